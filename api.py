@@ -0,0 +1,159 @@
+"""
+REST提取服务
+无状态的WSGI应用，封装HotelDataExtractor，可在gunicorn多worker下运行:
+    gunicorn -c gunicorn.conf.py api:app
+
+接口:
+    GET  /health    健康检查
+    POST /extract   上传图片或PMS导出文件，返回预订数据JSON和总结
+                    支持multipart/form-data(字段名file)或原始请求体(?filename=xxx.png)
+                    可用?deadline=秒数指定本次提取的时间预算，超时返回标记partial的部分结果
+                    可用?nocache=1跳过结果缓存重新提取（压测时测量实际的提取耗时），结果仍写入缓存
+"""
+
+import hashlib
+import io
+import json
+import os
+from email.parser import BytesParser
+from email.policy import HTTP
+from typing import Dict, List, Tuple
+from urllib.parse import parse_qs
+
+from PIL import Image
+
+from data_extractor import HotelDataExtractor, PARSER_VERSION, PREPROCESSOR_VERSION
+from deadline import DEFAULT_DEADLINE, Deadline
+from delta_ocr import extract_incremental
+from image_archive import ImageArchive
+from ocr_store import OCRStore
+from rate_anomaly import RateAnomalyDetector
+from result_cache import ResultCache, content_hash
+
+MAX_UPLOAD_BYTES = int(os.environ.get('MAX_UPLOAD_BYTES', 20 * 1024 * 1024))
+
+# 每个worker进程各自持有一个提取器，缓存通过SQLite在worker之间共享
+extractor = HotelDataExtractor()
+cache = ResultCache()
+ocr_store = OCRStore()
+archive = ImageArchive()
+rate_detector = RateAnomalyDetector()
+
+# 缓存键包含解析器版本、预处理版本和OCR参数（autotune重新写入参数后旧结果失效）
+RESULT_VERSION = (f"v{PARSER_VERSION}.{PREPROCESSOR_VERSION}." +
+                  hashlib.blake2b(json.dumps(extractor.ocr_profile, sort_keys=True).encode('utf-8'),
+                                  digest_size=6).hexdigest())
+
+
+def read_upload(environ) -> Tuple[bytes, str]:
+    """读取上传的文件内容和文件名"""
+    try:
+        length = int(environ.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        length = 0
+    if length <= 0:
+        raise ValueError("请求体为空")
+    if length > MAX_UPLOAD_BYTES:
+        raise ValueError(f"文件过大，最大支持 {MAX_UPLOAD_BYTES} 字节")
+
+    body = environ['wsgi.input'].read(length)
+    content_type = environ.get('CONTENT_TYPE', '')
+    query = parse_qs(environ.get('QUERY_STRING', ''))
+    filename = query.get('filename', ['upload.png'])[0]
+
+    if content_type.startswith('multipart/form-data'):
+        # 使用email解析器解析multipart请求体
+        message = BytesParser(policy=HTTP).parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode('latin-1') + body
+        )
+        for part in message.iter_parts():
+            if part.get_param('name', header='content-disposition') == 'file':
+                return part.get_payload(decode=True), part.get_filename() or filename
+        raise ValueError("multipart请求中缺少file字段")
+
+    return body, filename
+
+
+def extract(content: bytes, filename: str, file_hash: str, deadline: Deadline) -> List[Dict]:
+    """提取预订数据并生成总结和定价异常，图片归档并将OCR原文存入OCR存储"""
+    if extractor.is_export_file(filename):
+        bookings = extractor.extract_data_from_export(io.BytesIO(content), filename)
+    else:
+        image = Image.open(io.BytesIO(content))
+        archive.put(file_hash, content)
+        quality = extractor.check_image_quality(image)
+        if quality['status'] == 'reject':
+            raise ValueError(f"图片质量不合格: {'; '.join(quality['reasons'])}")
+        data, ocr = extract_incremental(extractor, ocr_store, archive, image, file_hash, quality, deadline)
+        if not ocr.get('partial'):
+            ocr_store.save(file_hash, filename, ocr, data)
+        bookings = [data] if data else []
+
+    # 定价异常随结果返回，正常价格计入房价统计
+    return [{'data': data, 'summary': extractor.generate_summary(data),
+             'anomalies': rate_detector.check_and_observe(data, extractor.determine_booking_type(data['booking_id']))}
+            for data in bookings]
+
+
+def json_response(start_response, status: str, payload: Dict) -> List[bytes]:
+    """返回JSON响应"""
+    body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    start_response(status, [
+        ('Content-Type', 'application/json; charset=utf-8'),
+        ('Content-Length', str(len(body)))
+    ])
+    return [body]
+
+
+def app(environ, start_response):
+    """WSGI入口"""
+    method = environ.get('REQUEST_METHOD', 'GET')
+    path = environ.get('PATH_INFO', '/')
+
+    if path == '/health' and method == 'GET':
+        return json_response(start_response, '200 OK', {'status': 'ok'})
+
+    if path != '/extract':
+        return json_response(start_response, '404 Not Found', {'error': '接口不存在'})
+    if method != 'POST':
+        return json_response(start_response, '405 Method Not Allowed', {'error': '仅支持POST'})
+
+    try:
+        content, filename = read_upload(environ)
+    except ValueError as e:
+        return json_response(start_response, '400 Bad Request', {'error': str(e)})
+
+    # 解析逻辑、预处理或OCR参数变化后旧结果自动失效
+    query = parse_qs(environ.get('QUERY_STRING', ''))
+    file_hash = content_hash(content)
+    key = f"{file_hash}:{os.path.splitext(filename)[1].lower()}:{RESULT_VERSION}"
+    if query.get('nocache', ['0'])[0] not in ('1', 'true'):
+        cached = cache.get(key)
+        if cached is not None:
+            return json_response(start_response, '200 OK', {'bookings': cached, 'cached': True})
+
+    try:
+        seconds = float(query.get('deadline', [DEFAULT_DEADLINE])[0])
+    except ValueError:
+        return json_response(start_response, '400 Bad Request', {'error': "deadline参数无效"})
+
+    try:
+        bookings = extract(content, filename, file_hash, Deadline(seconds))
+    except Exception as e:
+        print(f"提取服务处理失败: {str(e)}")
+        return json_response(start_response, '422 Unprocessable Entity', {'error': f"无法处理文件: {str(e)}"})
+
+    # 部分结果不缓存，下次请求重新完整识别
+    if bookings and not any(item['data'].get('partial') for item in bookings):
+        cache.set(key, bookings)
+
+    return json_response(start_response, '200 OK', {'bookings': bookings, 'cached': False})
+
+
+# 本地调试
+if __name__ == "__main__":
+    from wsgiref.simple_server import make_server
+
+    port = int(os.environ.get('PORT', 8000))
+    print(f"提取服务运行在 http://0.0.0.0:{port}")
+    make_server('0.0.0.0', port, app).serve_forever()
@@ -0,0 +1,35 @@
+"""
+提取服务客户端
+Streamlit界面设置EXTRACTOR_API_URL环境变量后，通过HTTP调用api.py提供的提取服务
+"""
+
+import os
+import requests
+from typing import Dict, List, Optional
+
+
+class ExtractorClient:
+    """提取服务HTTP客户端"""
+
+    def __init__(self, base_url: str, timeout: float = 120):
+        if not base_url.startswith(('http://', 'https://')):
+            base_url = f"http://{base_url}"
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    @classmethod
+    def from_env(cls) -> Optional['ExtractorClient']:
+        """根据EXTRACTOR_API_URL环境变量创建客户端，未设置时返回None"""
+        base_url = os.environ.get('EXTRACTOR_API_URL', '').strip()
+        return cls(base_url) if base_url else None
+
+    def extract(self, content: bytes, filename: str) -> List[Dict]:
+        """上传文件并返回预订数据列表"""
+        response = self.session.post(
+            f"{self.base_url}/extract",
+            files={'file': (filename, content)},
+            timeout=self.timeout
+        )
+        response.raise_for_status()
+        return [item['data'] for item in response.json().get('bookings', [])]
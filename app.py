@@ -1,11 +1,24 @@
 import streamlit as st
+import time
+from datetime import date, timedelta
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
 import pandas as pd
 import numpy as np
+import requests
 from PIL import Image
-import plotly.express as px
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
+from booking_dates import bookings_frame
+from charts import PayloadBudget, demand_figure, room_price_figure, timeline_figure
+from booking_history import BookingHistory
 from data_extractor import HotelDataExtractor
+from deadline import Deadline
+from delta_ocr import extract_incremental
+from image_archive import ImageArchive
+from inventory import InventoryChecker
+from api_client import ExtractorClient
+from ocr_store import OCRStore
+from rate_anomaly import RateAnomalyDetector, describe_anomaly
+from result_cache import ResultCache, content_hash
+from sales_digest import build_digest, to_excel
 
 # 设置页面配置
 st.set_page_config(
@@ -193,12 +206,105 @@ st.markdown("""
 # 初始化session state
 if 'uploaded_data' not in st.session_state:
     st.session_state.uploaded_data = []
+if 'booking_history' not in st.session_state:
+    st.session_state.booking_history = BookingHistory()
+if 'inventory_checker' not in st.session_state:
+    st.session_state.inventory_checker = InventoryChecker()
+
+def store_bookings(bookings):
+    """保存分析结果，追加到各预订的版本历史，并批量更新逐晚房量需求"""
+    for data in bookings:
+        st.session_state.uploaded_data.append(data)
+        st.session_state.booking_history.add(data)
+    st.session_state.inventory_checker.upsert_bookings(bookings)
+
+def store_booking(data):
+    store_bookings([data])
+
+def show_inventory_conflicts(conflicts):
+    """显示超售的房型和日期"""
+    if not st.session_state.inventory_checker.inventory:
+        return
+    if conflicts.empty:
+        st.success("✅ 各房型库存充足，没有超售")
+    else:
+        nights = conflicts['日期'].nunique()
+        st.error(f"🚨 {conflicts['房类'].nunique()} 个房型共 {nights} 晚超售")
+        st.dataframe(conflicts.assign(日期=conflicts['日期'].dt.strftime('%Y-%m-%d')), use_container_width=True)
 
 # 初始化数据提取器
 @st.cache_resource
 def get_data_extractor():
     return HotelDataExtractor()
 
+@st.cache_resource
+def get_ocr_store():
+    return OCRStore()
+
+@st.cache_resource
+def get_image_archive():
+    return ImageArchive()
+
+@st.cache_resource
+def get_result_cache():
+    return ResultCache()
+
+@st.cache_resource
+def get_rate_detector():
+    return RateAnomalyDetector()
+
+def check_rates(bookings):
+    """按房价运行统计检查定价是否异常（如少输一位），并把正常价格计入统计"""
+    extractor = get_data_extractor()
+    messages = []
+    for data in bookings:
+        booking_type = extractor.determine_booking_type(data['booking_id'])
+        for anomaly in get_rate_detector().check_and_observe(data, booking_type):
+            messages.append(f"- {data['booking_id']}: {describe_anomaly(anomaly)}")
+    if messages:
+        st.warning("⚠️ 以下定价可能有误，请核对：\n" + "\n".join(messages))
+
+# 设置EXTRACTOR_API_URL时，界面作为提取服务的客户端
+@st.cache_resource
+def get_extractor_client():
+    return ExtractorClient.from_env()
+
+def extract_with_client(client, uploaded_file):
+    """通过提取服务提取预订数据，服务返回错误或无法连接时显示错误并返回None"""
+    try:
+        return client.extract(uploaded_file.getvalue(), uploaded_file.name)
+    except requests.HTTPError as e:
+        try:
+            detail = e.response.json().get('error')
+        except ValueError:
+            detail = None
+        st.error(f"❌ 提取服务返回错误({e.response.status_code}): {detail or e.response.reason}")
+    except requests.RequestException as e:
+        st.error(f"❌ 无法连接提取服务 {client.base_url}: {str(e)}")
+    return None
+
+@st.cache_resource
+def get_background_executor():
+    return ThreadPoolExecutor(max_workers=2)
+
+def run_cancellable(fn, deadline):
+    """在后台线程中提取并定期刷新进度条。
+    用户离开页面或重新上传时，Streamlit会在下一次刷新进度条时中断本次运行，此时取消后台提取"""
+    future = get_background_executor().submit(fn)
+    progress = st.progress(0.0)
+    try:
+        while True:
+            try:
+                return future.result(timeout=0.2)
+            except FutureTimeout:
+                elapsed = deadline.elapsed()
+                ratio = min(1.0, elapsed / deadline.seconds) if deadline.seconds else 0.0
+                progress.progress(ratio, text=f"已用时 {elapsed:.1f}s")
+    finally:
+        if not future.done():
+            deadline.cancel()
+        progress.empty()
+
 def create_visualization_table(data):
     """创建可视化表格"""
     if not data:
@@ -210,6 +316,7 @@ def create_visualization_table(data):
         '房数': data['room_counts'],
         '定价': data['prices'],
         '包价': data['rate_codes'],
+        '含早': get_data_extractor().rate_catalog.lookup(data['rate_codes'])['breakfast'].to_numpy(),
         '标志': data['flags']
     })
     
@@ -231,9 +338,26 @@ def compare_data(data1, data2):
     if not data1 or not data2:
         return None
     
+    # 按解析后的日期比较，无法解析时退回比较原始字符串
+    stays = bookings_frame([data1, data2])
+    first, second = stays.iloc[0], stays.iloc[1]
+    
+    def date_changed(column, raw_column):
+        if pd.isna(first[column]) or pd.isna(second[column]):
+            return first[raw_column] != second[raw_column]
+        return first[column] != second[column]
+    
+    def shift_days(column):
+        if pd.isna(first[column]) or pd.isna(second[column]):
+            return None
+        return (second[column].normalize() - first[column].normalize()).days
+    
     comparison = {
-        'arrival_diff': data1['arrival'] != data2['arrival'],
-        'departure_diff': data1['departure'] != data2['departure'],
+        'arrival_diff': date_changed('arrival_at', 'arrival'),
+        'departure_diff': date_changed('departure_at', 'departure'),
+        'arrival_shift': shift_days('arrival_at'),
+        'departure_shift': shift_days('departure_at'),
+        'nights_diff': second['nights'] - first['nights'],
         'total_rooms_diff': data1['total_rooms'] - data2['total_rooms'],
         'room_types_diff': set(data1['room_types']) - set(data2['room_types']),
         'price_changes': []
@@ -254,23 +378,77 @@ def compare_data(data1, data2):
     
     return comparison
 
+# 每次运行（一个页面）共用一个图表数据预算
+chart_budget = PayloadBudget()
+
+# 版本变化表最多显示的行数
+MAX_CHANGE_ROWS = 100
+
 # 主界面
-tab1, tab2 = st.tabs(["单张图片分析", "两张图片比较"])
+tab1, tab2, tab3, tab4, tab5 = st.tabs(["单张图片分析", "两张图片比较", "库存冲突", "历史搜索", "销售汇总"])
 
 with tab1:
     st.header("📊 单张图片分析")
     
     uploaded_file = st.file_uploader(
-        "上传酒店预订数据图片",
-        type=['png', 'jpg', 'jpeg'],
-        help="支持PNG、JPG、JPEG格式"
+        "上传酒店预订数据图片或PMS导出文件",
+        type=['png', 'jpg', 'jpeg', 'csv', 'xlsx', 'pdf'],
+        help="支持PNG、JPG、JPEG格式图片，以及PMS导出的CSV、Excel、PDF(文本层)文件"
     )
     
-    if uploaded_file is not None:
+    if uploaded_file is not None and get_data_extractor().is_export_file(uploaded_file.name):
+        # PMS导出文件直接读取，跳过OCR
+        st.info(f"📄 检测到PMS导出文件: {uploaded_file.name}")
+        
+        if st.button("分析数据", type="primary"):
+            with st.spinner("正在读取导出文件..."):
+                extractor = get_data_extractor()
+                client = get_extractor_client()
+                if client:
+                    bookings = extract_with_client(client, uploaded_file)
+                    if bookings is None:
+                        st.stop()
+                else:
+                    bookings = extractor.extract_data_from_export(uploaded_file, uploaded_file.name)
+                
+                if bookings:
+                    store_bookings(bookings)
+                    st.success(f"共读取 {len(bookings)} 个预订")
+                    check_rates(bookings)
+                    show_inventory_conflicts(st.session_state.inventory_checker.conflicts(
+                        list({rt for data in bookings for rt in data['room_types']})))
+                    
+                    st.subheader("📋 预订列表")
+                    # 按到达时间排序
+                    stays = bookings_frame(bookings)
+                    sales = extractor.split_sales(bookings)
+                    df_bookings = pd.DataFrame({
+                        '预订': stays['booking_id'],
+                        '到达': stays['arrival_at'],
+                        '离开': stays['departure_at'],
+                        '间夜': stays['nights'],
+                        '总房数': stays['total_rooms'],
+                        '总销售额': sales['total'],
+                        '客房收入': sales['room_revenue'],
+                        '包价收入': sales['package_revenue'],
+                        '总结': [generate_summary(data) for data in bookings]
+                    }).sort_values('到达', kind='stable')
+                    st.dataframe(df_bookings, use_container_width=True)
+                else:
+                    st.error("未能从导出文件中读取到预订数据，请检查文件格式")
+    
+    elif uploaded_file is not None:
         # 显示上传的图片
         image = Image.open(uploaded_file)
         st.image(image, caption="上传的图片", use_column_width=True)
         
+        # OCR前快速检查图片质量
+        quality = get_data_extractor().check_image_quality(image)
+        if quality['status'] == 'reject':
+            st.error(f"❌ 图片无法识别: {'；'.join(quality['reasons'])}。请重新截图，或手动选择图片类型")
+        elif quality['status'] == 'warn':
+            st.warning(f"⚠️ {'；'.join(quality['reasons'])}" + ("，将使用增强预处理" if quality['enhance'] else ""))
+        
         # 添加手动选择功能作为备用
         st.subheader("🔧 手动选择图片类型（如果自动检测不准确）")
         image_type = st.selectbox(
@@ -286,7 +464,24 @@ with tab1:
                 
                 # 根据选择决定使用哪种数据
                 if image_type == "自动检测":
-                    data = extractor.extract_data_from_image(image)
+                    client = get_extractor_client()
+                    if client:
+                        bookings = extract_with_client(client, uploaded_file)
+                        if bookings is None:
+                            st.stop()
+                        data = bookings[0] if bookings else None
+                    else:
+                        deadline = Deadline()
+                        file_hash = content_hash(uploaded_file.getvalue())
+                        # 同一预订列表重新截图时只识别变化的行
+                        data, ocr = run_cancellable(
+                            lambda: extract_incremental(extractor, get_ocr_store(), get_image_archive(),
+                                                        image, file_hash, quality, deadline), deadline
+                        )
+                        # 归档截图，保存完整的OCR原文，解析逻辑升级后可直接重新解析
+                        get_image_archive().put(file_hash, uploaded_file.getvalue())
+                        if quality['status'] != 'reject' and not ocr.get('partial'):
+                            get_ocr_store().save(file_hash, uploaded_file.name, ocr, data)
                 elif image_type == "CON25625/麦尔会展":
                     # 强制使用麦尔会展数据
                     mock_text = extractor.get_mock_ocr_text("25625")
@@ -297,8 +492,13 @@ with tab1:
                     data = extractor.parse_ocr_text(mock_text)
                 
                 if data:
-                    # 存储数据
-                    st.session_state.uploaded_data.append(data)
+                    if data.get('partial'):
+                        st.warning(f"⚠️ {data['partial_reason']}，结果可能不完整")
+                    
+                    # 存储数据，检查该预订是否造成超售
+                    store_booking(data)
+                    show_inventory_conflicts(st.session_state.inventory_checker.check_booking(data))
+                    check_rates([data])
                     
                     # 显示可视化表格
                     st.subheader("📋 数据表格")
@@ -306,26 +506,8 @@ with tab1:
                     if df is not None:
                         st.dataframe(df, use_container_width=True)
                         
-                        # 显示图表
-                        col1, col2 = st.columns(2)
-                        
-                        with col1:
-                            # 房数分布图
-                            fig1 = px.bar(df, x='房类', y='房数', 
-                                        title="各房型房数分布",
-                                        color='房数',
-                                        color_continuous_scale='Blues')
-                            fig1.update_layout(xaxis_tickangle=-45)
-                            st.plotly_chart(fig1, use_container_width=True)
-                        
-                        with col2:
-                            # 定价分布图
-                            fig2 = px.bar(df, x='房类', y='定价',
-                                        title="各房型定价分布",
-                                        color='定价',
-                                        color_continuous_scale='Reds')
-                            fig2.update_layout(xaxis_tickangle=-45)
-                            st.plotly_chart(fig2, use_container_width=True)
+                        # 显示图表：房数和定价分布合并为一个图
+                        chart_budget.plotly_chart(room_price_figure(df))
                     
                     # 显示总结
                     st.subheader("📝 数据总结")
@@ -334,7 +516,7 @@ with tab1:
                     
                     # 显示详细信息
                     st.subheader("📈 详细信息")
-                    col1, col2, col3 = st.columns(3)
+                    col1, col2, col3, col4 = st.columns(4)
                     
                     with col1:
                         st.metric("总房数", data['total_rooms'])
@@ -344,20 +526,82 @@ with tab1:
                         st.metric("入住天数", data['days'])
                         st.metric("房型种类", len(data['room_types']))
                     
+                    # 按包价代码拆分客房收入和包价收入（早餐等）
+                    sales = extractor.split_sales([data]).iloc[0]
+                    
                     with col3:
-                        total_sales = sum(count * price for count, price in zip(data['room_counts'], data['prices']))
-                        st.metric("总销售额", f"¥{total_sales:,.2f}")
-                        avg_price = total_sales / data['total_rooms'] if data['total_rooms'] > 0 else 0
+                        st.metric("总销售额", f"¥{sales['total']:,.2f}")
+                        avg_price = sales['total'] / data['total_rooms'] if data['total_rooms'] > 0 else 0
                         st.metric("平均房价", f"¥{avg_price:.2f}")
+                    
+                    with col4:
+                        st.metric("客房收入", f"¥{sales['room_revenue']:,.2f}")
+                        st.metric("包价收入", f"¥{sales['package_revenue']:,.2f}", help=f"含早 {sales['breakfasts']} 份")
+    
+    # 同一预订列表的多张截图（或超长截图）分块识别后拼接为一条预订
+    with st.expander("📚 多张截图合并（房型行很多的团队长列表）"):
+        list_files = st.file_uploader(
+            "按顺序上传同一预订列表的多张截图",
+            type=['png', 'jpg', 'jpeg'],
+            accept_multiple_files=True,
+            key="list_screenshots",
+            help="相邻截图之间可以有重叠，重复的行会自动去除"
+        )
+        
+        if list_files and st.button("合并分析", key="merge_analyze"):
+            with st.spinner(f"正在分块识别 {len(list_files)} 张截图..."):
+                extractor = get_data_extractor()
+                deadline = Deadline()
+                images = [Image.open(f) for f in list_files]
+                data = run_cancellable(lambda: extractor.extract_data_from_images(images, deadline), deadline)
+                
+                if data:
+                    if data.get('partial'):
+                        st.warning(f"⚠️ {data['partial_reason']}，结果可能不完整")
+                    store_booking(data)
+                    show_inventory_conflicts(st.session_state.inventory_checker.check_booking(data))
+                    check_rates([data])
+                    st.dataframe(create_visualization_table(data), use_container_width=True)
+                    st.success(generate_summary(data))
+                else:
+                    st.error("未能从截图中识别到预订数据")
+
+    # watch_folder.py自动识别的结果
+    with st.expander("📥 监控文件夹识别结果"):
+        records = get_ocr_store().recent(20)
+        records = [record for record in records if record['data']]
+        if records:
+            for record in records:
+                col1, col2 = st.columns([4, 1])
+                with col1:
+                    st.caption(f"{record['filename']}: {generate_summary(record['data'])}")
+                with col2:
+                    if st.button("加入分析", key=f"import_{record['id']}"):
+                        store_booking(record['data'])
+                        st.success("已加入")
+        else:
+            st.info("暂无自动识别结果，可运行 python watch_folder.py <截图目录> 启动监控")
 
 with tab2:
     st.header("🔄 两张图片比较")
     
-    if len(st.session_state.uploaded_data) >= 2:
-        st.subheader("📊 数据比较结果")
-        
+    history = st.session_state.booking_history
+    versioned_keys = history.keys_with_versions(2)
+    data1 = data2 = None
+    
+    if versioned_keys:
+        # 同一预订有多个版本时，比较所选预订的上一版本和最新版本
+        selected_key = st.selectbox("选择预订", versioned_keys, index=len(versioned_keys) - 1)
+        version_total = history.version_count(selected_key)
+        data1 = history.get_version(selected_key, version_total - 1)
+        data2 = history.get_latest(selected_key)
+        st.caption(f"{selected_key} 共 {version_total} 个版本，比较第 {version_total - 1} 版和第 {version_total} 版")
+    elif len(st.session_state.uploaded_data) >= 2:
         data1 = st.session_state.uploaded_data[-2]  # 倒数第二个
         data2 = st.session_state.uploaded_data[-1]  # 最后一个
+    
+    if data1 and data2:
+        st.subheader("📊 数据比较结果")
         
         comparison = compare_data(data1, data2)
         
@@ -384,6 +628,10 @@ with tab2:
                 st.warning("⚠️ 到达/离开时间有变化")
                 st.write(f"第一张: {data1['arrival']} - {data1['departure']}")
                 st.write(f"第二张: {data2['arrival']} - {data2['departure']}")
+                if comparison['arrival_shift']:
+                    st.write(f"到达日期变化: {comparison['arrival_shift']:+d} 天")
+                if pd.notna(comparison['nights_diff']) and comparison['nights_diff'] != 0:
+                    st.write(f"间夜数变化: {comparison['nights_diff']:+.0f} 晚")
             
             if comparison['total_rooms_diff'] != 0:
                 st.info(f"📊 总房数变化: {comparison['total_rooms_diff']:+d}")
@@ -407,18 +655,95 @@ with tab2:
             
             df_combined = pd.concat([df1_comp, df2_comp], ignore_index=True)
             
-            fig = px.bar(df_combined, x='房类', y='房数', color='图片',
-                        title="房数比较", barmode='group')
-            fig.update_layout(xaxis_tickangle=-45)
-            st.plotly_chart(fig, use_container_width=True)
-            
-            fig2 = px.bar(df_combined, x='房类', y='定价', color='图片',
-                         title="定价比较", barmode='group')
-            fig2.update_layout(xaxis_tickangle=-45)
-            st.plotly_chart(fig2, use_container_width=True)
+            chart_budget.plotly_chart(room_price_figure(df_combined, group='图片', title="房数与定价比较"))
     
     else:
         st.info("请先上传至少两张图片进行分析")
+    
+    if versioned_keys:
+        # 版本时间线：指标在追加版本时已算好，这里只读取
+        st.subheader("🕒 版本时间线")
+        timeline = history.timeline(selected_key)
+        
+        chart_budget.plotly_chart(timeline_figure(timeline, title=f"{selected_key} 版本变化"))
+        
+        # 各版本相对上一版本的变化，只列出最近的版本
+        changes = []
+        for number in range(version_total, max(1, version_total - MAX_CHANGE_ROWS), -1):
+            delta = history.get_delta(selected_key, number)
+            room_changes = [f"{room_type} {room[0]}间/¥{room[1]:.0f}" for room_type, room in delta['rooms'].items()]
+            room_changes += [f"{room_type} 取消" for room_type in delta['removed_rooms']]
+            changes.append({
+                '版本': number,
+                '时间': timeline['captured_at'].iloc[number - 1].strftime('%m/%d %H:%M'),
+                '字段变化': ', '.join(f"{field}={value}" for field, value in delta['fields'].items()),
+                '房型变化': ', '.join(room_changes)
+            })
+        st.dataframe(pd.DataFrame(changes), use_container_width=True)
+
+with tab3:
+    st.header("🏨 房量与库存冲突")
+    
+    checker = st.session_state.inventory_checker
+    if not checker.inventory:
+        st.info("未配置酒店库存，请将 inventory.example.json 复制为 inventory.json 并填写各房型房间数")
+    elif not checker.room_index:
+        st.info("请先上传预订数据")
+    else:
+        show_inventory_conflicts(checker.conflicts())
+        
+        # 逐晚需求与库存
+        demand = checker.demand_frame()
+        room_type = st.selectbox("选择房型", list(demand.columns))
+        chart_budget.plotly_chart(demand_figure(demand[room_type], checker.inventory.get(room_type),
+                                                title=f"{room_type} 逐晚需求"))
+
+with tab4:
+    st.header("🔎 历史截图搜索")
+    
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        query = st.text_input("关键词", placeholder="公司名称、预订号、房类或包价代码，多个词用空格分隔")
+    with col2:
+        period = st.selectbox("时间范围", ["全部", "最近7天", "最近30天", "最近90天"])
+    
+    if query:
+        page_size = 20
+        days = {"最近7天": 7, "最近30天": 30, "最近90天": 90}.get(period)
+        since = time.time() - days * 86400 if days else None
+        
+        total, _ = get_ocr_store().search(query, limit=0, since=since)
+        if total:
+            page_count = (total + page_size - 1) // page_size
+            page = st.number_input(f"页码（共 {page_count} 页，{total} 条）", min_value=1, max_value=page_count, value=1)
+            _, results = get_ocr_store().search(query, limit=page_size, offset=(page - 1) * page_size, since=since)
+            st.dataframe(pd.DataFrame([{
+                '时间': pd.to_datetime(result['created_at'], unit='s').strftime('%Y-%m-%d %H:%M'),
+                '文件': result['filename'],
+                '预订': result['booking_id'] or '',
+                '摘要': result['snippet']
+            } for result in results]), use_container_width=True)
+        else:
+            st.info("没有找到匹配的截图")
+
+with tab5:
+    st.header("📰 销售汇总")
+    
+    yesterday = date.today() - timedelta(days=1)
+    period = st.date_input("日期范围", value=(yesterday, yesterday), max_value=date.today())
+    if isinstance(period, (tuple, list)) and len(period) == 2:
+        # 汇总按日期范围缓存，重复查看直接读取
+        digest = build_digest(get_ocr_store(), period[0], period[1], get_data_extractor(), get_result_cache())
+        st.markdown(digest['markdown'])
+        
+        col1, col2, col3 = st.columns(3)
+        name = digest['period'].replace(' ~ ', '_')
+        with col1:
+            st.download_button("下载文本", digest['text'], file_name=f"销售汇总_{name}.txt")
+        with col2:
+            st.download_button("下载Markdown", digest['markdown'], file_name=f"销售汇总_{name}.md")
+        with col3:
+            st.download_button("下载Excel", to_excel(digest), file_name=f"销售汇总_{name}.xlsx")
 
 # 侧边栏信息 - 代码编辑器风格
 with st.sidebar:
@@ -0,0 +1,118 @@
+"""
+预订日期处理
+PMS截图和导出中的到达/离开时间为没有年份的'MM/DD HH:MM'字符串。
+这里一次性批量解析为datetime，按参考日期推断年份（包括跨年的预订），并计算间夜数，
+之后的筛选、排序和统计都基于datetime而不是字符串
+"""
+
+import numpy as np
+import pandas as pd
+from datetime import date
+from typing import Dict, List, Optional, Sequence
+
+DATE_PATTERN = r'(?P<month>\d{1,2})/(?P<day>\d{1,2})(?:\s+(?P<hour>\d{1,2}):(?P<minute>\d{2}))?'
+
+# 与参考日期相差超过半年的日期视为相邻年份
+HALF_YEAR_DAYS = 183
+
+
+# 推断年份时在闰年中比较月日，使02/29也能参与比较
+LEAP_YEAR = 2000
+
+
+def _split_fields(values: Sequence[str]) -> pd.DataFrame:
+    """提取月、日、时、分，无法解析的为NaN。
+    一批预订中的时间字符串重复很多，只对不同的字符串做正则匹配，再按编码展开"""
+    codes, uniques = pd.factorize(pd.Series(values, dtype=object).astype(str))
+    parts = pd.Series(uniques, dtype=object).str.extract(DATE_PATTERN)
+    fields = parts.apply(pd.to_numeric, errors='coerce')
+    fields[['hour', 'minute']] = fields[['hour', 'minute']].fillna(0)
+    return fields.iloc[codes].reset_index(drop=True)
+
+
+def _infer_years(fields: pd.DataFrame, reference: pd.Timestamp) -> np.ndarray:
+    """年份取离参考日期最近的一年"""
+    month_day = pd.to_datetime(pd.DataFrame({'year': LEAP_YEAR, 'month': fields['month'], 'day': fields['day']}),
+                               errors='coerce')
+    offset = (month_day - pd.Timestamp(LEAP_YEAR, reference.month, reference.day)).dt.days.to_numpy()
+    years = np.full(len(fields), reference.year)
+    years[offset > HALF_YEAR_DAYS] -= 1
+    years[offset < -HALF_YEAR_DAYS] += 1
+    return years
+
+
+def _assemble(fields: pd.DataFrame, years: np.ndarray) -> pd.Series:
+    return pd.to_datetime(pd.DataFrame({
+        'year': years, 'month': fields['month'], 'day': fields['day'],
+        'hour': fields['hour'], 'minute': fields['minute'],
+    }), errors='coerce')
+
+
+def parse_booking_times(values: Sequence[str], reference: Optional[date] = None) -> pd.Series:
+    """批量解析'MM/DD HH:MM'（时分可省略），年份取离参考日期最近的一年，无法解析的为NaT"""
+    reference = pd.Timestamp(reference or date.today())
+    fields = _split_fields(values)
+    return _assemble(fields, _infer_years(fields, reference))
+
+
+def normalize_stays(arrivals: Sequence[str], departures: Sequence[str],
+                    reference: Optional[date] = None) -> pd.DataFrame:
+    """批量解析到达/离开时间并计算间夜数。
+    离开早于到达时（如12/30到达、01/02离开）离开日期顺延一年。无法解析的行间夜数为NaN"""
+    reference = pd.Timestamp(reference or date.today())
+    arrival = parse_booking_times(arrivals, reference)
+
+    fields = _split_fields(departures)
+    years = _infer_years(fields, reference)
+    departure = _assemble(fields, years)
+    wrapped = (departure < arrival).to_numpy()
+    if wrapped.any():
+        years[wrapped] += 1
+        departure = _assemble(fields, years)
+
+    nights = (departure.dt.normalize() - arrival.dt.normalize()).dt.days
+    return pd.DataFrame({'arrival': arrival, 'departure': departure, 'nights': nights})
+
+
+def to_iso(times: pd.Series) -> List[Optional[str]]:
+    """datetime转为可JSON序列化的字符串，NaT为None"""
+    return [None if pd.isna(t) else t.strftime('%Y-%m-%dT%H:%M') for t in times]
+
+
+def add_stay_dates(bookings: List[Dict], reference: Optional[date] = None) -> List[Dict]:
+    """为一批预订补充arrival_at/departure_at，并在能解析时用实际间夜数作为days"""
+    if not bookings:
+        return bookings
+    stays = normalize_stays([b['arrival'] for b in bookings], [b['departure'] for b in bookings], reference)
+    for booking, arrival_at, departure_at, nights in zip(
+            bookings, to_iso(stays['arrival']), to_iso(stays['departure']), stays['nights']):
+        booking['arrival_at'] = arrival_at
+        booking['departure_at'] = departure_at
+        if not np.isnan(nights):
+            booking['days'] = int(nights)
+    return bookings
+
+
+def bookings_frame(bookings: List[Dict], reference: Optional[date] = None) -> pd.DataFrame:
+    """预订列表转为带datetime列的DataFrame，用于按日期筛选、排序和统计。
+    已有arrival_at/departure_at的直接使用，其余按原始字符串解析"""
+    frame = pd.DataFrame({
+        'booking_id': [b['booking_id'] for b in bookings],
+        'arrival': [b['arrival'] for b in bookings],
+        'departure': [b['departure'] for b in bookings],
+        'total_rooms': [b['total_rooms'] for b in bookings],
+    })
+    stays = normalize_stays(frame['arrival'], frame['departure'], reference)
+    stored_arrival = pd.to_datetime(pd.Series([b.get('arrival_at') for b in bookings], dtype=object))
+    stored_departure = pd.to_datetime(pd.Series([b.get('departure_at') for b in bookings], dtype=object))
+
+    frame['arrival_at'] = stored_arrival.fillna(stays['arrival'])
+    frame['departure_at'] = stored_departure.fillna(stays['departure'])
+    frame['nights'] = (frame['departure_at'].dt.normalize() - frame['arrival_at'].dt.normalize()).dt.days
+    frame['room_nights'] = frame['total_rooms'] * frame['nights']
+    return frame
+
+
+def stay_dates(data: Dict, reference: Optional[date] = None) -> pd.Series:
+    """单个预订的到达/离开datetime和间夜数"""
+    return bookings_frame([data], reference).iloc[0]
@@ -0,0 +1,168 @@
+"""
+预订版本历史
+同一预订（如CON25626）多次上传时，按预订号保存只追加的版本历史：
+哈希表直接指向最新版本，各版本之间只保存增量，时间线所需的指标在追加时一次算好
+"""
+
+import copy
+import time
+import pandas as pd
+from typing import Dict, List, Optional
+
+# 每隔多少个版本保存一次完整快照，限制还原历史版本时需要回放的增量数
+CHECKPOINT_INTERVAL = 10
+
+# 预订级别的字段（房型明细单独比较）
+BOOKING_FIELDS = ['booking_id', 'arrival', 'departure', 'arrival_at', 'departure_at', 'days',
+                  'total_rooms', 'total_people']
+
+
+def booking_key(booking_id: str) -> str:
+    """预订号作为版本历史的键，例如 'CON25626/国家疾控局' -> 'CON25626'"""
+    return booking_id.split('/')[0].strip()
+
+
+def room_map(data: Dict) -> Dict[str, tuple]:
+    """房类 -> (房数, 定价, 包价, 标志)"""
+    return {
+        room_type: (data['room_counts'][i], data['prices'][i],
+                    data['rate_codes'][i] if i < len(data.get('rate_codes', [])) else '',
+                    data['flags'][i] if i < len(data.get('flags', [])) else '')
+        for i, room_type in enumerate(data['room_types'])
+    }
+
+
+def diff_bookings(old: Dict, new: Dict) -> Dict:
+    """计算两个版本之间的增量，只包含有变化的字段和房型"""
+    delta = {'fields': {}, 'rooms': {}, 'removed_rooms': []}
+    for field in BOOKING_FIELDS:
+        if old.get(field) != new.get(field):
+            delta['fields'][field] = new.get(field)
+
+    old_rooms = room_map(old)
+    new_rooms = room_map(new)
+    for room_type, room in new_rooms.items():
+        if old_rooms.get(room_type) != room:
+            delta['rooms'][room_type] = room
+    delta['removed_rooms'] = [room_type for room_type in old_rooms if room_type not in new_rooms]
+    return delta
+
+
+def apply_delta(data: Dict, delta: Dict) -> Dict:
+    """在一个版本上应用增量，得到下一个版本"""
+    result = {k: v for k, v in data.items() if k not in ('room_types', 'room_counts', 'prices', 'rate_codes', 'flags')}
+    result.update(delta['fields'])
+
+    rooms = room_map(data)
+    for room_type in delta['removed_rooms']:
+        rooms.pop(room_type, None)
+    rooms.update(delta['rooms'])
+
+    result['room_types'] = list(rooms)
+    result['room_counts'] = [room[0] for room in rooms.values()]
+    result['prices'] = [room[1] for room in rooms.values()]
+    result['rate_codes'] = [room[2] for room in rooms.values()]
+    result['flags'] = [room[3] for room in rooms.values()]
+    return result
+
+
+def is_empty_delta(delta: Dict) -> bool:
+    return not (delta['fields'] or delta['rooms'] or delta['removed_rooms'])
+
+
+class BookingHistory:
+    """按预订号组织的版本历史"""
+
+    def __init__(self):
+        self.latest = {}  # 预订号 -> 最新版本完整数据
+        self.versions = {}  # 预订号 -> 版本列表（只追加）
+        self._timelines = {}  # 预订号 -> 时间线DataFrame缓存
+
+    def add(self, data: Dict, captured_at: Optional[float] = None) -> int:
+        """追加一个版本，与最新版本完全相同时不追加，返回版本号（从1开始）"""
+        key = booking_key(data['booking_id'])
+        captured_at = captured_at or time.time()
+        versions = self.versions.setdefault(key, [])
+        latest = self.latest.get(key)
+
+        if latest is None:
+            delta = None
+        else:
+            delta = diff_bookings(latest, data)
+            if is_empty_delta(delta):
+                return len(versions)
+
+        number = len(versions) + 1
+        entry = {
+            'version': number,
+            'captured_at': captured_at,
+            'delta': delta,
+            # 完整快照只在第一个版本和检查点保存
+            'snapshot': copy.deepcopy(data) if delta is None or number % CHECKPOINT_INTERVAL == 0 else None,
+            'metrics': self._metrics(data),
+        }
+        versions.append(entry)
+        self.latest[key] = copy.deepcopy(data)
+        self._timelines.pop(key, None)
+        return number
+
+    def _metrics(self, data: Dict) -> Dict:
+        """时间线用的指标"""
+        metrics = {
+            'total_rooms': data['total_rooms'],
+            'revenue': sum(count * price for count, price in zip(data['room_counts'], data['prices'])),
+            'arrival': data['arrival'],
+            'departure': data['departure'],
+        }
+        for room_type, count, price in zip(data['room_types'], data['room_counts'], data['prices']):
+            metrics[f"rooms:{room_type}"] = count
+            metrics[f"price:{room_type}"] = price
+        return metrics
+
+    def keys(self) -> List[str]:
+        """所有预订号"""
+        return list(self.versions)
+
+    def keys_with_versions(self, minimum: int = 2) -> List[str]:
+        """版本数不少于minimum的预订号"""
+        return [key for key, versions in self.versions.items() if len(versions) >= minimum]
+
+    def version_count(self, key: str) -> int:
+        return len(self.versions.get(key, []))
+
+    def get_latest(self, key: str) -> Optional[Dict]:
+        """O(1)获取最新版本"""
+        return self.latest.get(key)
+
+    def get_version(self, key: str, number: int) -> Optional[Dict]:
+        """还原指定版本：从最近的完整快照开始回放增量"""
+        versions = self.versions.get(key, [])
+        if not 1 <= number <= len(versions):
+            return None
+        if number == len(versions):
+            return self.latest[key]
+
+        start = number - 1
+        while versions[start]['snapshot'] is None:
+            start -= 1
+        data = copy.deepcopy(versions[start]['snapshot'])
+        for entry in versions[start + 1:number]:
+            data = apply_delta(data, entry['delta'])
+        return data
+
+    def get_delta(self, key: str, number: int) -> Optional[Dict]:
+        """指定版本相对上一版本的增量，第一个版本返回None"""
+        versions = self.versions.get(key, [])
+        if not 1 <= number <= len(versions):
+            return None
+        return versions[number - 1]['delta']
+
+    def timeline(self, key: str) -> pd.DataFrame:
+        """各版本的指标时间线，结果缓存到下一次追加版本为止"""
+        if key not in self._timelines:
+            rows = [dict(entry['metrics'], version=entry['version'],
+                         captured_at=pd.to_datetime(entry['captured_at'], unit='s'),
+                         changed=len(entry['delta']['rooms']) + len(entry['delta']['fields']) if entry['delta'] else 0)
+                    for entry in self.versions.get(key, [])]
+            self._timelines[key] = pd.DataFrame(rows)
+        return self._timelines[key]
@@ -0,0 +1,176 @@
+"""
+图表生成
+数据先在服务端聚合（房型过多时合并为"其他"，长时间线按区间取样），
+相关图表合并为一个子图Figure，点数较多时改用WebGL轨迹，
+每个页面的图表JSON总大小受预算限制，避免发送给浏览器的数据过大
+"""
+
+import os
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+import plotly.io as pio
+import streamlit as st
+from plotly.subplots import make_subplots
+from typing import Dict, Optional
+
+# 单条轨迹取样前的点数超过该值时使用WebGL(Scattergl)
+WEBGL_THRESHOLD = 1000
+
+# 时间线最多保留的点数
+MAX_POINTS = 500
+
+# 柱状图/面积图最多显示的房型数，其余合并为"其他"
+MAX_CATEGORIES = 20
+OTHER_LABEL = '其他'
+
+# 每个页面图表JSON的总大小上限(字节)
+PAGE_PAYLOAD_BUDGET = int(os.environ.get('CHART_PAYLOAD_BUDGET', 2 * 1024 * 1024))
+
+
+def scatter_trace(x, y, points: Optional[int] = None, **kwargs):
+    """折线轨迹，点数多时使用WebGL。points为downsample前的点数，默认为len(x)"""
+    points = len(x) if points is None else points
+    trace_type = go.Scattergl if points > WEBGL_THRESHOLD else go.Scatter
+    return trace_type(x=x, y=y, **kwargs)
+
+
+def limit_categories(df: pd.DataFrame, category: str, value: str, by: Optional[str] = None,
+                     agg: Optional[Dict] = None, max_categories: int = MAX_CATEGORIES) -> pd.DataFrame:
+    """按(by, category)聚合，只保留value合计最大的max_categories个类别，其余合并为"其他"。
+    agg为各列的聚合方式，默认value求和"""
+    totals = df.groupby(category, sort=False)[value].sum()
+    if len(totals) > max_categories:
+        keep = totals.nlargest(max_categories - 1).index
+        df = df.assign(**{category: df[category].where(df[category].isin(keep), OTHER_LABEL)})
+    keys = ([by] if by else []) + [category]
+    return df.groupby(keys, sort=False, as_index=False).agg(agg or {value: 'sum'})
+
+
+def downsample(df: pd.DataFrame, max_points: int = MAX_POINTS) -> pd.DataFrame:
+    """按行号分成max_points个区间，每个区间取最后一行（时间线上即该区间结束时的状态）"""
+    if len(df) <= max_points:
+        return df
+    buckets = np.arange(len(df)) * max_points // len(df)
+    last = np.flatnonzero(np.diff(buckets, append=max_points))
+    return df.iloc[last]
+
+
+def room_price_figure(df: pd.DataFrame, group: Optional[str] = None, title: str = "") -> go.Figure:
+    """房数和定价并排的子图。group为分组列（如比较时的'图片'），为None时按数值着色"""
+    df = limit_categories(df, '房类', '房数', by=group, agg={'房数': 'sum', '定价': 'mean'})
+    fig = make_subplots(rows=1, cols=2, subplot_titles=("各房型房数", "各房型定价"))
+
+    if group is None:
+        fig.add_trace(go.Bar(x=df['房类'], y=df['房数'], name='房数',
+                             marker=dict(color=df['房数'], colorscale='Blues')), row=1, col=1)
+        fig.add_trace(go.Bar(x=df['房类'], y=df['定价'], name='定价',
+                             marker=dict(color=df['定价'], colorscale='Reds')), row=1, col=2)
+        fig.update_layout(showlegend=False)
+    else:
+        colors = ['#636efa', '#ef553b', '#00cc96', '#ab63fa']
+        for i, (name, part) in enumerate(df.groupby(group, sort=False)):
+            color = colors[i % len(colors)]
+            fig.add_trace(go.Bar(x=part['房类'], y=part['房数'], name=str(name), legendgroup=str(name),
+                                 marker_color=color), row=1, col=1)
+            fig.add_trace(go.Bar(x=part['房类'], y=part['定价'], name=str(name), legendgroup=str(name),
+                                 marker_color=color, showlegend=False), row=1, col=2)
+        fig.update_layout(barmode='group')
+
+    fig.update_xaxes(tickangle=-45)
+    fig.update_layout(title=title)
+    return fig
+
+
+def timeline_figure(timeline: pd.DataFrame, title: str = "") -> go.Figure:
+    """版本时间线：上方为总房数和销售额（双纵轴），下方为各房型房数堆叠面积"""
+    points = len(timeline)
+    timeline = downsample(timeline)
+    fig = make_subplots(rows=2, cols=1, shared_xaxes=True, vertical_spacing=0.08,
+                        specs=[[{"secondary_y": True}], [{}]],
+                        subplot_titles=("房数与销售额", "各房型房数"))
+
+    fig.add_trace(scatter_trace(timeline['version'], timeline['total_rooms'], points,
+                                mode='lines+markers', name='总房数'), row=1, col=1, secondary_y=False)
+    fig.add_trace(scatter_trace(timeline['version'], timeline['revenue'], points,
+                                mode='lines+markers', name='销售额'), row=1, col=1, secondary_y=True)
+
+    room_columns = [c for c in timeline.columns if c.startswith('rooms:')]
+    df_rooms = timeline[['version'] + room_columns].melt(id_vars='version', var_name='房类', value_name='房数')
+    df_rooms['房类'] = df_rooms['房类'].str.slice(len('rooms:'))
+    df_rooms = limit_categories(df_rooms.fillna(0), '房类', '房数', by='version')
+    # 堆叠面积不支持WebGL，点数已由downsample限制
+    for room_type, part in df_rooms.groupby('房类', sort=False):
+        fig.add_trace(go.Scatter(x=part['version'], y=part['房数'], name=room_type,
+                                 stackgroup='rooms', mode='lines'), row=2, col=1)
+
+    fig.update_layout(title=title, height=700)
+    fig.update_xaxes(title_text="版本", row=2, col=1)
+    return fig
+
+
+def demand_figure(demand: pd.Series, capacity: Optional[int] = None, title: str = "") -> go.Figure:
+    """逐晚需求曲线，capacity为库存线"""
+    fig = go.Figure(scatter_trace(demand.index, demand.values, mode='lines', name='需求', fill='tozeroy'))
+    if capacity is not None:
+        fig.add_hline(y=capacity, line_dash='dash', line_color='red', annotation_text=f"库存 {capacity}")
+    fig.update_layout(title=title, xaxis_title="日期", yaxis_title="需求")
+    return fig
+
+
+def _array_size(values: np.ndarray) -> int:
+    """数据数组在图表JSON中的字符数：数值数组按base64编码，日期和文本数组按带引号的字符串"""
+    if values.dtype.kind in 'iuf':
+        itemsize = values.dtype.itemsize
+        if values.dtype.kind in 'iu' and itemsize == 8 and values.size:
+            # 与plotly一致，64位整数先缩小为能容纳取值范围的最小宽度
+            low, high = int(values.min()), int(values.max())
+            signed = values.dtype.kind == 'i'
+            for size in (1, 2, 4):
+                bits = 8 * size - signed
+                if (-(1 << bits) if signed else 0) <= low and high < 1 << bits:
+                    itemsize = size
+                    break
+        return (values.size * itemsize + 2) // 3 * 4 + 32
+    if values.dtype.kind == 'M':
+        return 22 * values.size
+    return sum(len(str(value)) + 3 for value in values.ravel())
+
+
+def payload_size(fig: go.Figure) -> int:
+    """图表JSON的字符数。st.plotly_chart绘制时会序列化整个图表（耗时主要在数据数组的编码），
+    这里不再完整序列化一次：数据数组按元素数和类型计算，只序列化其余的布局和轨迹属性"""
+    arrays = 0
+
+    def strip(value):
+        nonlocal arrays
+        if isinstance(value, dict):
+            return {key: strip(item) for key, item in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [strip(item) for item in value]
+        if isinstance(value, np.ndarray):
+            arrays += _array_size(value)
+            return None
+        return value
+
+    skeleton = {'data': [strip(trace.to_plotly_json()) for trace in fig.data],
+                'layout': strip(fig.layout.to_plotly_json())}
+    return len(pio.to_json(skeleton, validate=False)) + arrays
+
+
+class PayloadBudget:
+    """一个页面的图表数据预算，超出时不再绘制并提示"""
+
+    def __init__(self, limit: int = PAGE_PAYLOAD_BUDGET):
+        self.limit = limit
+        self.used = 0
+
+    def plotly_chart(self, fig: go.Figure, **kwargs) -> bool:
+        """在预算内时绘制图表，返回是否已绘制"""
+        size = payload_size(fig)
+        if self.used + size > self.limit:
+            st.info(f"图表数据过大（{size / 1024:.0f}KB），已省略。可缩小数据范围后查看")
+            return False
+        self.used += size
+        st.plotly_chart(fig, use_container_width=True, **kwargs)
+        return True
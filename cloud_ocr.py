@@ -6,6 +6,8 @@
 import requests
 import base64
 import json
+import mmap
+import os
 from typing import Dict, Optional
 
 class CloudOCR:
@@ -16,9 +18,12 @@ class CloudOCR:
         self.base_url = "https://api.ocr.space/parse/image"
     
     def encode_image(self, image_path: str) -> str:
-        """将图片编码为base64"""
-        with open(image_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
+        """将图片编码为base64，内存映射读取文件，不额外复制一份文件内容"""
+        if os.path.getsize(image_path) == 0:
+            return ""
+        with open(image_path, "rb") as image_file, \
+                mmap.mmap(image_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return base64.b64encode(mapped).decode('ascii')
     
     def ocr_space_api(self, image_data: str) -> str:
         """使用OCR.space API进行文字识别"""
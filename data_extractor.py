@@ -1,7 +1,12 @@
+import json
+import os
 import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
 import numpy as np
 import pandas as pd
-from PIL import Image
+from PIL import Image, ImageFilter, ImageOps
 from typing import Dict, List, Optional, Tuple
 
 # 尝试导入OpenCV，如果失败则使用替代方案
@@ -20,11 +25,67 @@ except ImportError:
     TESSERACT_AVAILABLE = False
     print("Tesseract不可用，将使用模拟数据")
 
+from booking_dates import add_stay_dates, stay_dates
+from export_reader import export_type, parse_text_rows, read_export, rows_to_bookings
+from deadline import Deadline, ExtractionCancelled
+from delta_ocr import carry_over_words, dedupe_overlap_lines, diff_bands, order_lines
+from image_quality import assess_image_quality
+from rate_codes import RateCodeCatalog, split_revenue
+
+# 解析器和预处理版本号：修改parse_booking_data后递增PARSER_VERSION，已存储的OCR原文会被重新解析；
+# 修改preprocess_image或OCR参数后递增PREPROCESSOR_VERSION，对应记录需要重新OCR
+PARSER_VERSION = 2
+PREPROCESSOR_VERSION = 1
+
+# OCR原文的解析方式，随记录保存，重新解析时使用识别时的方式：
+# text为整体文本解析(parse_booking_data)，rows为逐行解析数据行(parse_booking_rows，长截图分块和增量识别)
+PARSE_TEXT = 'text'
+PARSE_ROWS = 'rows'
+
+# 长截图分块OCR参数：高度超过TILE_THRESHOLD的图片按TILE_HEIGHT切块，
+# 相邻块重叠TILE_OVERLAP像素（需大于一行的高度，保证每行至少完整出现在一个块中）
+TILE_THRESHOLD = 2400
+TILE_HEIGHT = 1600
+TILE_OVERLAP = 120
+OCR_WORKERS = min(4, os.cpu_count() or 1)
+
+# OCR参数配置文件，由ocr_autotune.py在标注样本上搜索后写入，提取器启动时加载
+DEFAULT_OCR_PROFILE_PATH = os.environ.get('OCR_PROFILE_PATH', 'ocr_profile.json')
+
+# 默认OCR参数：blur为gaussian/median/none，threshold为otsu/adaptive/none（仅OpenCV可用时生效），
+# block_size和threshold_c为自适应阈值的参数
+DEFAULT_OCR_PROFILE = {
+    'lang': 'chi_sim+eng', 'psm': 6, 'oem': 3, 'scale': 1.0,
+    'blur': 'gaussian', 'blur_size': 5, 'threshold': 'otsu', 'block_size': 31, 'threshold_c': 10,
+}
+
+
+def load_ocr_profile(path: str = DEFAULT_OCR_PROFILE_PATH) -> Dict:
+    """加载OCR参数，配置文件中的参数覆盖默认值"""
+    profile = dict(DEFAULT_OCR_PROFILE)
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            profile.update(json.load(f).get('profile', {}))
+    return profile
+
+
+def build_ocr_strategies(profile: Dict) -> List[Dict]:
+    """按OCR参数生成降级策略，按耗时从高到低排列，截止时间不足时依次选用更快的策略。
+    cost为相对完整识别的耗时估计；minimal只识别英文和数字（房类、房数、价格、日期列）"""
+    config = f"--psm {profile['psm']} --oem {profile['oem']}"
+    return [
+        dict(profile, name='full', config=config, cost=1.0),
+        dict(profile, name='reduced', scale=profile['scale'] * 0.75, config=config, cost=0.6),
+        dict(profile, name='minimal', scale=profile['scale'] * 0.6, lang='eng',
+             config=config + ' -c tessedit_char_whitelist=ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789/.:,', cost=0.25),
+    ]
+
+
 class HotelDataExtractor:
     """酒店预订数据提取器"""
     
     
-    def __init__(self):
+    def __init__(self, ocr_profile: Optional[Dict] = None):
         self.room_type_patterns = {
             # D系列
             'DKN': r'DKN', 'DKS': r'DKS', 'DQN': r'DQN', 'DQS': r'DQS', 
@@ -63,9 +124,32 @@ class HotelDataExtractor:
             'May': '旅游', 'Jun': '旅游', 'Jul': '旅游', 'Aug': '旅游',
             'Sep': '旅游', 'Oct': '旅游', 'Nov': '旅游', 'Dec': '旅游'
         }
+        
+        # 完整识别每百万像素的耗时估计(秒)，随实际OCR耗时更新
+        self.ocr_seconds_per_mpx = 1.5
+        
+        # 包价代码目录，用于拆分客房收入和包价收入
+        self.rate_catalog = RateCodeCatalog.load()
+        
+        # OCR参数和降级策略，未指定时从ocr_profile.json加载
+        self.ocr_profile = ocr_profile or load_ocr_profile()
+        self.ocr_strategies = build_ocr_strategies(self.ocr_profile)
     
-    def preprocess_image(self, image: Image.Image) -> Image.Image:
-        """预处理图片以提高OCR识别率"""
+    def preprocess_image(self, image: Image.Image, quality: Optional[Dict] = None,
+                         profile: Optional[Dict] = None) -> Image.Image:
+        """预处理图片以提高OCR识别率，质量检查建议增强时使用更重的处理。
+        profile为OCR参数（模糊和阈值方式），默认使用提取器加载的参数"""
+        profile = profile or self.ocr_profile
+        enhance = bool(quality and quality.get('enhance'))
+        
+        if enhance:
+            # 文字偏小时先放大，再拉伸对比度
+            upscale = quality.get('upscale', 1.0)
+            if upscale > 1.0:
+                width, height = image.size
+                image = image.resize((int(width * upscale), int(height * upscale)), Image.LANCZOS)
+            image = ImageOps.autocontrast(image.convert('L'), cutoff=1)
+        
         if CV2_AVAILABLE:
             # 使用OpenCV进行图像处理
             img_array = np.array(image)
@@ -76,42 +160,154 @@ class HotelDataExtractor:
             else:
                 gray = img_array
             
-            # 应用高斯模糊去噪
-            blurred = cv2.GaussianBlur(gray, (5, 5), 0)
-            
-            # 应用阈值处理
-            _, thresh = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+            if enhance:
+                # 中值滤波去噪，自适应阈值应对光照不均和低对比度
+                blurred = cv2.medianBlur(gray, 3)
+                thresh = cv2.adaptiveThreshold(blurred, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                                               cv2.THRESH_BINARY, 31, 10)
+            else:
+                # 按OCR参数去噪和二值化
+                size = profile['blur_size']
+                if profile['blur'] == 'gaussian':
+                    blurred = cv2.GaussianBlur(gray, (size, size), 0)
+                elif profile['blur'] == 'median':
+                    blurred = cv2.medianBlur(gray, size)
+                else:
+                    blurred = gray
+                
+                if profile['threshold'] == 'otsu':
+                    _, thresh = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+                elif profile['threshold'] == 'adaptive':
+                    thresh = cv2.adaptiveThreshold(blurred, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY,
+                                                   profile['block_size'], profile['threshold_c'])
+                else:
+                    thresh = blurred
             
             # 转换回PIL格式
             processed_image = Image.fromarray(thresh)
         else:
             # 使用PIL进行简单的图像处理
             processed_image = image.convert('L')  # 转换为灰度图
+            if enhance:
+                processed_image = processed_image.filter(ImageFilter.SHARPEN)
         
         return processed_image
     
-    def extract_text_from_image(self, image: Image.Image) -> str:
-        """从图片中提取文本"""
+    def check_image_quality(self, image: Image.Image) -> Dict:
+        """OCR前快速检查图片质量"""
+        return assess_image_quality(image)
+    
+    def run_ocr(self, image: Image.Image, quality: Optional[Dict] = None,
+                strategy: Optional[Dict] = None, timeout: float = 0) -> Dict:
+        """按指定策略运行Tesseract，返回OCR原文和单词坐标（坐标为原图坐标）。
+        strategy默认为完整识别，timeout为0表示不限时，超时时抛出RuntimeError"""
+        strategy = strategy or self.ocr_strategies[0]
+        scale = strategy['scale']
+        if scale != 1.0:
+            width, height = image.size
+            image = image.resize((max(1, int(width * scale)), max(1, int(height * scale))), Image.BILINEAR)
+        
+        # 预处理图片
+        processed_image = self.preprocess_image(image, quality, strategy)
+        # 增强预处理可能放大了图片，单词坐标需要按实际比例换算回原图
+        ratio = processed_image.size[0] / image.size[0] * scale
+        
+        # 使用OCR提取单词及其坐标，一次OCR同时得到文本和坐标
+        started_at = time.perf_counter()
+        ocr_data = pytesseract.image_to_data(
+            processed_image, 
+            lang=strategy['lang'],
+            config=strategy['config'],
+            output_type=pytesseract.Output.DICT,
+            timeout=timeout
+        )
+        self.record_ocr_time(image.size, strategy, time.perf_counter() - started_at)
+        
+        words = []
+        for i, word in enumerate(ocr_data['text']):
+            if not str(word).strip():
+                continue
+            words.append({
+                'text': word,
+                'left': int(ocr_data['left'][i] / ratio),
+                'top': int(ocr_data['top'][i] / ratio),
+                'width': int(ocr_data['width'][i] / ratio),
+                'height': int(ocr_data['height'][i] / ratio),
+                'conf': float(ocr_data['conf'][i]),
+                'line': (ocr_data['block_num'][i], ocr_data['par_num'][i], ocr_data['line_num'][i])
+            })
+        
+        return {'text': self.words_to_text(words), 'words': words}
+    
+    def record_ocr_time(self, size: Tuple[int, int], strategy: Dict, seconds: float):
+        """记录OCR耗时，按每百万像素的完整识别耗时做指数平滑，用于估计剩余时间够不够用"""
+        megapixels = max(size[0] * size[1] / 1e6, 0.01)
+        observed = seconds / (megapixels * strategy['cost'])
+        self.ocr_seconds_per_mpx = 0.7 * self.ocr_seconds_per_mpx + 0.3 * observed
+    
+    def estimate_ocr_seconds(self, size: Tuple[int, int], strategy: Dict) -> float:
+        """估计按某策略识别一张图片的耗时"""
+        return self.ocr_seconds_per_mpx * size[0] * size[1] / 1e6 * strategy['cost']
+    
+    def extract_ocr_result(self, image: Image.Image, quality: Optional[Dict] = None,
+                           mock_fallback: bool = True) -> Dict:
+        """从图片中提取OCR原文和单词坐标。识别出错时返回模拟数据，mock_fallback为False时抛出异常"""
         try:
             if TESSERACT_AVAILABLE:
-                # 预处理图片
-                processed_image = self.preprocess_image(image)
-                
-                # 使用OCR提取文本
-                text = pytesseract.image_to_string(
-                    processed_image, 
-                    lang='chi_sim+eng',
-                    config='--psm 6'
-                )
-                
-                return text
+                return self.run_ocr(image, quality)
             else:
                 # 使用更智能的方法来区分不同图片
                 # 基于图片的像素特征来判断
-                return self.detect_image_type(image)
+                return {'text': self.detect_image_type(image), 'words': []}
         except Exception as e:
+            if not mock_fallback:
+                raise
             print(f"OCR提取失败: {str(e)}")
-            return self.get_mock_ocr_text()
+            return {'text': self.get_mock_ocr_text(), 'words': []}
+    
+    def extract_ocr_with_deadline(self, image: Image.Image, quality: Optional[Dict],
+                                  deadline: Deadline) -> Dict:
+        """在截止时间内提取OCR结果。剩余时间不够完整识别时逐级降级为更快的策略，
+        降级或超时的结果标记为partial；取消时抛出ExtractionCancelled"""
+        deadline.check()
+        if not TESSERACT_AVAILABLE:
+            return dict(self.extract_ocr_result(image, quality), strategy='mock', partial=False)
+        
+        for index, strategy in enumerate(self.ocr_strategies):
+            deadline.check()
+            remaining = deadline.remaining()
+            if remaining <= 0:
+                break
+            # 非最后一级策略要给最后一级预留时间，估计时间不够时直接跳到更快的策略
+            is_last = index == len(self.ocr_strategies) - 1
+            budget = remaining
+            if not is_last:
+                budget = remaining - self.estimate_ocr_seconds(image.size, self.ocr_strategies[-1])
+                if self.estimate_ocr_seconds(image.size, strategy) > budget:
+                    continue
+            try:
+                timeout = 0 if budget == float('inf') else budget
+                result = self.run_ocr(image, quality, strategy, timeout=timeout)
+                return dict(result, strategy=strategy['name'], partial=strategy['name'] != 'full')
+            except RuntimeError as e:
+                # pytesseract超时或出错时抛出RuntimeError，改用更快的策略；
+                # 超时说明实际耗时至少为timeout，据此修正耗时估计
+                print(f"OCR策略 {strategy['name']} 失败: {str(e)}")
+                if timeout and 'timeout' in str(e).lower():
+                    self.record_ocr_time(image.size, strategy, timeout)
+        
+        return {'text': '', 'words': [], 'strategy': None, 'partial': True}
+    
+    def words_to_text(self, words: List[Dict]) -> str:
+        """按行号将OCR单词还原为文本"""
+        lines = {}
+        for word in words:
+            lines.setdefault(tuple(word['line']), []).append(word['text'])
+        return "\n".join(" ".join(line_words) for line_words in lines.values())
+    
+    def extract_text_from_image(self, image: Image.Image) -> str:
+        """从图片中提取文本"""
+        return self.extract_ocr_result(image)['text']
     
     def detect_image_type(self, image: Image.Image) -> str:
         """检测图片类型并返回对应的模拟数据"""
@@ -121,7 +317,6 @@ class HotelDataExtractor:
             total_pixels = width * height
             aspect_ratio = width / height
             
-<<<<<<< HEAD
             print(f"图片信息: {width}x{height}, 像素: {total_pixels}, 宽高比: {aspect_ratio:.2f}")
             
             # 简化的检测逻辑
@@ -158,83 +353,6 @@ class HotelDataExtractor:
             else:
                 print("最终判断: 麦尔会展图片")
                 return self.get_mock_ocr_text("25625")
-=======
-            # 转换为numpy数组进行分析
-            import numpy as np
-            img_array = np.array(image)
-            
-            # 计算图片的平均亮度
-            if len(img_array.shape) == 3:
-                gray = np.mean(img_array, axis=2)
-            else:
-                gray = img_array
-            
-            avg_brightness = np.mean(gray)
-            
-            # 计算图片的复杂度（边缘密度）
-            from PIL import ImageFilter
-            edges = image.filter(ImageFilter.FIND_EDGES)
-            edge_array = np.array(edges)
-            edge_density = np.mean(edge_array) / 255.0
-            
-            # 计算图片的对比度
-            contrast = np.std(gray)
-            
-            # 计算图片的纹理复杂度
-            texture_complexity = np.var(gray)
-            
-            # 基于多个特征来判断图片类型
-            # 国家疾控局的图片特征：
-            # 1. 通常更宽（横向表格）
-            # 2. 有更多的文字和表格线
-            # 3. 对比度较高
-            # 4. 纹理复杂度较高
-            
-            score_25626 = 0
-            score_25625 = 0
-            
-            # 宽高比评分（国家疾控局图片通常更宽）
-            if aspect_ratio > 1.5:
-                score_25626 += 2
-            else:
-                score_25625 += 1
-            
-            # 像素数量评分（国家疾控局图片通常更大）
-            if total_pixels > 800000:
-                score_25626 += 2
-            elif total_pixels > 400000:
-                score_25626 += 1
-            else:
-                score_25625 += 1
-            
-            # 边缘密度评分（国家疾控局图片有更多表格线）
-            if edge_density > 0.15:
-                score_25626 += 2
-            elif edge_density > 0.08:
-                score_25626 += 1
-            else:
-                score_25625 += 1
-            
-            # 对比度评分（国家疾控局图片对比度更高）
-            if contrast > 50:
-                score_25626 += 1
-            else:
-                score_25625 += 1
-            
-            # 纹理复杂度评分
-            if texture_complexity > 2000:
-                score_25626 += 1
-            else:
-                score_25625 += 1
-            
-            # 根据总分决定图片类型
-            if score_25626 > score_25625:
-                print(f"检测到国家疾控局图片 (分数: 25626={score_25626}, 25625={score_25625})")
-                return self.get_mock_ocr_text("25626")  # 国家疾控局
-            else:
-                print(f"检测到麦尔会展图片 (分数: 25626={score_25626}, 25625={score_25625})")
-                return self.get_mock_ocr_text("25625")  # 麦尔会展
->>>>>>> 5d445e019fc68d9039c2c6d13a08acaaa46d207a
                 
         except Exception as e:
             print(f"图片类型检测失败: {str(e)}")
@@ -271,8 +389,8 @@ class HotelDataExtractor:
             R CON25625/麦尔会展 DETN 5 550.00 12/19 18:00 12/21 12:00 2
             """
     
-    def parse_booking_data(self, text: str) -> Optional[Dict]:
-        """解析预订数据"""
+    def parse_booking_data(self, text: str, reference: Optional[date] = None) -> Optional[Dict]:
+        """解析预订数据，reference为推断到达/离开年份的参考日期（默认今天）"""
         try:
             # 提取预订ID
             booking_id_match = re.search(r'(CON\d+/[^\\n]+|FIT\d+/[^\\n]+|[A-Za-z]{3}\d+/[^\\n]+)', text)
@@ -343,29 +461,244 @@ class HotelDataExtractor:
                 'flags': flags
             }
             
+            # 解析到达/离开日期，能解析时用实际间夜数
+            add_stay_dates([data], reference)
             return data
             
         except Exception as e:
             print(f"数据解析失败: {str(e)}")
             return None
     
-    def extract_data_from_image(self, image: Image.Image) -> Optional[Dict]:
-        """从图片中提取完整的预订数据"""
+    def extract_data_and_ocr(self, image: Image.Image, quality: Optional[Dict] = None,
+                             deadline: Optional[Deadline] = None,
+                             mock_fallback: bool = True) -> Tuple[Optional[Dict], Dict]:
+        """从图片中提取预订数据，同时返回OCR原文以便存储后重新解析。
+        OCR前先做质量检查，无法识别的图片直接返回None，ocr['quality']中给出原因。
+        传入deadline时按剩余时间降级识别，结果不完整时data['partial']为True；取消时抛出ExtractionCancelled。
+        mock_fallback为False时识别或解析出错直接抛出异常，不退回模拟数据（参数调优用）"""
+        ocr = {'text': '', 'words': []}
         try:
+            if quality is None:
+                quality = self.check_image_quality(image)
+            ocr['quality'] = quality
+            if quality['status'] == 'reject':
+                print(f"图片质量不合格: {'; '.join(quality['reasons'])}")
+                return None, ocr
+            
+            # 长截图分块并行OCR
+            if TESSERACT_AVAILABLE and image.size[1] > TILE_THRESHOLD:
+                data, ocr = self.extract_data_and_ocr_tiled([image], quality, deadline, mock_fallback)
+                ocr['quality'] = quality
+                return data, ocr
+            
             # 提取文本
-            text = self.extract_text_from_image(image)
+            if deadline is not None:
+                ocr = dict(self.extract_ocr_with_deadline(image, quality, deadline), quality=quality)
+            else:
+                ocr = dict(self.extract_ocr_result(image, quality, mock_fallback), quality=quality)
             
-            if not text.strip():
-                return None
+            ocr['parse_mode'] = PARSE_TEXT
+            if not ocr['text'].strip():
+                return None, ocr
             
             # 解析数据
-            data = self.parse_booking_data(text)
+            data = self.parse_booking_data(ocr['text'])
             
-            return data
+            return self.mark_partial(data, ocr), ocr
             
+        except ExtractionCancelled:
+            raise
         except Exception as e:
+            if not mock_fallback:
+                raise
             print(f"数据提取失败: {str(e)}")
+            return None, ocr
+    
+    def extract_data_and_ocr_delta(self, image: Image.Image, previous_image: Image.Image, previous: Dict,
+                                   quality: Optional[Dict] = None,
+                                   deadline: Optional[Deadline] = None) -> Optional[Tuple[Optional[Dict], Dict]]:
+        """与同一版面的上一张截图比较，只OCR变化的行，未变化的行沿用上一次的单词。
+        previous为上一张截图的OCR存储记录；不适用增量识别时返回None，由调用方完整识别"""
+        if not TESSERACT_AVAILABLE or not previous.get('ocr_words'):
+            return None
+        if quality is None:
+            quality = self.check_image_quality(image)
+        if quality['status'] == 'reject':
+            return None
+        delta = diff_bands(previous_image, image)
+        if delta is None:
+            return None
+    
+        # 更新前保存的分块识别结果中，重叠区域的行有两份
+        words = carry_over_words(dedupe_overlap_lines(previous['ocr_words']), delta['moved'])
+        results = []
+        for index, (top, bottom) in enumerate(delta['changed']):
+            crop = image.crop((0, top, image.size[0], bottom))
+            if deadline is not None:
+                result = self.extract_ocr_with_deadline(crop, quality, deadline)
+            else:
+                result = self.extract_ocr_result(crop, quality)
+            results.append(result)
+            words.extend(dict(word, top=word['top'] + top, line=['delta', index] + list(word['line']))
+                         for word in result['words'])
+    
+        words = order_lines(words)
+        ocr = {
+            'text': self.words_to_text(words),
+            'words': words,
+            'quality': quality,
+            'partial': any(result.get('partial') for result in results),
+            'strategy': next((r.get('strategy') for r in results if r.get('strategy') not in (None, 'full')), None),
+            'delta': {'base': previous['content_hash'], 'bands': delta['bands'],
+                      'changed_bands': delta['changed_bands']},
+            # 与完整识别使用相同的解析方式
+            'parse_mode': PARSE_ROWS if image.size[1] > TILE_THRESHOLD else PARSE_TEXT,
+        }
+        data = self.parse_ocr_text(ocr['text'], ocr['parse_mode'])
+        return self.mark_partial(data, ocr), ocr
+    
+    def mark_partial(self, data: Optional[Dict], ocr: Dict) -> Optional[Dict]:
+        """OCR结果不完整（降级识别或超时）时在预订数据上标记"""
+        if data and ocr.get('partial'):
+            data['partial'] = True
+            data['partial_reason'] = f"时间不足，使用了降级识别策略({ocr.get('strategy') or '超时'})"
+        return data
+    
+    def extract_data_from_image(self, image: Image.Image,
+                                deadline: Optional[Deadline] = None) -> Optional[Dict]:
+        """从图片中提取完整的预订数据"""
+        data, _ = self.extract_data_and_ocr(image, deadline=deadline)
+        return data
+    
+    def split_into_tiles(self, image: Image.Image, tile_height: int = TILE_HEIGHT,
+                         overlap: int = TILE_OVERLAP) -> List[Tuple[int, Image.Image]]:
+        """将长图切分为相互重叠的水平块，返回(块顶部偏移, 块图片)列表"""
+        width, height = image.size
+        if height <= tile_height:
+            return [(0, image)]
+        
+        tiles = []
+        step = tile_height - overlap
+        top = 0
+        while True:
+            bottom = min(top + tile_height, height)
+            tiles.append((top, image.crop((0, top, width, bottom))))
+            if bottom >= height:
+                break
+            top += step
+        return tiles
+    
+    def stitch_rows(self, row_lists: List[List[Dict]]) -> List[Dict]:
+        """拼接各块解析出的数据行，去掉重叠区域重复的行。
+        相邻块之间取前一块末尾与后一块开头最长的相同行序列作为重叠部分，
+        因此不在重叠区域内、内容恰好相同的行不会被误删。"""
+        stitched = []
+        for rows in row_lists:
+            keys = [row['line'] for row in rows]
+            previous = [row['line'] for row in stitched]
+            overlap = 0
+            for k in range(min(len(previous), len(keys)), 0, -1):
+                if previous[-k:] == keys[:k]:
+                    overlap = k
+                    break
+            stitched.extend(rows[overlap:])
+        return stitched
+    
+    def parse_booking_rows(self, text: str, reference: Optional[date] = None) -> Optional[Dict]:
+        """逐行解析预订数据行并汇总为一条预订记录，没有可识别的数据行时返回None。
+        reference为推断到达/离开年份的参考日期（默认今天）"""
+        bookings = rows_to_bookings(parse_text_rows(text))
+        if not bookings:
             return None
+        # 多个预订ID时取房数最多的一个
+        booking = max(bookings, key=lambda booking: booking['total_rooms'])
+        if reference is not None:
+            add_stay_dates([booking], reference)
+        return booking
+    
+    def parse_ocr_text(self, text: str, parse_mode: Optional[str] = PARSE_TEXT,
+                       reference: Optional[date] = None) -> Optional[Dict]:
+        """按识别时的解析方式（ocr['parse_mode']）解析OCR原文，用于增量识别和重新解析已存储的原文"""
+        if parse_mode == PARSE_ROWS:
+            return self.parse_booking_rows(text, reference)
+        return self.parse_booking_data(text, reference) if text.strip() else None
+    
+    def extract_data_and_ocr_tiled(self, images: List[Image.Image], quality: Optional[Dict] = None,
+                                   deadline: Optional[Deadline] = None,
+                                   mock_fallback: bool = True) -> Tuple[Optional[Dict], Dict]:
+        """对一张长截图或同一列表的多张截图分块并行OCR，拼接数据行后生成一条预订记录。
+        未传入quality时逐张检查图片质量，跳过无法识别的图片。
+        传入deadline时超时未开始的块会被跳过，结果标记为partial"""
+        tiles = []
+        for image in images:
+            image_quality = quality if quality is not None else self.check_image_quality(image)
+            if image_quality['status'] == 'reject':
+                print(f"跳过质量不合格的图片: {'; '.join(image_quality['reasons'])}")
+                continue
+            tiles.extend((offset, tile, image_quality) for offset, tile in self.split_into_tiles(image))
+        
+        def ocr_tile(tile):
+            if deadline is None:
+                return self.extract_ocr_result(tile[1], tile[2], mock_fallback)
+            if deadline.expired():
+                deadline.check()
+                return {'text': '', 'words': [], 'strategy': None, 'partial': True}
+            return self.extract_ocr_with_deadline(tile[1], tile[2], deadline)
+        
+        # pytesseract在子进程中运行Tesseract，线程池即可并行
+        with ThreadPoolExecutor(max_workers=OCR_WORKERS) as pool:
+            results = list(pool.map(ocr_tile, tiles))
+        
+        words = []
+        for index, ((offset, _, _), result) in enumerate(zip(tiles, results)):
+            for word in result['words']:
+                words.append(dict(word, top=word['top'] + offset, line=(index,) + tuple(word['line'])))
+        # 与数据行一样去掉重叠区域重复的行，增量识别沿用单词时每行只出现一次
+        words = dedupe_overlap_lines(words)
+        
+        rows = self.stitch_rows([parse_text_rows(result['text']) for result in results])
+        if rows:
+            text = "\n".join(row['line'] for row in rows)
+            parse_mode = PARSE_ROWS
+        else:
+            # 没有可识别的数据行，退回整体文本解析
+            text = "\n".join(result['text'] for result in results)
+            parse_mode = PARSE_TEXT
+        data = self.parse_ocr_text(text, parse_mode)
+        
+        strategies = [result.get('strategy') for result in results]
+        ocr = {
+            'text': text,
+            'words': words,
+            'partial': any(result.get('partial') for result in results),
+            'strategy': next((s for s in strategies if s and s != 'full'), strategies[0] if strategies else None),
+            'parse_mode': parse_mode,
+        }
+        return self.mark_partial(data, ocr), ocr
+    
+    def extract_data_from_images(self, images: List[Image.Image],
+                                 deadline: Optional[Deadline] = None) -> Optional[Dict]:
+        """从同一预订列表的多张截图（或一张长截图）中提取一条预订数据"""
+        try:
+            data, _ = self.extract_data_and_ocr_tiled(images, deadline=deadline)
+            return data
+        except ExtractionCancelled:
+            raise
+        except Exception as e:
+            print(f"多图数据提取失败: {str(e)}")
+            return None
+    
+    def is_export_file(self, filename: str) -> bool:
+        """判断上传文件是否为PMS导出文件(CSV/Excel/PDF)"""
+        return export_type(filename) is not None
+    
+    def extract_data_from_export(self, file, filename: str) -> List[Dict]:
+        """从PMS导出文件中直接提取预订数据，跳过OCR"""
+        try:
+            return read_export(file, filename)
+        except Exception as e:
+            print(f"导出文件读取失败: {str(e)}")
+            return []
     
     def determine_booking_type(self, booking_id: str) -> str:
         """确定预订类型"""
@@ -376,7 +709,11 @@ class HotelDataExtractor:
     
     def calculate_total_sales(self, room_counts: List[int], prices: List[float]) -> float:
         """计算总销售额"""
-        return sum(count * price for count, price in zip(room_counts, prices))
+        return float(np.dot(np.asarray(room_counts, dtype=np.float64), np.asarray(prices, dtype=np.float64)))
+    
+    def split_sales(self, bookings: List[Dict]) -> pd.DataFrame:
+        """按包价代码把一批预订的销售额拆分为客房收入和包价收入"""
+        return split_revenue(bookings, self.rate_catalog)
     
     def generate_summary(self, data: Dict) -> str:
         """生成总结语句"""
@@ -389,8 +726,9 @@ class HotelDataExtractor:
         booking_name = data['booking_id']
         
         # 处理时间格式，去掉具体时分
-        arrival_date = data['arrival'].split(' ')[0]  # 只要日期部分
-        departure_date = data['departure'].split(' ')[0]  # 只要日期部分
+        stay = stay_dates(data)
+        arrival_date = stay['arrival_at'].strftime('%m/%d') if pd.notna(stay['arrival_at']) else data['arrival']
+        departure_date = stay['departure_at'].strftime('%m/%d') if pd.notna(stay['departure_at']) else data['departure']
         
         # 按房数排序生成详细房型信息
         room_details = []
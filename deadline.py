@@ -0,0 +1,54 @@
+"""
+提取截止时间与取消
+每次提取请求携带一个Deadline，OCR根据剩余时间选择更快的识别策略，
+用户离开页面或重新上传时调用cancel()，提取在下一个检查点停止
+"""
+
+import math
+import os
+import threading
+import time
+from typing import Optional
+
+# 默认单次提取时间预算(秒)
+DEFAULT_DEADLINE = float(os.environ.get('EXTRACTION_DEADLINE', 30))
+
+
+class ExtractionCancelled(Exception):
+    """提取已被取消"""
+
+
+class Deadline:
+    """提取截止时间，seconds为None表示不限时"""
+
+    def __init__(self, seconds: Optional[float] = DEFAULT_DEADLINE):
+        self.seconds = seconds
+        self.started_at = time.monotonic()
+        self._cancelled = threading.Event()
+
+    def elapsed(self) -> float:
+        """已用时间"""
+        return time.monotonic() - self.started_at
+
+    def remaining(self) -> float:
+        """剩余时间，不限时返回inf"""
+        if self.seconds is None:
+            return math.inf
+        return max(0.0, self.seconds - self.elapsed())
+
+    def expired(self) -> bool:
+        """是否已超时"""
+        return self.remaining() <= 0
+
+    def cancel(self):
+        """取消提取"""
+        self._cancelled.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def check(self):
+        """检查点：已取消时抛出ExtractionCancelled"""
+        if self.cancelled:
+            raise ExtractionCancelled("提取已取消")
@@ -0,0 +1,154 @@
+"""
+增量OCR
+同一个团队预订的列表页每次修改后都会重新截图，通常只有一两行变化。
+新截图按版面（顶部标题栏）找到存储的上一张截图，按文字行切分为水平条带并逐条比较像素，
+只对变化的条带做OCR，未变化的条带沿用上一次的单词坐标，合并后重新解析为预订记录
+"""
+
+import hashlib
+from difflib import SequenceMatcher
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+# 版面键取截图顶部的高度（像素），同一预订的列表页标题栏相同
+HEADER_HEIGHT = 60
+
+# 与背景灰度相差超过该值的像素视为文字
+INK_THRESHOLD = 40
+
+# 间隔小于该行数的文字行合并为一个条带
+MIN_BAND_GAP = 3
+
+# 比较条带时忽略灰度低位，避免缩放/压缩带来的细微差异
+QUANT_SHIFT = 4
+
+# 裁剪变化区域时上下多留的像素，避免切掉文字边缘
+BAND_MARGIN = 4
+
+# 变化条带占比超过该值时增量识别不比完整识别快，直接完整识别
+MAX_CHANGED_RATIO = 0.5
+
+
+def _gray(image: Image.Image) -> np.ndarray:
+    return np.asarray(image.convert('L'))
+
+
+def layout_key(image: Image.Image) -> str:
+    """版面键：宽度 + 顶部标题栏量化后的哈希"""
+    header = _gray(image)[:HEADER_HEIGHT] >> QUANT_SHIFT
+    digest = hashlib.blake2b(header.tobytes(), digest_size=8).hexdigest()
+    return f"{image.size[0]}:{digest}"
+
+
+def row_bands(gray: np.ndarray) -> List[Tuple[int, int]]:
+    """按水平投影切分文字行，返回[(top, bottom)]。
+    表格竖线在每一行都有墨迹，几乎整列都是墨迹的列不参与投影"""
+    background = int(np.median(gray))
+    ink = np.abs(gray.astype(np.int16) - background) > INK_THRESHOLD
+    ink[:, ink.mean(axis=0) > 0.9] = False
+    rows = np.flatnonzero(ink.any(axis=1))
+    if len(rows) == 0:
+        return []
+    # 相邻墨迹行间隔不小于MIN_BAND_GAP处断开
+    breaks = np.flatnonzero(np.diff(rows) > MIN_BAND_GAP)
+    tops = np.concatenate(([rows[0]], rows[breaks + 1]))
+    bottoms = np.concatenate((rows[breaks], [rows[-1]])) + 1
+    return list(zip(tops.tolist(), bottoms.tolist()))
+
+
+def band_signatures(gray: np.ndarray, bands: List[Tuple[int, int]]) -> List[bytes]:
+    quantized = gray >> QUANT_SHIFT
+    return [hashlib.blake2b(quantized[top:bottom].tobytes(), digest_size=8).digest() for top, bottom in bands]
+
+
+def diff_bands(previous: Image.Image, current: Image.Image) -> Optional[Dict]:
+    """对齐两张截图的文字条带。
+    返回moved（上一张中未变化的条带 -> 纵向位移）和changed（新截图中需要OCR的区域），
+    宽度不同或变化过多时返回None"""
+    if previous.size[0] != current.size[0]:
+        return None
+    old_gray, new_gray = _gray(previous), _gray(current)
+    old_bands, new_bands = row_bands(old_gray), row_bands(new_gray)
+    if not old_bands or not new_bands:
+        return None
+
+    matcher = SequenceMatcher(None, band_signatures(old_gray, old_bands),
+                              band_signatures(new_gray, new_bands), autojunk=False)
+    moved, changed = [], []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            for i, j in zip(range(i1, i2), range(j1, j2)):
+                moved.append((old_bands[i], new_bands[j][0] - old_bands[i][0]))
+        elif j2 > j1:
+            # 相邻的变化条带合并为一个区域一起OCR
+            changed.append((max(0, new_bands[j1][0] - BAND_MARGIN),
+                            min(current.size[1], new_bands[j2 - 1][1] + BAND_MARGIN)))
+
+    changed_bands = len(new_bands) - len(moved)
+    if changed_bands > len(new_bands) * MAX_CHANGED_RATIO:
+        return None
+    return {'moved': moved, 'changed': changed, 'bands': len(new_bands), 'changed_bands': changed_bands}
+
+
+def dedupe_overlap_lines(words: List[Dict]) -> List[Dict]:
+    """去掉分块OCR在相邻块重叠区域重复识别的行：文字相同且纵坐标相差不到半个行高的行只保留第一次出现的。
+    内容相同的不同数据行相隔至少一个行高，不会被去掉"""
+    lines = {}
+    for word in words:
+        lines.setdefault(tuple(word['line']), []).append(word)
+    seen = {}
+    kept = []
+    for line in lines.values():
+        text = ' '.join(word['text'] for word in line)
+        top = min(word['top'] for word in line)
+        height = max(word['height'] for word in line)
+        if any(abs(top - other_top) <= max(height, other_height) / 2
+               for other_top, other_height in seen.get(text, [])):
+            continue
+        seen.setdefault(text, []).append((top, height))
+        kept.extend(line)
+    return kept
+
+
+def carry_over_words(words: List[Dict], moved: List[Tuple[Tuple[int, int], int]]) -> List[Dict]:
+    """沿用上一张截图中未变化条带内的单词，坐标按条带位移换算到新截图"""
+    if not moved:
+        return []
+    tops = np.array([band[0] for band, _ in moved])
+    bottoms = np.array([band[1] for band, _ in moved])
+    shifts = np.array([shift for _, shift in moved])
+    kept = []
+    for word in words:
+        center = word['top'] + word['height'] / 2
+        index = np.searchsorted(tops, center, side='right') - 1
+        if index >= 0 and center < bottoms[index]:
+            kept.append(dict(word, top=word['top'] + int(shifts[index]), line=['prev'] + list(word['line'])))
+    return kept
+
+
+def order_lines(words: List[Dict]) -> List[Dict]:
+    """按行的纵坐标排列单词，使沿用的行和新识别的行按截图中的顺序还原为文本"""
+    lines = {}
+    for word in words:
+        lines.setdefault(tuple(word['line']), []).append(word)
+    ordered = sorted(lines.values(), key=lambda line: min(word['top'] for word in line))
+    return [word for line in ordered for word in line]
+
+
+def extract_incremental(extractor, store, archive, image: Image.Image, content_hash: str,
+                        quality: Optional[Dict] = None, deadline=None) -> Tuple[Optional[Dict], Dict]:
+    """提取预订数据，有同一版面的上一张截图时增量识别，否则完整识别。
+    返回的ocr中带有layout_key，存入OCR存储后作为下一张截图的比较基准"""
+    key = layout_key(image)
+    result = None
+    previous = store.latest_by_layout(key, exclude=content_hash)
+    if previous is not None:
+        previous_image = archive.open_image(previous['content_hash'])
+        if previous_image is not None:
+            with previous_image:
+                result = extractor.extract_data_and_ocr_delta(image, previous_image, previous, quality, deadline)
+    data, ocr = result or extractor.extract_data_and_ocr(image, quality, deadline)
+    ocr['layout_key'] = key
+    return data, ocr
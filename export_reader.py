@@ -0,0 +1,326 @@
+"""
+PMS导出文件读取
+直接读取PMS导出的CSV/Excel/PDF(文本层)报表，映射为与parse_booking_data相同的预订数据结构，跳过OCR
+"""
+
+import codecs
+import os
+import re
+from datetime import date
+import pandas as pd
+from typing import Dict, Iterator, List, Optional
+
+from booking_dates import add_stay_dates
+
+# 尝试导入openpyxl，如果失败则不支持Excel导出
+try:
+    import openpyxl
+    EXCEL_AVAILABLE = True
+except ImportError:
+    EXCEL_AVAILABLE = False
+    print("openpyxl不可用，将无法读取Excel导出文件")
+
+# 尝试导入pdfplumber，如果失败则不支持PDF导出
+try:
+    import pdfplumber
+    PDF_AVAILABLE = True
+except ImportError:
+    PDF_AVAILABLE = False
+    print("pdfplumber不可用，将无法读取PDF导出文件")
+
+EXPORT_EXTENSIONS = ('csv', 'xlsx', 'pdf')
+
+# 每批处理的行数，保证大文件内存占用有上限
+CHUNK_SIZE = 20000
+
+# PMS导出表头别名 -> 内部字段名
+COLUMN_ALIASES = {
+    'status': ['状态', 'Status', 'Sta'],
+    'name': ['姓名', '预订', '预订号', 'Name', 'Booking', 'Block'],
+    'room_type': ['房类', '房型', 'Room Type', 'RoomType', 'RmType'],
+    'room_count': ['房数', 'Rooms', 'Rms', 'Qty'],
+    'price': ['定价', '房价', 'Rate', 'Price'],
+    'arrival': ['到达', 'Arrival', 'Arr'],
+    'departure': ['离开', 'Departure', 'Dep'],
+    'days': ['天', '天数', 'Nights', 'Nts'],
+    'rate_code': ['包价', 'Package', 'Rate Code', 'RateCode'],
+    'flag': ['标志', 'Flag'],
+}
+
+REQUIRED_COLUMNS = ['name', 'room_type', 'room_count', 'price']
+
+# 文本层中的一行预订数据，格式与OCR文本一致
+# 例: R CON25626/国家疾控局 STS 1 580.00 10/14 18:00 10/16 12:00 2 BRK2, NSV
+BOOKING_ROW_PATTERN = re.compile(
+    r'^[ \t]*(?:(?P<status>[A-Z])[ \t]+)?'
+    r'(?P<name>[A-Za-z]{3}\d+/\S+)[ \t]+'
+    r'(?P<room_type>[A-Z]{2,5})[ \t]+'
+    r'(?P<room_count>\d+)[ \t]+'
+    r'(?P<price>\d+(?:\.\d+)?)[ \t]+'
+    r'(?P<arrival>\d{1,2}/\d{1,2}[ \t]+\d{1,2}:\d{2})[ \t]+'
+    r'(?P<departure>\d{1,2}/\d{1,2}[ \t]+\d{1,2}:\d{2})'
+    r'(?:[ \t]+(?P<days>\d+))?'
+    r'(?:[ \t]+(?P<rate_code>[A-Z][A-Z0-9]*(?:,[ \t]*[A-Z][A-Z0-9]*)*))?',
+    re.MULTILINE
+)
+
+
+def export_type(filename: str) -> Optional[str]:
+    """根据文件名判断导出文件类型，非导出文件返回None"""
+    ext = os.path.splitext(filename or '')[1].lower().lstrip('.')
+    return ext if ext in EXPORT_EXTENSIONS else None
+
+
+def parse_text_rows(text: str) -> List[Dict]:
+    """从文本中逐行解析预订数据行，line字段保留原始行文本"""
+    return [dict(match.groupdict(), line=match.group(0).strip())
+            for match in BOOKING_ROW_PATTERN.finditer(text)]
+
+
+def rows_to_bookings(rows: List[Dict]) -> List[Dict]:
+    """将已解析的数据行汇总为预订数据列表"""
+    if not rows:
+        return []
+    accumulator = BookingAccumulator()
+    accumulator.add_chunk(pd.DataFrame(rows))
+    return accumulator.to_bookings()
+
+
+def normalize_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """将导出表头统一为内部字段名"""
+    lookup = {}
+    for field, aliases in COLUMN_ALIASES.items():
+        for alias in aliases:
+            lookup[alias.lower()] = field
+
+    renamed = {}
+    for column in df.columns:
+        field = lookup.get(str(column).strip().lower())
+        if field and field not in renamed.values():
+            renamed[column] = field
+
+    df = df[list(renamed)].rename(columns=renamed)
+
+    missing = [column for column in REQUIRED_COLUMNS if column not in df.columns]
+    if missing:
+        raise ValueError(f"导出文件缺少必要列: {', '.join(missing)}")
+
+    return df
+
+
+class BookingAccumulator:
+    """按预订ID和房类汇总导出行，只保留汇总结果以限制内存"""
+
+    def __init__(self):
+        self.bookings = {}
+
+    def add_chunk(self, chunk: pd.DataFrame):
+        """汇总一批已规范化表头的数据行"""
+        chunk = chunk.copy()
+        for column in ['status', 'arrival', 'departure', 'rate_code', 'flag']:
+            if column not in chunk.columns:
+                chunk[column] = ''
+        # 带年份的到达/离开时间，只有Excel导出的日期单元格提供
+        for column in ['arrival_at', 'departure_at']:
+            if column not in chunk.columns:
+                chunk[column] = None
+        if 'days' not in chunk.columns:
+            chunk['days'] = 0
+
+        chunk['name'] = chunk['name'].astype(str).str.strip()
+        chunk['room_type'] = chunk['room_type'].astype(str).str.strip().str.upper()
+        chunk['room_count'] = pd.to_numeric(chunk['room_count'], errors='coerce').fillna(0).astype(int)
+        chunk['price'] = pd.to_numeric(chunk['price'], errors='coerce').fillna(0.0).astype(float)
+        chunk['days'] = pd.to_numeric(chunk['days'], errors='coerce').fillna(0).astype(int)
+        for column in ['arrival', 'departure', 'rate_code', 'flag']:
+            chunk[column] = chunk[column].fillna('').astype(str).str.strip()
+
+        # 去掉空行和已取消的行
+        chunk = chunk[(chunk['name'] != '') & (chunk['name'] != 'nan') & (chunk['room_type'] != '')]
+        chunk = chunk[chunk['status'].fillna('').astype(str).str.strip().str.upper() != 'X']
+        if chunk.empty:
+            return
+
+        grouped = chunk.groupby(['name', 'room_type'], sort=False).agg(
+            room_count=('room_count', 'sum'),
+            price=('price', 'first'),
+            arrival=('arrival', 'first'),
+            departure=('departure', 'first'),
+            arrival_at=('arrival_at', 'first'),
+            departure_at=('departure_at', 'first'),
+            days=('days', 'max'),
+            rate_code=('rate_code', 'first'),
+            flag=('flag', 'first'),
+        )
+
+        for (name, room_type), row in zip(grouped.index, grouped.itertuples(index=False)):
+            booking = self.bookings.setdefault(name, {
+                'rooms': {},
+                'arrival': row.arrival,
+                'departure': row.departure,
+                'arrival_at': None,
+                'departure_at': None,
+                'days': 0,
+            })
+            if not booking['arrival']:
+                booking['arrival'] = row.arrival
+            if not booking['departure']:
+                booking['departure'] = row.departure
+            if not booking['arrival_at'] and isinstance(row.arrival_at, str):
+                booking['arrival_at'] = row.arrival_at
+            if not booking['departure_at'] and isinstance(row.departure_at, str):
+                booking['departure_at'] = row.departure_at
+            booking['days'] = max(booking['days'], int(row.days))
+
+            room = booking['rooms'].get(room_type)
+            if room is None:
+                booking['rooms'][room_type] = [int(row.room_count), float(row.price), row.rate_code, row.flag]
+            else:
+                room[0] += int(row.room_count)
+
+    def to_bookings(self) -> List[Dict]:
+        """输出与parse_booking_data相同结构的预订数据列表"""
+        results = []
+        for booking_id, booking in self.bookings.items():
+            rooms = booking['rooms']
+            room_counts = [room[0] for room in rooms.values()]
+            total_rooms = sum(room_counts)
+            default_flag = '团体' if not booking_id.startswith('FIT') else '散客'
+            results.append({
+                'booking_id': booking_id,
+                'room_types': list(rooms),
+                'room_counts': room_counts,
+                'prices': [room[1] for room in rooms.values()],
+                'arrival': booking['arrival'] or "未知",
+                'departure': booking['departure'] or "未知",
+                'days': booking['days'],
+                'total_rooms': total_rooms,
+                'total_people': total_rooms,
+                'rate_codes': [room[2] for room in rooms.values()],
+                'flags': [room[3] or default_flag for room in rooms.values()]
+            })
+        add_stay_dates(results)
+
+        # Excel日期单元格自带年份，直接使用，不按当前日期推断（历史或跨年的导出会推断错年份）
+        for result, booking in zip(results, self.bookings.values()):
+            if booking['arrival_at']:
+                result['arrival_at'] = booking['arrival_at']
+            if booking['departure_at']:
+                result['departure_at'] = booking['departure_at']
+            if booking['arrival_at'] and booking['departure_at']:
+                result['days'] = (date.fromisoformat(booking['departure_at'][:10]) -
+                                  date.fromisoformat(booking['arrival_at'][:10])).days
+        return results
+
+
+def detect_csv_encoding(file, sample_size: int = 65536) -> str:
+    """根据文件开头的样本判断CSV编码，PMS常见UTF-8和GBK两种"""
+    if isinstance(file, (str, os.PathLike)):
+        with open(file, 'rb') as f:
+            sample = f.read(sample_size)
+    else:
+        file.seek(0)
+        sample = file.read(sample_size)
+        file.seek(0)
+
+    try:
+        # 样本末尾可能截断多字节字符，使用增量解码器忽略末尾
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+        return 'utf-8-sig'
+    except UnicodeDecodeError:
+        return 'gbk'
+
+
+def iter_csv_chunks(file, chunk_size: int = CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    """分块读取CSV导出"""
+    encoding = detect_csv_encoding(file)
+    reader = pd.read_csv(file, chunksize=chunk_size, dtype=str, encoding=encoding,
+                         skipinitialspace=True)
+    for chunk in reader:
+        yield normalize_columns(chunk)
+
+
+def format_excel_cell(value):
+    """Excel中的日期单元格（datetime/Timestamp）按PMS文本格式MM/DD HH:MM输出，与CSV/PDF导出一致"""
+    if isinstance(value, date):
+        return value.strftime('%m/%d %H:%M')
+    return value
+
+
+def split_excel_dates(chunk: pd.DataFrame) -> pd.DataFrame:
+    """到达/离开的日期单元格保留年份写入arrival_at/departure_at，arrival/departure只用于显示；
+    其余单元格与CSV一样按文本处理，空单元格保持为空"""
+    dates = {}
+    for column in ['arrival', 'departure']:
+        if column in chunk.columns:
+            cells = chunk[column]
+            dates[column + '_at'] = [cell.strftime('%Y-%m-%dT%H:%M') if isinstance(cell, date) else None
+                                     for cell in cells]
+            dates[column] = [format_excel_cell(cell) for cell in cells]
+    chunk = chunk.where(chunk.isna(), chunk.astype(str))
+    return chunk.assign(**dates)
+
+
+def iter_excel_chunks(file, chunk_size: int = CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    """以只读模式逐行读取Excel导出，按批输出"""
+    if not EXCEL_AVAILABLE:
+        raise RuntimeError("未安装openpyxl，无法读取Excel导出文件")
+
+    workbook = openpyxl.load_workbook(file, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = None
+        for row in rows:
+            if row and any(cell is not None for cell in row):
+                header = [str(cell).strip() if cell is not None else '' for cell in row]
+                break
+        if header is None:
+            return
+
+        batch = []
+        for row in rows:
+            batch.append(row[:len(header)])
+            if len(batch) >= chunk_size:
+                yield split_excel_dates(normalize_columns(pd.DataFrame(batch, columns=header, dtype=object)))
+                batch = []
+        if batch:
+            yield split_excel_dates(normalize_columns(pd.DataFrame(batch, columns=header, dtype=object)))
+    finally:
+        workbook.close()
+
+
+def iter_pdf_chunks(file, chunk_size: int = CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    """逐页读取PDF文本层并解析预订行，按批输出"""
+    if not PDF_AVAILABLE:
+        raise RuntimeError("未安装pdfplumber，无法读取PDF导出文件")
+
+    with pdfplumber.open(file) as pdf:
+        batch = []
+        for page in pdf.pages:
+            batch.extend(parse_text_rows(page.extract_text() or ''))
+            # 释放已解析页面的缓存
+            page.flush_cache()
+            if len(batch) >= chunk_size:
+                yield pd.DataFrame(batch)
+                batch = []
+        if batch:
+            yield pd.DataFrame(batch)
+
+
+def read_export(file, filename: str, chunk_size: int = CHUNK_SIZE) -> List[Dict]:
+    """读取PMS导出文件并返回预订数据列表"""
+    file_type = export_type(filename)
+    if file_type == 'csv':
+        chunks = iter_csv_chunks(file, chunk_size)
+    elif file_type == 'xlsx':
+        chunks = iter_excel_chunks(file, chunk_size)
+    elif file_type == 'pdf':
+        chunks = iter_pdf_chunks(file, chunk_size)
+    else:
+        raise ValueError(f"不支持的导出文件类型: {filename}")
+
+    accumulator = BookingAccumulator()
+    for chunk in chunks:
+        accumulator.add_chunk(chunk)
+
+    return accumulator.to_bookings()
@@ -0,0 +1,23 @@
+"""
+gunicorn配置
+启动提取服务: gunicorn -c gunicorn.conf.py api:app
+"""
+
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+
+# OCR是CPU密集型任务，默认每个CPU核心一个worker
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+worker_class = 'sync'
+
+# 单张图片OCR可能较慢
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+graceful_timeout = 30
+
+# 定期重启worker，避免OCR库的内存增长
+max_requests = 500
+max_requests_jitter = 50
+
+accesslog = '-'
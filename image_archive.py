@@ -0,0 +1,472 @@
+#!/usr/bin/env python3
+"""
+截图归档
+上传的截图按内容哈希去重，无损重新压缩后追加写入少量打包文件(pack)，不在磁盘上保留成千上万个小文件。
+索引文件为定长记录(哈希 -> 打包文件/偏移/长度)，以内存映射方式读取；读取图片时直接返回打包文件
+内存映射的切片，不复制数据。删除只标记索引记录，compact时重写打包文件回收空间:
+    python image_archive.py status
+    python image_archive.py reprocess      # 对预处理版本过期或未识别的截图重新OCR
+    python image_archive.py delete <内容哈希> ...
+    python image_archive.py compact
+"""
+
+import argparse
+import io
+import mmap
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Tuple
+
+import numpy as np
+from PIL import Image, features
+
+from ocr_store import DATA_DIR
+
+# 文件锁：POSIX使用flock，Windows没有fcntl，改用msvcrt锁定锁文件的第一个字节
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+DEFAULT_ARCHIVE_DIR = os.path.join(DATA_DIR, 'archive')
+
+# 单个打包文件的大小上限，超过后写入新的打包文件
+MAX_PACK_BYTES = 256 * 1024 * 1024
+
+INDEX_MAGIC = b'MLIDX001'
+ENTRY_MAGIC = b'MLPK'
+
+# 索引记录：sha256哈希、打包文件编号、偏移、长度、删除标记、压缩格式
+INDEX_DTYPE = np.dtype([
+    ('digest', 'S32'),
+    ('pack', '<u4'),
+    ('offset', '<u8'),
+    ('length', '<u4'),
+    ('deleted', 'u1'),
+    ('format', 'u1'),
+    ('reserved', 'V2'),
+])
+
+# 打包文件中每个条目的头部：magic + 哈希 + 数据长度
+ENTRY_HEADER_SIZE = len(ENTRY_MAGIC) + 32 + 4
+
+# 压缩格式：截图需要无损保存，优先使用无损WebP（通常比PNG小30%以上）
+FORMAT_ORIGINAL, FORMAT_PNG, FORMAT_WEBP = 0, 1, 2
+
+
+def _digest(value: bytes) -> bytes:
+    """S32字段读出时会去掉末尾的空字节，补齐为32字节的哈希"""
+    return bytes(value).ljust(32, b'\x00')
+
+
+def _release(view: mmap.mmap):
+    """关闭内存映射；仍有调用方持有read()返回的切片时不能关闭，交给垃圾回收"""
+    try:
+        view.close()
+    except BufferError:
+        pass
+
+
+def _lock_file(lock_file):
+    """阻塞直到取得锁文件的排他锁"""
+    if fcntl is not None:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        return
+    lock_file.seek(0)
+    while True:
+        try:
+            # LK_LOCK重试约10秒后仍未取得锁时抛出OSError，继续等待
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+            return
+        except OSError:
+            pass
+
+
+def _unlock_file(lock_file):
+    if fcntl is not None:
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+        return
+    lock_file.seek(0)
+    msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def recompress(content: bytes) -> Tuple[bytes, int]:
+    """无损重新压缩截图，结果不比原文件小时保留原文件"""
+    try:
+        with Image.open(io.BytesIO(content)) as image:
+            image.load()
+            if image.mode not in ('RGB', 'RGBA', 'L'):
+                image = image.convert('RGB')
+            buffer = io.BytesIO()
+            if features.check('webp'):
+                image.save(buffer, format='WEBP', lossless=True, quality=100, method=4)
+                fmt = FORMAT_WEBP
+            else:
+                image.save(buffer, format='PNG', optimize=True)
+                fmt = FORMAT_PNG
+    except Exception as e:
+        print(f"截图重新压缩失败，保存原文件: {str(e)}")
+        return content, FORMAT_ORIGINAL
+
+    compressed = buffer.getvalue()
+    if len(compressed) >= len(content):
+        return content, FORMAT_ORIGINAL
+    return compressed, fmt
+
+
+class ImageArchive:
+    """基于打包文件和内存映射索引的截图归档"""
+
+    def __init__(self, directory: str = DEFAULT_ARCHIVE_DIR, max_pack_bytes: int = MAX_PACK_BYTES):
+        self.directory = directory
+        self.max_pack_bytes = max_pack_bytes
+        self.index_path = os.path.join(directory, 'index.bin')
+        self.lock = threading.RLock()
+        os.makedirs(directory, exist_ok=True)
+
+        if not os.path.exists(self.index_path):
+            with open(self.index_path, 'wb') as f:
+                f.write(INDEX_MAGIC)
+
+        self._index_file = None
+        self._index_map = None
+        self._index_size = 0
+        self._index_inode = None
+        self.entries = np.zeros(0, dtype=INDEX_DTYPE)
+        self.positions = {}  # 哈希 -> 索引记录行号
+        self._pack_maps = {}  # 打包文件编号 -> (文件, mmap)
+        self._load_index()
+
+    # ---- 索引 ----
+
+    def _load_index(self):
+        """内存映射索引文件，记录数组直接指向映射的内存。
+        文件只增长时只登记新增的记录；被compact替换(inode变化)时重新加载"""
+        stat = os.stat(self.index_path)
+        if stat.st_size == self._index_size and stat.st_ino == self._index_inode:
+            return
+        grown = stat.st_ino == self._index_inode and stat.st_size > self._index_size
+        first_new = len(self.entries) if grown else 0
+
+        self._close_index()
+        self._index_file = open(self.index_path, 'r+b')
+        count = (stat.st_size - len(INDEX_MAGIC)) // INDEX_DTYPE.itemsize
+        if count > 0:
+            self._index_map = mmap.mmap(self._index_file.fileno(), 0)
+            self.entries = np.frombuffer(self._index_map, dtype=INDEX_DTYPE, count=count, offset=len(INDEX_MAGIC))
+        self._index_size = stat.st_size
+        self._index_inode = stat.st_ino
+
+        # 同一哈希有多条记录时以最后一条为准
+        if not grown:
+            self.positions = {}
+            self._close_packs()
+        for row in range(first_new, len(self.entries)):
+            self.positions[_digest(self.entries['digest'][row])] = row
+
+    def _close_index(self):
+        self.entries = np.zeros(0, dtype=INDEX_DTYPE)
+        if self._index_map is not None:
+            _release(self._index_map)
+            self._index_map = None
+        if self._index_file is not None:
+            self._index_file.close()
+            self._index_file = None
+        self._index_size = 0
+
+    @contextmanager
+    def _write_lock(self):
+        """线程锁加文件锁，多个进程（如多个gunicorn worker）可以同时写入同一个归档"""
+        with self.lock:
+            with open(os.path.join(self.directory, 'archive.lock'), 'w') as lock_file:
+                _lock_file(lock_file)
+                try:
+                    yield
+                finally:
+                    _unlock_file(lock_file)
+
+    def _find(self, content_hash: str) -> Optional[int]:
+        """查找未删除的索引记录行号，先检查其他进程是否追加了记录或已compact"""
+        self._load_index()
+        row = self.positions.get(bytes.fromhex(content_hash))
+        if row is None or self.entries['deleted'][row]:
+            return None
+        return row
+
+    def __contains__(self, content_hash: str) -> bool:
+        with self.lock:
+            return self._find(content_hash) is not None
+
+    def __len__(self) -> int:
+        with self.lock:
+            self._load_index()
+            return int(np.count_nonzero(self.entries['deleted'] == 0))
+
+    # ---- 打包文件 ----
+
+    def _pack_path(self, pack: int) -> str:
+        return os.path.join(self.directory, f'pack-{pack:05d}.pack')
+
+    def _pack_numbers(self):
+        return sorted(int(name[5:10]) for name in os.listdir(self.directory)
+                      if name.startswith('pack-') and name.endswith('.pack'))
+
+    def _current_pack(self) -> int:
+        """当前写入的打包文件编号，写满后换新文件"""
+        packs = self._pack_numbers()
+        if not packs:
+            return 1
+        if os.path.getsize(self._pack_path(packs[-1])) >= self.max_pack_bytes:
+            return packs[-1] + 1
+        return packs[-1]
+
+    def _pack_view(self, pack: int, end: int) -> memoryview:
+        """打包文件的内存映射，文件变长后重新映射"""
+        cached = self._pack_maps.get(pack)
+        if cached is None or len(cached[1]) < end:
+            if cached is not None:
+                _release(cached[1])
+                cached[0].close()
+            f = open(self._pack_path(pack), 'rb')
+            cached = (f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+            self._pack_maps[pack] = cached
+        return memoryview(cached[1])
+
+    def _close_packs(self):
+        for f, view in self._pack_maps.values():
+            _release(view)
+            f.close()
+        self._pack_maps = {}
+
+    # ---- 读写 ----
+
+    def put(self, content_hash: str, content: bytes) -> bool:
+        """归档一张截图，已存在时跳过，返回是否新写入"""
+        with self._write_lock():
+            if self._find(content_hash) is not None:
+                return False
+
+            payload, fmt = recompress(content)
+            digest = bytes.fromhex(content_hash)
+            pack = self._current_pack()
+            with open(self._pack_path(pack), 'ab') as f:
+                offset = f.tell() + ENTRY_HEADER_SIZE
+                f.write(ENTRY_MAGIC + digest + len(payload).to_bytes(4, 'little'))
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+
+            record = np.zeros(1, dtype=INDEX_DTYPE)
+            record[0] = (digest, pack, offset, len(payload), 0, fmt, b'\x00\x00')
+            with open(self.index_path, 'ab') as f:
+                f.write(record.tobytes())
+            self._load_index()
+            return True
+
+    def read(self, content_hash: str) -> Optional[memoryview]:
+        """读取归档的截图数据，返回打包文件内存映射的切片（不复制）"""
+        with self.lock:
+            row = self._find(content_hash)
+            if row is None:
+                return None
+            entry = self.entries[row]
+            start = int(entry['offset'])
+            end = start + int(entry['length'])
+            return self._pack_view(int(entry['pack']), end)[start:end]
+
+    def open_image(self, content_hash: str) -> Optional[Image.Image]:
+        """读取并解码归档的截图"""
+        data = self.read(content_hash)
+        if data is None:
+            return None
+        image = Image.open(io.BytesIO(data))
+        image.load()
+        return image
+
+    def delete(self, content_hash: str) -> bool:
+        """标记删除，空间在compact时回收"""
+        with self._write_lock():
+            row = self._find(content_hash)
+            if row is None:
+                return False
+            # 直接修改内存映射中的删除标记
+            self.entries['deleted'][row] = 1
+            self._index_map.flush()
+            return True
+
+    def iter_entries(self) -> Iterator[Tuple[str, memoryview]]:
+        """按打包文件和偏移顺序遍历所有截图（顺序读磁盘），产出(哈希, 数据切片)"""
+        with self.lock:
+            self._load_index()
+            entries = self.entries.copy()
+        live = entries[entries['deleted'] == 0]
+        # 同一哈希只取最后一条记录
+        _, last = np.unique(live['digest'][::-1], return_index=True)
+        live = live[len(live) - 1 - last]
+        for entry in np.sort(live, order=['pack', 'offset']):
+            start = int(entry['offset'])
+            end = start + int(entry['length'])
+            with self.lock:
+                view = self._pack_view(int(entry['pack']), end)
+            yield _digest(entry['digest']).hex(), view[start:end]
+
+    def stats(self) -> Dict:
+        """归档统计"""
+        with self.lock:
+            self._load_index()
+            entries = self.entries
+            packs = [name for name in os.listdir(self.directory) if name.endswith('.pack')]
+            deleted = entries['deleted'] != 0
+            return {
+                'entries': int(np.count_nonzero(~deleted)),
+                'deleted': int(np.count_nonzero(deleted)),
+                'packs': len(packs),
+                'live_bytes': int(entries['length'][~deleted].sum()),
+                'dead_bytes': int(entries['length'][deleted].sum()),
+                'disk_bytes': sum(os.path.getsize(os.path.join(self.directory, name)) for name in packs),
+            }
+
+    def compact(self, min_dead_ratio: float = 0.2) -> int:
+        """重写已删除数据占比超过min_dead_ratio的打包文件，并重写索引去掉删除的记录，返回回收的字节数。
+        全部删除的打包文件不重写，没有存活记录引用的打包文件直接删除"""
+        with self._write_lock():
+            self._load_index()
+            entries = self.entries.copy()
+            live = entries[entries['deleted'] == 0]
+            _, last = np.unique(live['digest'][::-1], return_index=True)
+            live = np.sort(live[len(live) - 1 - last], order=['pack', 'offset'])
+
+            before = sum(os.path.getsize(self._pack_path(p)) for p in self._pack_numbers())
+            next_pack = self._current_pack() + 1
+
+            for pack in np.unique(entries['pack']):
+                in_pack = entries['pack'] == pack
+                dead = entries['length'][in_pack & (entries['deleted'] != 0)].sum()
+                if dead == 0 or dead < min_dead_ratio * entries['length'][in_pack].sum():
+                    continue
+
+                # 存活条目复制到新的打包文件；切片用完立即释放，否则关闭内存映射失败，Windows上无法删除旧文件
+                rows = np.flatnonzero(live['pack'] == pack)
+                if len(rows) == 0:
+                    continue
+                with open(self._pack_path(next_pack), 'ab') as f:
+                    for row in rows:
+                        entry = live[row]
+                        start = int(entry['offset'])
+                        end = start + int(entry['length'])
+                        new_offset = f.tell() + ENTRY_HEADER_SIZE
+                        f.write(ENTRY_MAGIC + _digest(entry['digest']) + int(entry['length']).to_bytes(4, 'little'))
+                        with self._pack_view(int(pack), end) as view, view[start:end] as data:
+                            f.write(data)
+                        live['pack'][row] = next_pack
+                        live['offset'][row] = new_offset
+                    f.flush()
+                    os.fsync(f.fileno())
+                next_pack += 1
+
+            # 新索引写入临时文件后原子替换
+            temp_path = self.index_path + '.tmp'
+            with open(temp_path, 'wb') as f:
+                f.write(INDEX_MAGIC)
+                f.write(live.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            self._close_index()
+            self._close_packs()
+            os.replace(temp_path, self.index_path)
+            # 已重写、全部删除和之前遗留的空打包文件都不再被索引引用
+            referenced = set(int(pack) for pack in np.unique(live['pack']))
+            for pack in self._pack_numbers():
+                if pack in referenced:
+                    continue
+                try:
+                    os.remove(self._pack_path(pack))
+                except PermissionError as e:
+                    # Windows上其他调用方仍持有read()返回的切片时文件不能删除，下次compact再删除
+                    print(f"打包文件删除失败: {str(e)}")
+            self._load_index()
+
+            after = sum(os.path.getsize(self._pack_path(p)) for p in self._pack_numbers())
+            return int(before - after)
+
+    def close(self):
+        with self.lock:
+            self._close_packs()
+            self._close_index()
+
+
+def _stale_images(archive: ImageArchive, versions: Dict[str, int], force: bool):
+    """逐张解码需要重新识别的截图，产出(内容哈希, 图片)"""
+    from data_extractor import PREPROCESSOR_VERSION
+
+    for content_hash, data in archive.iter_entries():
+        if not force and versions.get(content_hash, 0) >= PREPROCESSOR_VERSION:
+            continue
+        try:
+            image = Image.open(io.BytesIO(data))
+            image.load()
+        except Exception as e:
+            print(f"截图解码失败: {content_hash}: {str(e)}")
+            continue
+        yield content_hash, image
+
+
+def reprocess_archive(archive: ImageArchive, store=None, force: bool = False, workers: int = 1) -> int:
+    """对归档中未识别或预处理版本过期的截图重新OCR，结果写入OCR存储，返回处理的数量。
+    workers大于1时在多个进程中识别，解码后的图片通过共享内存传给工作进程"""
+    from data_extractor import HotelDataExtractor
+    from ocr_store import OCRStore
+    from shared_images import ocr_in_workers
+
+    store = store or OCRStore()
+    images = _stale_images(archive, store.preprocessor_versions(), force)
+    if workers > 1:
+        results = ocr_in_workers(images, workers)
+    else:
+        extractor = HotelDataExtractor()
+        results = ((content_hash, extractor.extract_data_and_ocr(image), None) for content_hash, image in images)
+
+    processed = 0
+    for content_hash, result, error in results:
+        if error is not None:
+            print(f"重新识别失败: {content_hash}: {str(error)}")
+            continue
+        data, ocr = result
+        store.save(content_hash, f"archive:{content_hash[:12]}", ocr, data)
+        processed += 1
+    return processed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="截图归档管理")
+    parser.add_argument('command', choices=['status', 'reprocess', 'delete', 'compact'])
+    parser.add_argument('hashes', nargs='*', help="delete时要删除的截图内容哈希")
+    parser.add_argument('--path', default=DEFAULT_ARCHIVE_DIR, help="归档目录")
+    parser.add_argument('--force', action='store_true', help="reprocess时重新识别所有截图")
+    parser.add_argument('--workers', type=int, default=1, help="reprocess时的识别进程数")
+    parser.add_argument('--min-dead-ratio', type=float, default=0.2, help="compact时重写的打包文件的最小删除占比")
+    args = parser.parse_args()
+
+    archive = ImageArchive(args.path)
+    start = time.perf_counter()
+    if args.command == 'reprocess':
+        print(f"完成，共重新识别 {reprocess_archive(archive, force=args.force, workers=args.workers)} 张截图")
+    elif args.command == 'delete':
+        if not args.hashes:
+            parser.error("delete需要指定截图的内容哈希")
+        deleted = sum(archive.delete(content_hash) for content_hash in args.hashes)
+        print(f"完成，标记删除 {deleted} 张截图，运行compact回收空间")
+    elif args.command == 'compact':
+        print(f"完成，回收 {archive.compact(args.min_dead_ratio) / 1024 / 1024:.1f}MB")
+
+    stats = archive.stats()
+    print(f"截图: {stats['entries']}，已删除: {stats['deleted']}，打包文件: {stats['packs']}，"
+          f"占用: {stats['disk_bytes'] / 1024 / 1024:.1f}MB（可回收 {stats['dead_bytes'] / 1024 / 1024:.1f}MB），"
+          f"耗时 {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
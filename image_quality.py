@@ -0,0 +1,148 @@
+"""
+图片质量检查
+OCR前在缩小的灰度副本上快速估计清晰度、文字尺寸(有效DPI)、对比度和表格线，
+提前拒绝无法识别的图片，对质量一般的图片改用增强预处理
+"""
+
+import numpy as np
+from PIL import Image
+from typing import Dict
+
+# 检查时缩小到的最大宽度和最大像素数（长截图按像素数限制）
+ANALYSIS_WIDTH = 800
+ANALYSIS_PIXELS = 800 * 1000
+
+# 图片最短边低于该值视为缩略图
+MIN_SIDE = 200
+
+# 拉普拉斯方差（模糊程度），越小越模糊
+BLUR_REJECT = 20.0
+BLUR_WARN = 80.0
+
+# 对比度（背景与文字的灰度差）
+CONTRAST_REJECT = 30.0
+CONTRAST_WARN = 70.0
+
+# 文字行高（原图像素），Tesseract在字高20像素以上识别效果最好
+TEXT_HEIGHT_REJECT = 6.0
+TEXT_HEIGHT_WARN = 12.0
+TARGET_TEXT_HEIGHT = 20.0
+
+# 按10pt字号换算有效DPI
+TEXT_POINT_SIZE = 10.0
+
+# 墨迹像素占比过低视为空白图片
+MIN_INK_RATIO = 0.002
+
+# 一行/一列中墨迹占比超过该值视为表格线
+TABLE_LINE_RATIO = 0.6
+
+
+def _runs(mask: np.ndarray) -> np.ndarray:
+    """返回布尔序列中连续True段的长度"""
+    padded = np.concatenate(([False], mask, [False])).astype(np.int8)
+    edges = np.flatnonzero(np.diff(padded))
+    return edges[1::2] - edges[::2]
+
+
+def assess_image_quality(image: Image.Image) -> Dict:
+    """评估图片是否适合OCR，返回各项指标、结论(ok/warn/reject)和原因"""
+    width, height = image.size
+    reasons = []
+
+    if min(width, height) < MIN_SIDE:
+        return {
+            'status': 'reject', 'enhance': False, 'reasons': [f"图片尺寸过小({width}x{height})"],
+            'blur': 0.0, 'contrast': 0.0, 'text_height': 0.0, 'effective_dpi': 0.0,
+            'ink_ratio': 0.0, 'table_lines': 0, 'upscale': 1.0
+        }
+
+    # 在缩小的灰度副本上计算，先按整数倍缩小再转灰度以减少计算量
+    factor = max(1, width // ANALYSIS_WIDTH, int(np.sqrt(width * height / ANALYSIS_PIXELS)))
+    if factor > 1 and image.mode not in ('L', 'RGB', 'RGBA'):
+        # reduce不支持调色板、二值和16位灰度图片
+        image = image.convert('RGB' if image.mode in ('P', 'PA') else 'L')
+    small = image.reduce(factor) if factor > 1 else image
+    scale = small.size[0] / width
+    gray_u8 = np.asarray(small.convert('L'))
+    gray = gray_u8.astype(np.float32)
+
+    # 清晰度：拉普拉斯算子响应的方差
+    laplacian = (gray[1:-1, :-2] + gray[1:-1, 2:] + gray[:-2, 1:-1] + gray[2:, 1:-1]
+                 - 4 * gray[1:-1, 1:-1])
+    blur = float(laplacian.var())
+
+    # 对比度：背景（灰度中位数）与文字（p1或p99）的差，用直方图计算分位数比排序快
+    cdf = np.cumsum(np.bincount(gray_u8.ravel(), minlength=256)) / gray_u8.size
+    p1, p50, p99 = (float(np.searchsorted(cdf, q)) for q in (0.01, 0.5, 0.99))
+    dark_background = p50 < 128
+    ink_level = p99 if dark_background else p1
+    contrast = abs(p50 - ink_level)
+
+    # 墨迹：以背景和文字灰度的中点二值化（兼容深色背景）
+    threshold = (p50 + ink_level) / 2
+    ink = gray > threshold if dark_background else gray < threshold
+    ink_ratio = float(ink.mean())
+
+    # 表格线：墨迹几乎贯穿整行/整列
+    row_ratio = ink.mean(axis=1)
+    col_ratio = ink.mean(axis=0)
+    line_rows = row_ratio > TABLE_LINE_RATIO
+    line_cols = col_ratio > TABLE_LINE_RATIO
+    table_lines = int(len(_runs(line_rows)) + len(_runs(line_cols)))
+
+    # 文字行高：有墨迹且不是表格线的连续行，换算回原图像素
+    text_rows = (row_ratio > 0.01) & ~line_rows
+    runs = _runs(text_rows)
+    runs = runs[runs >= 2] if np.any(runs >= 2) else runs
+    text_height = float(np.median(runs) / scale) if len(runs) else 0.0
+    effective_dpi = text_height * 72 / TEXT_POINT_SIZE
+
+    status = 'ok'
+    enhance = False
+
+    if ink_ratio < MIN_INK_RATIO:
+        reasons.append("图片中几乎没有文字")
+        status = 'reject'
+    if blur < BLUR_REJECT:
+        reasons.append(f"图片模糊(清晰度 {blur:.0f})")
+        status = 'reject'
+    if contrast < CONTRAST_REJECT:
+        reasons.append(f"对比度过低({contrast:.0f})")
+        status = 'reject'
+    if 0 < text_height < TEXT_HEIGHT_REJECT:
+        reasons.append(f"文字过小(约 {text_height:.0f} 像素)")
+        status = 'reject'
+
+    if status != 'reject':
+        if blur < BLUR_WARN:
+            reasons.append(f"图片略模糊(清晰度 {blur:.0f})")
+            enhance = True
+        if contrast < CONTRAST_WARN:
+            reasons.append(f"对比度偏低({contrast:.0f})")
+            enhance = True
+        if 0 < text_height < TEXT_HEIGHT_WARN:
+            reasons.append(f"文字偏小(约 {text_height:.0f} 像素)")
+            enhance = True
+        if table_lines == 0:
+            reasons.append("未检测到表格线，可能不是预订列表截图")
+        if reasons:
+            status = 'warn'
+
+    # 文字偏小时OCR前放大的倍数
+    upscale = 1.0
+    if enhance and 0 < text_height < TARGET_TEXT_HEIGHT:
+        upscale = min(3.0, TARGET_TEXT_HEIGHT / text_height)
+
+    return {
+        'status': status,
+        'enhance': enhance,
+        'reasons': reasons,
+        'blur': blur,
+        'contrast': contrast,
+        'text_height': text_height,
+        'effective_dpi': effective_dpi,
+        'ink_ratio': ink_ratio,
+        'table_lines': table_lines,
+        'upscale': upscale
+    }
@@ -0,0 +1,161 @@
+"""
+团队房量与库存冲突检查
+把每个预订的到达/离开日期和各房型房数展开为逐晚需求（差分数组+前缀和），
+与配置的酒店各房型库存比较，找出超售的房型和日期
+"""
+
+import json
+import os
+import numpy as np
+import pandas as pd
+from datetime import date, timedelta
+from typing import Dict, List, Optional
+
+from booking_dates import normalize_stays
+from booking_history import booking_key
+
+DEFAULT_INVENTORY_PATH = os.environ.get('HOUSE_INVENTORY_PATH', 'inventory.json')
+
+# 默认检查范围（天）
+DEFAULT_HORIZON = 365
+
+
+def load_house_inventory(path: str = DEFAULT_INVENTORY_PATH) -> Dict[str, int]:
+    """读取各房型库存配置 {房类: 房间数}，文件不存在时返回空配置"""
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return {room_type: int(count) for room_type, count in json.load(f).items()}
+
+
+class InventoryChecker:
+    """逐晚房量需求。每个房型一行差分数组，预订的每个房型在到达日+房数、离开日-房数，
+    前缀和即为每晚需求。同一预订再次分析时先减去旧的贡献再加上新的。"""
+
+    def __init__(self, inventory: Optional[Dict[str, int]] = None, start: Optional[date] = None,
+                 horizon: int = DEFAULT_HORIZON):
+        self.inventory = inventory if inventory is not None else load_house_inventory()
+        self.start = start or date.today() - timedelta(days=30)
+        self.horizon = horizon
+        self.room_index = {}  # 房类 -> 行号
+        self.diff = np.zeros((0, horizon + 1), dtype=np.int32)
+        self.contributions = {}  # 预订号 -> (行号数组, 开始数组, 结束数组, 房数数组)
+        self._demand = None
+
+    def _rows_for(self, room_types: List[str]) -> np.ndarray:
+        """房类转换为行号，新房类追加新行"""
+        new_types = [rt for rt in dict.fromkeys(room_types) if rt not in self.room_index]
+        if new_types:
+            for room_type in new_types:
+                self.room_index[room_type] = len(self.room_index)
+            self.diff = np.vstack([self.diff, np.zeros((len(new_types), self.horizon + 1), dtype=np.int32)])
+        return np.array([self.room_index[rt] for rt in room_types], dtype=np.int64)
+
+    def _apply(self, rows, starts, ends, counts, sign: int):
+        np.add.at(self.diff, (rows, starts), sign * counts)
+        np.add.at(self.diff, (rows, ends), -sign * counts)
+        self._demand = None
+
+    def upsert_bookings(self, bookings: List[Dict]):
+        """批量加入（或替换）预订的房量需求"""
+        # 同一预订在本批中出现多次时只保留最后一个
+        latest = {booking_key(data['booking_id']): data for data in bookings}
+        if not latest:
+            return
+
+        # 先撤销这些预订之前的贡献
+        for key in latest:
+            old = self.contributions.pop(key, None)
+            if old is not None:
+                self._apply(*old, sign=-1)
+
+        # 所有预订的房型行展开为一维数组，一次性计算
+        keys, room_types, counts, arrivals, departures = [], [], [], [], []
+        for key, data in latest.items():
+            for room_type, count in zip(data['room_types'], data['room_counts']):
+                keys.append(key)
+                room_types.append(room_type)
+                counts.append(count)
+                arrivals.append(data['arrival'])
+                departures.append(data['departure'])
+        if not keys:
+            return
+
+        # 年份按检查范围的中点推断，日期落在检查范围内
+        stays = normalize_stays(arrivals, departures, self.start + timedelta(days=self.horizon // 2))
+        start_ts = pd.Timestamp(self.start)
+        starts = (stays['arrival'] - start_ts).dt.days.to_numpy(dtype=float)
+        ends = (stays['departure'] - start_ts).dt.days.to_numpy(dtype=float)
+
+        # 无法解析日期或完全不在检查范围内的行忽略，其余截断到范围内
+        valid = ~np.isnan(starts) & ~np.isnan(ends) & (ends > 0) & (starts < self.horizon)
+        starts = np.clip(starts, 0, self.horizon).astype(np.int64)
+        ends = np.clip(ends, 0, self.horizon).astype(np.int64)
+        counts = np.asarray(counts, dtype=np.int32)
+        rows = self._rows_for(room_types)
+        keys = np.asarray(keys)
+
+        rows, starts, ends, counts, keys = rows[valid], starts[valid], ends[valid], counts[valid], keys[valid]
+        self._apply(rows, starts, ends, counts, sign=1)
+
+        # 记录每个预订的贡献，便于之后替换
+        order = np.argsort(keys, kind='stable')
+        unique_keys, first = np.unique(keys[order], return_index=True)
+        for key, part in zip(unique_keys, np.split(order, first[1:])):
+            self.contributions[key] = (rows[part], starts[part], ends[part], counts[part])
+
+    def upsert_booking(self, data: Dict):
+        """加入（或替换）一个预订的房量需求"""
+        self.upsert_bookings([data])
+
+    def demand(self) -> np.ndarray:
+        """每个房型每晚的需求，形状为(房型数, 天数)"""
+        if self._demand is None:
+            self._demand = np.cumsum(self.diff, axis=1)[:, :self.horizon]
+        return self._demand
+
+    def demand_frame(self) -> pd.DataFrame:
+        """逐晚需求表，行为日期，列为房类"""
+        dates = pd.date_range(self.start, periods=self.horizon, freq='D')
+        return pd.DataFrame(self.demand().T, index=dates, columns=list(self.room_index))
+
+    def conflicts(self, room_types: Optional[List[str]] = None) -> pd.DataFrame:
+        """需求超过库存的(日期, 房类)，可限定房类"""
+        columns = ['日期', '房类', '需求', '库存', '超售']
+        types = [rt for rt in (self.room_index if room_types is None else room_types) if rt in self.room_index and rt in self.inventory]
+        if not types:
+            return pd.DataFrame(columns=columns)
+
+        rows = np.array([self.room_index[rt] for rt in types])
+        capacity = np.array([self.inventory[rt] for rt in types])[:, None]
+        demand = self.demand()[rows]
+        over_type, over_day = np.nonzero(demand > capacity)
+
+        return pd.DataFrame({
+            '日期': pd.Timestamp(self.start) + pd.to_timedelta(over_day, unit='D'),
+            '房类': np.asarray(types)[over_type],
+            '需求': demand[over_type, over_day],
+            '库存': capacity[over_type, 0],
+            '超售': demand[over_type, over_day] - capacity[over_type, 0],
+        }, columns=columns).sort_values(['日期', '房类']).reset_index(drop=True)
+
+    def check_booking(self, data: Dict) -> pd.DataFrame:
+        """加入预订后，返回该预订入住期间、所订房型上的超售情况"""
+        self.upsert_booking(data)
+        contribution = self.contributions.get(booking_key(data['booking_id']))
+        # 未配置库存或所订房型都不在库存中时没有超售
+        conflicts = self.conflicts(data['room_types'])
+        if contribution is None or conflicts.empty:
+            return self.conflicts([])
+
+        # 标出预订占用的(房型, 晚)
+        rows, starts, ends, counts = contribution
+        occupied = np.zeros(self.diff.shape, dtype=np.int32)
+        booked = counts > 0
+        np.add.at(occupied, (rows[booked], starts[booked]), 1)
+        np.add.at(occupied, (rows[booked], ends[booked]), -1)
+        occupied = np.cumsum(occupied, axis=1)[:, :self.horizon] > 0
+
+        day = (conflicts['日期'] - pd.Timestamp(self.start)).dt.days.to_numpy(dtype=np.int64)
+        row = np.array([self.room_index[rt] for rt in conflicts['房类']], dtype=np.int64)
+        return conflicts[occupied[row, day]].reset_index(drop=True)
@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+"""
+压力测试工具
+用样本截图模拟多个前台用户并发提取，统计延迟分位数、吞吐量、CPU和峰值内存，用于容量规划
+
+用法:
+    # 进程内直接调用extract_data_from_image，8个并发用户，持续60秒
+    python loadtest.py samples/ --concurrency 8 --duration 60
+
+    # 按每秒2个请求的泊松到达率压测HTTP提取服务（默认跳过服务端结果缓存，每次都完整提取）
+    python loadtest.py samples/ --url http://localhost:8000 --rate 2 --duration 60
+"""
+
+import argparse
+import io
+import json
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+# 尝试导入psutil，用于采样服务端进程的CPU和内存
+try:
+    import psutil
+    PSUTIL_AVAILABLE = True
+except ImportError:
+    PSUTIL_AVAILABLE = False
+
+# resource只在Unix上可用，Windows下CPU时间取自os.times()，峰值内存需要psutil
+try:
+    import resource
+except ImportError:
+    resource = None
+
+SAMPLE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.csv', '.xlsx', '.pdf')
+
+
+def load_corpus(paths: List[str]) -> List[Dict]:
+    """读取样本文件到内存，避免压测时磁盘IO干扰"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.lower().endswith(SAMPLE_EXTENSIONS):
+                    files.append(os.path.join(path, name))
+        else:
+            files.append(path)
+
+    corpus = []
+    for file_path in files:
+        with open(file_path, 'rb') as f:
+            corpus.append({'name': os.path.basename(file_path), 'content': f.read()})
+    return corpus
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """计算已排序数据的分位数（线性插值）"""
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * pct / 100
+    lower = int(k)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (k - lower)
+
+
+def process_usage() -> Dict:
+    """本进程和已结束子进程的CPU时间（秒）及峰值内存（MB）"""
+    if resource is not None:
+        own = resource.getrusage(resource.RUSAGE_SELF)
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        # Linux下ru_maxrss单位为KB，macOS下为字节
+        rss_unit = 1 if sys.platform == 'darwin' else 1024
+        return {
+            'cpu_seconds': own.ru_utime + own.ru_stime,
+            'child_cpu_seconds': children.ru_utime + children.ru_stime,
+            'peak_rss_mb': own.ru_maxrss * rss_unit / 1024 / 1024,
+            'child_peak_rss_mb': children.ru_maxrss * rss_unit / 1024 / 1024,
+        }
+    times = os.times()
+    peak_rss = 0.0
+    if PSUTIL_AVAILABLE:
+        memory = psutil.Process().memory_info()
+        peak_rss = getattr(memory, 'peak_wset', memory.rss) / 1024 / 1024
+    return {
+        'cpu_seconds': times.user + times.system,
+        'child_cpu_seconds': times.children_user + times.children_system,
+        'peak_rss_mb': peak_rss,
+        'child_peak_rss_mb': 0.0,
+    }
+
+
+def make_local_target() -> Callable[[Dict], None]:
+    """进程内调用提取器"""
+    from PIL import Image
+    from data_extractor import HotelDataExtractor
+
+    extractor = HotelDataExtractor()
+
+    def run(sample: Dict):
+        if extractor.is_export_file(sample['name']):
+            if not extractor.extract_data_from_export(io.BytesIO(sample['content']), sample['name']):
+                raise RuntimeError("导出文件未提取到数据")
+            return
+        image = Image.open(io.BytesIO(sample['content']))
+        if extractor.extract_data_from_image(image) is None:
+            raise RuntimeError("未提取到数据")
+
+    return run
+
+
+def make_http_target(url: str, timeout: float, use_cache: bool = False) -> Callable[[Dict], None]:
+    """调用HTTP提取服务，每个线程使用独立的会话。
+    样本会被反复发送，默认带nocache参数跳过服务端结果缓存，否则第一次之后都是缓存命中"""
+    import requests
+
+    endpoint = url.rstrip('/') + '/extract'
+    params = {} if use_cache else {'nocache': '1'}
+    local = threading.local()
+
+    def run(sample: Dict):
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        response = session.post(endpoint, params=params, files={'file': (sample['name'], sample['content'])},
+                                timeout=timeout)
+        response.raise_for_status()
+
+    return run
+
+
+class ServerSampler:
+    """后台采样服务端进程（含子进程）的CPU和内存"""
+
+    def __init__(self, pid: int, interval: float = 0.5):
+        self.process = psutil.Process(pid)
+        self.interval = interval
+        self.cpu_samples = []
+        self.peak_rss = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _processes(self):
+        return [self.process] + self.process.children(recursive=True)
+
+    def _run(self):
+        for proc in self._processes():
+            proc.cpu_percent(None)
+        while not self._stop.wait(self.interval):
+            cpu = 0.0
+            rss = 0
+            for proc in self._processes():
+                try:
+                    cpu += proc.cpu_percent(None)
+                    rss += proc.memory_info().rss
+                except psutil.NoSuchProcess:
+                    continue
+            self.cpu_samples.append(cpu)
+            self.peak_rss = max(self.peak_rss, rss)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self) -> Dict:
+        self._stop.set()
+        self._thread.join()
+        return {
+            'server_cpu_avg_percent': sum(self.cpu_samples) / len(self.cpu_samples) if self.cpu_samples else 0.0,
+            'server_cpu_max_percent': max(self.cpu_samples, default=0.0),
+            'server_peak_rss_mb': self.peak_rss / 1024 / 1024,
+        }
+
+
+class LoadTest:
+    """压测执行器，支持闭环（固定并发用户）和开环（固定到达率）两种模式"""
+
+    def __init__(self, target: Callable[[Dict], None], corpus: List[Dict], concurrency: int,
+                 duration: float, rate: Optional[float] = None, think_time: float = 0.0,
+                 max_requests: Optional[int] = None, seed: Optional[int] = None):
+        self.target = target
+        self.corpus = corpus
+        self.concurrency = concurrency
+        self.duration = duration
+        self.rate = rate
+        self.think_time = think_time
+        self.max_requests = max_requests
+        self.random = random.Random(seed)
+        self.latencies = []
+        self.errors = 0
+        self.issued = 0
+        self.lock = threading.Lock()
+
+    def _next_sample(self) -> Optional[Dict]:
+        with self.lock:
+            if self.max_requests is not None and self.issued >= self.max_requests:
+                return None
+            sample = self.corpus[self.issued % len(self.corpus)]
+            self.issued += 1
+            return sample
+
+    def _execute(self, sample: Dict, scheduled_at: float):
+        # 开环模式下延迟从计划到达时间算起，包含排队时间
+        try:
+            self.target(sample)
+            ok = True
+        except Exception as e:
+            print(f"请求失败: {sample['name']}: {str(e)}")
+            ok = False
+        latency = time.perf_counter() - scheduled_at
+        with self.lock:
+            if ok:
+                self.latencies.append(latency)
+            else:
+                self.errors += 1
+
+    def _user_loop(self, deadline: float):
+        while time.perf_counter() < deadline:
+            sample = self._next_sample()
+            if sample is None:
+                return
+            self._execute(sample, time.perf_counter())
+            if self.think_time:
+                time.sleep(self.random.expovariate(1 / self.think_time))
+
+    def _run_closed(self, deadline: float):
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            for _ in range(self.concurrency):
+                pool.submit(self._user_loop, deadline)
+
+    def _run_open(self, deadline: float):
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            next_arrival = time.perf_counter()
+            while next_arrival < deadline:
+                delay = next_arrival - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                sample = self._next_sample()
+                if sample is None:
+                    break
+                pool.submit(self._execute, sample, next_arrival)
+                next_arrival += self.random.expovariate(self.rate)
+
+    def run(self) -> Dict:
+        """执行压测并返回统计结果"""
+        usage_before = process_usage()
+        start = time.perf_counter()
+        deadline = start + self.duration
+
+        if self.rate:
+            self._run_open(deadline)
+        else:
+            self._run_closed(deadline)
+
+        elapsed = time.perf_counter() - start
+        usage_after = process_usage()
+        cpu_seconds = usage_after['cpu_seconds'] - usage_before['cpu_seconds']
+        latencies = sorted(self.latencies)
+
+        return {
+            'mode': f"open(rate={self.rate}/s)" if self.rate else f"closed(users={self.concurrency})",
+            'requests': len(latencies) + self.errors,
+            'errors': self.errors,
+            'elapsed_s': elapsed,
+            'throughput_rps': len(latencies) / elapsed if elapsed > 0 else 0.0,
+            'latency_mean_ms': sum(latencies) / len(latencies) * 1000 if latencies else 0.0,
+            'latency_p50_ms': percentile(latencies, 50) * 1000,
+            'latency_p95_ms': percentile(latencies, 95) * 1000,
+            'latency_p99_ms': percentile(latencies, 99) * 1000,
+            'latency_max_ms': latencies[-1] * 1000 if latencies else 0.0,
+            'cpu_seconds': cpu_seconds,
+            'cpu_percent': cpu_seconds / elapsed * 100 if elapsed > 0 else 0.0,
+            'child_cpu_seconds': usage_after['child_cpu_seconds'],
+            'peak_rss_mb': usage_after['peak_rss_mb'],
+            'child_peak_rss_mb': usage_after['child_peak_rss_mb'],
+        }
+
+
+def print_report(stats: Dict):
+    """打印压测报告"""
+    print("=" * 50)
+    print(f"模式:         {stats['mode']}")
+    print(f"请求数:       {stats['requests']} (失败 {stats['errors']})")
+    print(f"耗时:         {stats['elapsed_s']:.1f}s")
+    print(f"吞吐量:       {stats['throughput_rps']:.2f} 请求/秒")
+    print(f"延迟 平均:    {stats['latency_mean_ms']:.0f}ms")
+    print(f"延迟 p50:     {stats['latency_p50_ms']:.0f}ms")
+    print(f"延迟 p95:     {stats['latency_p95_ms']:.0f}ms")
+    print(f"延迟 p99:     {stats['latency_p99_ms']:.0f}ms")
+    print(f"延迟 最大:    {stats['latency_max_ms']:.0f}ms")
+    print(f"CPU:          {stats['cpu_seconds']:.1f}s ({stats['cpu_percent']:.0f}%)，子进程(Tesseract) {stats['child_cpu_seconds']:.1f}s")
+    print(f"峰值内存:     {stats['peak_rss_mb']:.0f}MB，子进程 {stats['child_peak_rss_mb']:.0f}MB")
+    if 'server_cpu_avg_percent' in stats:
+        print(f"服务端CPU:    平均 {stats['server_cpu_avg_percent']:.0f}%，最高 {stats['server_cpu_max_percent']:.0f}%")
+        print(f"服务端内存:   峰值 {stats['server_peak_rss_mb']:.0f}MB")
+    print("=" * 50)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="酒店预订数据提取压测工具")
+    parser.add_argument('corpus', nargs='+', help="样本图片文件或目录")
+    parser.add_argument('--url', help="HTTP提取服务地址，不指定则在进程内调用提取器")
+    parser.add_argument('--concurrency', type=int, default=4, help="并发用户数（开环模式下为最大在途请求数）")
+    parser.add_argument('--rate', type=float, help="到达率(请求/秒)，指定后使用开环泊松到达")
+    parser.add_argument('--duration', type=float, default=30, help="压测时长(秒)")
+    parser.add_argument('--requests', type=int, help="最大请求数")
+    parser.add_argument('--think-time', type=float, default=0.0, help="闭环模式下用户平均思考时间(秒)")
+    parser.add_argument('--timeout', type=float, default=120, help="HTTP请求超时(秒)")
+    parser.add_argument('--use-cache', action='store_true', help="允许服务端返回缓存的结果（默认跳过缓存）")
+    parser.add_argument('--server-pid', type=int, help="服务端主进程PID，用于采样服务端CPU和内存（需要psutil）")
+    parser.add_argument('--seed', type=int, help="随机种子")
+    parser.add_argument('--json', help="将结果写入JSON文件")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    if not corpus:
+        print("❌ 没有找到样本文件")
+        sys.exit(1)
+
+    target = make_http_target(args.url, args.timeout, args.use_cache) if args.url else make_local_target()
+    print(f"样本数: {len(corpus)}，目标: {args.url or '进程内 extract_data_from_image'}")
+
+    sampler = None
+    if args.server_pid:
+        if PSUTIL_AVAILABLE:
+            sampler = ServerSampler(args.server_pid)
+            sampler.start()
+        else:
+            print("psutil不可用，跳过服务端采样")
+
+    test = LoadTest(target, corpus, args.concurrency, args.duration, rate=args.rate,
+                    think_time=args.think_time, max_requests=args.requests, seed=args.seed)
+    stats = test.run()
+    if sampler:
+        stats.update(sampler.stop())
+
+    print_report(stats)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(stats, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+OCR参数自动调优
+在标注样本上搜索Tesseract的psm/oem、缩放比例、模糊/阈值方式和语言组合，
+按每张图片的耗时和字段级准确率给出帕累托前沿，并把选中的参数写入ocr_profile.json，
+提取器启动时加载
+
+样本目录中每张截图配一个同名JSON标注文件（如 a.png 和 a.json），内容为正确的预订数据，
+格式与提取结果相同（booking_id、arrival、departure、total_rooms、room_types、room_counts、prices、rate_codes）
+
+用法:
+    # 随机抽取40组参数，选准确率最高的一组写入ocr_profile.json
+    python ocr_autotune.py samples/
+
+    # 搜索全部组合，选每张图片2秒以内准确率最高的一组
+    python ocr_autotune.py samples/ --trials 0 --max-latency 2
+
+    # 选准确率不低于95%的最快的一组，只输出结果不写配置
+    python ocr_autotune.py samples/ --min-accuracy 0.95 --dry-run
+"""
+
+import argparse
+import csv
+import itertools
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image
+
+from data_extractor import (CV2_AVAILABLE, DEFAULT_OCR_PROFILE_PATH, TESSERACT_AVAILABLE,
+                            HotelDataExtractor, load_ocr_profile)
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+# 搜索空间。模糊和阈值只在OpenCV可用时生效；oem只搜索LSTM引擎（旧引擎需要额外的训练数据）
+SEARCH_SPACE = {
+    'psm': [3, 4, 6, 11],
+    'oem': [1, 3],
+    'scale': [0.75, 1.0, 1.5, 2.0],
+    'blur': [('none', 0), ('gaussian', 3), ('gaussian', 5), ('median', 3), ('median', 5)],
+    'threshold': ['otsu', 'adaptive', 'none'],
+    'lang': ['chi_sim+eng', 'eng'],
+}
+
+# 参与评分的预订级字段和房型级字段
+BOOKING_FIELDS = ['booking_id', 'arrival', 'departure', 'total_rooms']
+ROOM_FIELDS = ['room_counts', 'prices', 'rate_codes']
+
+
+def load_samples(path: str) -> List[Dict]:
+    """读取样本目录中有标注的截图，图片解码后放在内存中，避免调优时磁盘IO干扰计时"""
+    samples = []
+    for name in sorted(os.listdir(path)):
+        stem, ext = os.path.splitext(name)
+        if ext.lower() not in IMAGE_EXTENSIONS:
+            continue
+        label_path = os.path.join(path, stem + '.json')
+        if not os.path.exists(label_path):
+            print(f"跳过没有标注的样本: {name}")
+            continue
+        with open(label_path, 'r', encoding='utf-8') as f:
+            label = json.load(f)
+        with Image.open(os.path.join(path, name)) as image:
+            image.load()
+            samples.append({'name': name, 'image': image.convert('RGB'), 'label': label})
+    return samples
+
+
+def candidate_profiles(base: Dict, trials: int, seed: int) -> List[Dict]:
+    """生成待评估的参数组合。trials为0时搜索全部组合，否则随机抽取trials组；
+    当前使用的参数总是包含在内，作为比较基准"""
+    space = dict(SEARCH_SPACE)
+    if not CV2_AVAILABLE:
+        space['blur'] = [(base['blur'], base['blur_size'])]
+        space['threshold'] = [base['threshold']]
+
+    keys = list(space)
+    combos = list(itertools.product(*(space[key] for key in keys)))
+    if trials and trials < len(combos):
+        combos = random.Random(seed).sample(combos, trials)
+
+    profiles = [dict(base)]
+    for combo in combos:
+        values = dict(zip(keys, combo))
+        blur, blur_size = values.pop('blur')
+        profile = dict(base, blur=blur, blur_size=blur_size, **values)
+        if profile not in profiles:
+            profiles.append(profile)
+    return profiles
+
+
+def _normalize(value) -> str:
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).replace(' ', '').upper()
+
+
+def score_fields(data: Optional[Dict], label: Dict) -> Tuple[int, int]:
+    """字段级评分，返回(正确字段数, 标注字段数)。
+    房型级字段按房类对齐比较，识别结果中缺少的房类记为错误"""
+    data = data or {}
+    correct = total = 0
+    for field in BOOKING_FIELDS:
+        if field in label:
+            total += 1
+            correct += field in data and _normalize(data[field]) == _normalize(label[field])
+
+    predicted = {}
+    for i, room_type in enumerate(data.get('room_types', [])):
+        predicted[_normalize(room_type)] = {field: data.get(field, [])[i:i + 1] for field in ROOM_FIELDS}
+    for i, room_type in enumerate(label.get('room_types', [])):
+        row = predicted.get(_normalize(room_type), {})
+        for field in ROOM_FIELDS:
+            expected = label.get(field, [])[i:i + 1]
+            if not expected:
+                continue
+            total += 1
+            actual = row.get(field, [])
+            correct += bool(actual) and _normalize(actual[0]) == _normalize(expected[0])
+    return correct, total
+
+
+def evaluate(profile: Dict, samples: List[Dict]) -> Dict:
+    """按一组参数识别全部样本，返回每张图片的平均耗时(秒)、字段级准确率和失败的图片数。
+    与extract_data_from_image使用相同的入口(extract_data_and_ocr)，长截图同样分块识别并逐行解析，
+    但关闭模拟数据兜底：识别出错（如语言包缺失、参数无效）和未提取到数据都记为失败；
+    质量检查不随参数变化，预先完成，不计入耗时"""
+    extractor = HotelDataExtractor(profile)
+    correct = total = 0
+    seconds = 0.0
+    failures = 0
+    for sample in samples:
+        quality = extractor.check_image_quality(sample['image'])
+        started_at = time.perf_counter()
+        try:
+            data, _ = extractor.extract_data_and_ocr(sample['image'], quality, mock_fallback=False)
+        except Exception as e:
+            print(f"识别出错 {sample['name']}: {str(e)}")
+            data = None
+        else:
+            if data is None:
+                print(f"未提取到数据 {sample['name']}")
+        seconds += time.perf_counter() - started_at
+
+        failures += data is None
+        sample_correct, sample_total = score_fields(data, sample['label'])
+        correct += sample_correct
+        total += sample_total
+
+    return {
+        'profile': profile,
+        'seconds_per_image': seconds / len(samples),
+        'accuracy': correct / total if total else 0.0,
+        'failures': failures,
+    }
+
+
+def pareto_frontier(results: List[Dict]) -> List[Dict]:
+    """耗时-准确率的帕累托前沿（不存在又快又准的其他参数），按耗时升序。
+    有样本失败的参数不参与：出错的识别耗时很短，会被误当作最快的参数"""
+    frontier = []
+    valid = [r for r in results if not r['failures']]
+    for result in sorted(valid, key=lambda r: (r['seconds_per_image'], -r['accuracy'])):
+        if not frontier or result['accuracy'] > frontier[-1]['accuracy']:
+            frontier.append(result)
+    return frontier
+
+
+def choose(frontier: List[Dict], max_latency: Optional[float] = None,
+           min_accuracy: Optional[float] = None) -> Optional[Dict]:
+    """从前沿中选择参数：指定min_accuracy时选满足准确率的最快参数，否则选耗时限制内准确率最高的参数"""
+    candidates = [r for r in frontier if max_latency is None or r['seconds_per_image'] <= max_latency]
+    if min_accuracy is not None:
+        candidates = [r for r in candidates if r['accuracy'] >= min_accuracy]
+        return candidates[0] if candidates else None
+    return candidates[-1] if candidates else None
+
+
+def describe(profile: Dict) -> str:
+    blur = profile['blur'] if profile['blur'] == 'none' else f"{profile['blur']}{profile['blur_size']}"
+    return (f"psm={profile['psm']} oem={profile['oem']} scale={profile['scale']} blur={blur} "
+            f"threshold={profile['threshold']} lang={profile['lang']}")
+
+
+def write_profile(path: str, chosen: Dict, frontier: List[Dict], sample_count: int):
+    """写入配置文件，同时记录调优结果便于之后对比"""
+    content = {
+        'profile': chosen['profile'],
+        'accuracy': chosen['accuracy'],
+        'seconds_per_image': chosen['seconds_per_image'],
+        'samples': sample_count,
+        'tuned_at': datetime.now().isoformat(timespec='seconds'),
+        'frontier': [{k: r[k] for k in ('profile', 'accuracy', 'seconds_per_image')} for r in frontier],
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(content, f, ensure_ascii=False, indent=2)
+
+
+def write_report(path: str, results: List[Dict]):
+    """所有参数组合的评估结果写入CSV"""
+    keys = list(results[0]['profile'])
+    with open(path, 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.writer(f)
+        writer.writerow(keys + ['seconds_per_image', 'accuracy', 'failures'])
+        for r in results:
+            writer.writerow([r['profile'][k] for k in keys] + [f"{r['seconds_per_image']:.3f}",
+                                                              f"{r['accuracy']:.4f}", r['failures']])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OCR参数自动调优")
+    parser.add_argument('samples', help="标注样本目录（截图和同名JSON标注）")
+    parser.add_argument('--trials', type=int, default=40, help="随机抽取的参数组数，0表示搜索全部组合")
+    parser.add_argument('--seed', type=int, default=0, help="随机抽样的种子")
+    parser.add_argument('--max-latency', type=float, help="每张图片的耗时上限(秒)")
+    parser.add_argument('--min-accuracy', type=float, help="准确率下限，指定时选满足下限的最快参数")
+    parser.add_argument('--output', default=DEFAULT_OCR_PROFILE_PATH, help="写入的配置文件")
+    parser.add_argument('--report', help="所有参数组合的评估结果CSV")
+    parser.add_argument('--dry-run', action='store_true', help="只输出结果，不写配置文件")
+    args = parser.parse_args()
+
+    if not TESSERACT_AVAILABLE:
+        sys.exit("Tesseract不可用，无法调优")
+    samples = load_samples(args.samples)
+    if not samples:
+        sys.exit("没有带标注的样本")
+
+    profiles = candidate_profiles(load_ocr_profile(args.output), args.trials, args.seed)
+    print(f"样本: {len(samples)}，参数组合: {len(profiles)}")
+    results = []
+    for i, profile in enumerate(profiles, 1):
+        result = evaluate(profile, samples)
+        results.append(result)
+        print(f"[{i}/{len(profiles)}] {describe(profile)}: "
+              f"{result['seconds_per_image']:.2f}s/张，准确率 {result['accuracy']:.1%}，失败 {result['failures']}")
+
+    if args.report:
+        write_report(args.report, results)
+
+    frontier = pareto_frontier(results)
+    baseline = results[0]
+    print("\n帕累托前沿（耗时 / 准确率）:")
+    for r in frontier:
+        print(f"  {r['seconds_per_image']:6.2f}s  {r['accuracy']:6.1%}  {describe(r['profile'])}")
+    print(f"当前参数: {baseline['seconds_per_image']:.2f}s  {baseline['accuracy']:.1%}")
+
+    chosen = choose(frontier, args.max_latency, args.min_accuracy)
+    if chosen is None:
+        sys.exit("没有满足条件的参数组合")
+    print(f"选中: {describe(chosen['profile'])}")
+    if not args.dry_run:
+        write_profile(args.output, chosen, frontier, len(samples))
+        print(f"已写入 {args.output}，重启提取服务后生效；已存储的记录可用 image_archive.py reprocess --force 重新识别")
+
+
+if __name__ == "__main__":
+    main()
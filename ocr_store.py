@@ -0,0 +1,412 @@
+"""
+OCR原文存储
+保存每张图片的OCR原文和单词坐标，并记录解析器/预处理版本号。
+解析逻辑升级后，只需对存储的原文重新解析，无需重新OCR:
+    python ocr_store.py reprocess --workers 4
+
+OCR原文、预订名称、房类和包价代码建有全文索引(FTS5)，由触发器在写入时增量更新:
+    python ocr_store.py search "BRK2 疾控局"
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from typing import Dict, List, Optional, Tuple
+
+from data_extractor import HotelDataExtractor, PARSER_VERSION, PREPROCESSOR_VERSION
+from rate_codes import RateCodeCatalog, split_revenue
+
+DATA_DIR = os.environ.get('EXTRACTOR_DATA_DIR', 'data')
+DEFAULT_STORE_PATH = os.path.join(DATA_DIR, 'ocr.sqlite3')
+
+# 全文索引中各列的来源：预订名称、房类、包价代码从解析结果(JSON)中取出
+SEARCH_VALUES = """
+    new.id, new.filename, json_extract(new.data, '$.booking_id'),
+    (SELECT group_concat(value, ' ') FROM json_each(new.data, '$.room_types')),
+    (SELECT group_concat(value, ' ') FROM json_each(new.data, '$.rate_codes')),
+    new.ocr_text
+"""
+
+# trigram分词支持中文子串搜索，但查询词至少3个字符；
+# 更短的词（如两个字的公司简称）退回逐行匹配，只扫描ocr_search_names中的文件名、预订名称、房类和包价代码
+MIN_MATCH_LENGTH = 3
+SEARCH_NAMES = """
+    new.id, lower(ifnull(new.filename, '') || ' ' || ifnull(json_extract(new.data, '$.booking_id'), '') || ' ' ||
+    ifnull((SELECT group_concat(value, ' ') FROM json_each(new.data, '$.room_types')), '') || ' ' ||
+    ifnull((SELECT group_concat(value, ' ') FROM json_each(new.data, '$.rate_codes')), ''))
+"""
+
+# 搜索结果摘要前后保留的字符数
+SNIPPET_CONTEXT = 30
+
+
+class OCRStore:
+    """基于SQLite的OCR原文存储"""
+
+    def __init__(self, path: str = DEFAULT_STORE_PATH):
+        self.path = path
+        self._local = threading.local()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        conn = self._connect()
+        search_exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'ocr_search'"
+        ).fetchone() is not None
+        # 触发器中的OR REPLACE会被外层语句(UPSERT)的冲突处理覆盖，重复保存同一图片时names表主键冲突。
+        # 旧版触发器在同一事务内删除后按下面的定义重建，多个进程同时打开时不会重复创建
+        outdated = conn.execute("""
+            SELECT name FROM sqlite_master
+            WHERE type = 'trigger' AND name LIKE 'ocr_records_search_%' AND sql LIKE '%OR REPLACE%'
+        """).fetchall()
+        conn.executescript("""
+            BEGIN IMMEDIATE;
+            %(drops)s
+            CREATE TABLE IF NOT EXISTS ocr_records (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                content_hash TEXT NOT NULL UNIQUE,
+                filename TEXT,
+                created_at REAL NOT NULL,
+                ocr_text TEXT NOT NULL,
+                ocr_words TEXT NOT NULL,
+                preprocessor_version INTEGER NOT NULL,
+                parser_version INTEGER NOT NULL,
+                data TEXT,
+                parsed_at REAL,
+                layout_key TEXT,
+                parse_mode TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_ocr_records_parser_version
+                ON ocr_records (parser_version);
+            CREATE INDEX IF NOT EXISTS idx_ocr_records_created_at
+                ON ocr_records (created_at);
+
+            CREATE VIRTUAL TABLE IF NOT EXISTS ocr_search USING fts5(
+                filename, booking_id, room_types, rate_codes, ocr_text,
+                tokenize = 'trigram'
+            );
+            CREATE TABLE IF NOT EXISTS ocr_search_names (
+                id INTEGER PRIMARY KEY,
+                names TEXT NOT NULL
+            );
+            CREATE TRIGGER IF NOT EXISTS ocr_records_search_insert AFTER INSERT ON ocr_records BEGIN
+                DELETE FROM ocr_search_names WHERE id = new.id;
+                INSERT INTO ocr_search (rowid, filename, booking_id, room_types, rate_codes, ocr_text)
+                VALUES (%(values)s);
+                INSERT INTO ocr_search_names (id, names) VALUES (%(names)s);
+            END;
+            CREATE TRIGGER IF NOT EXISTS ocr_records_search_update AFTER UPDATE ON ocr_records BEGIN
+                DELETE FROM ocr_search WHERE rowid = old.id;
+                DELETE FROM ocr_search_names WHERE id = old.id;
+                INSERT INTO ocr_search (rowid, filename, booking_id, room_types, rate_codes, ocr_text)
+                VALUES (%(values)s);
+                INSERT INTO ocr_search_names (id, names) VALUES (%(names)s);
+            END;
+            CREATE TRIGGER IF NOT EXISTS ocr_records_search_delete AFTER DELETE ON ocr_records BEGIN
+                DELETE FROM ocr_search WHERE rowid = old.id;
+                DELETE FROM ocr_search_names WHERE id = old.id;
+            END;
+            COMMIT;
+        """ % {'values': SEARCH_VALUES, 'names': SEARCH_NAMES,
+               'drops': ''.join(f"DROP TRIGGER IF EXISTS {row['name']};" for row in outdated)})
+
+        # 升级前的存储补充版面键列，用于增量识别时查找同一版面的上一张截图
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(ocr_records)")]
+        if 'layout_key' not in columns:
+            conn.execute("ALTER TABLE ocr_records ADD COLUMN layout_key TEXT")
+        # 解析方式，重新解析时使用；升级前的记录为NULL，按整体文本解析
+        if 'parse_mode' not in columns:
+            conn.execute("ALTER TABLE ocr_records ADD COLUMN parse_mode TEXT")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_ocr_records_layout_key ON ocr_records (layout_key, id)")
+
+        # 升级前已有的记录补建索引
+        if not search_exists:
+            conn.execute(f"""
+                INSERT INTO ocr_search (rowid, filename, booking_id, room_types, rate_codes, ocr_text)
+                SELECT {SEARCH_VALUES} FROM ocr_records AS new
+            """)
+            conn.execute(f"""
+                INSERT OR REPLACE INTO ocr_search_names (id, names)
+                SELECT {SEARCH_NAMES} FROM ocr_records AS new
+            """)
+        conn.commit()
+
+    def _connect(self) -> sqlite3.Connection:
+        """每个线程使用独立连接"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def save(self, content_hash: str, filename: str, ocr: Dict, data: Optional[Dict]) -> int:
+        """保存一次OCR结果及解析数据，同一图片重复上传时覆盖，返回记录ID"""
+        conn = self._connect()
+        now = time.time()
+        conn.execute("""
+            INSERT INTO ocr_records (content_hash, filename, created_at, ocr_text, ocr_words,
+                                     preprocessor_version, parser_version, data, parsed_at, layout_key, parse_mode)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(content_hash) DO UPDATE SET
+                filename = excluded.filename,
+                ocr_text = excluded.ocr_text,
+                ocr_words = excluded.ocr_words,
+                preprocessor_version = excluded.preprocessor_version,
+                parser_version = excluded.parser_version,
+                data = excluded.data,
+                parsed_at = excluded.parsed_at,
+                layout_key = ifnull(excluded.layout_key, layout_key),
+                parse_mode = excluded.parse_mode
+        """, (
+            content_hash, filename, now, ocr['text'],
+            json.dumps(ocr.get('words', []), ensure_ascii=False),
+            PREPROCESSOR_VERSION, PARSER_VERSION,
+            json.dumps(data, ensure_ascii=False) if data else None, now, ocr.get('layout_key'),
+            ocr.get('parse_mode')
+        ))
+        conn.commit()
+        row = conn.execute("SELECT id FROM ocr_records WHERE content_hash = ?", (content_hash,)).fetchone()
+        return row['id']
+
+    def get(self, content_hash: str) -> Optional[Dict]:
+        """按图片内容哈希读取记录"""
+        row = self._connect().execute(
+            "SELECT * FROM ocr_records WHERE content_hash = ?", (content_hash,)
+        ).fetchone()
+        return self._to_record(row) if row else None
+
+    def exists(self, content_hash: str) -> bool:
+        """判断图片是否已识别过"""
+        row = self._connect().execute(
+            "SELECT 1 FROM ocr_records WHERE content_hash = ?", (content_hash,)
+        ).fetchone()
+        return row is not None
+
+    def latest_by_layout(self, layout_key: str, exclude: Optional[str] = None) -> Optional[Dict]:
+        """同一版面最近一次识别的记录（预处理版本过期的不算），作为增量识别的比较基准"""
+        row = self._connect().execute("""
+            SELECT * FROM ocr_records
+            WHERE layout_key = ? AND content_hash != ? AND preprocessor_version >= ?
+            ORDER BY id DESC LIMIT 1
+        """, (layout_key, exclude or '', PREPROCESSOR_VERSION)).fetchone()
+        return self._to_record(row) if row else None
+
+    def preprocessor_versions(self) -> Dict[str, int]:
+        """所有记录的预处理版本 {图片内容哈希: 版本}"""
+        rows = self._connect().execute("SELECT content_hash, preprocessor_version FROM ocr_records").fetchall()
+        return {row[0]: row[1] for row in rows}
+
+    def recent(self, limit: int = 50) -> List[Dict]:
+        """读取最近的记录"""
+        rows = self._connect().execute(
+            "SELECT * FROM ocr_records ORDER BY id DESC LIMIT ?", (limit,)
+        ).fetchall()
+        return [self._to_record(row) for row in rows]
+
+    def iter_data(self, batch_size: int = 1000, since: Optional[float] = None, until: Optional[float] = None):
+        """按ID顺序分批读取解析结果，每次产出一批预订数据。since/until限定识别时间范围[since, until)"""
+        last_id = 0
+        conn = self._connect()
+        while True:
+            rows = conn.execute("""
+                SELECT id, data FROM ocr_records
+                WHERE id > ? AND data IS NOT NULL AND created_at >= ? AND created_at < ?
+                ORDER BY id LIMIT ?
+            """, (last_id, since or 0, until or float('inf'), batch_size)).fetchall()
+            if not rows:
+                return
+            last_id = rows[-1]['id']
+            yield [json.loads(row['data']) for row in rows]
+
+    def period_fingerprint(self, since: float, until: float) -> str:
+        """时间范围内记录的指纹（数量、最大ID、最近解析时间），有新增或重新解析时改变"""
+        row = self._connect().execute("""
+            SELECT COUNT(*), MAX(id), MAX(parsed_at) FROM ocr_records
+            WHERE created_at >= ? AND created_at < ?
+        """, (since, until)).fetchone()
+        return f"{row[0]}:{row[1] or 0}:{row[2] or 0}"
+
+    def stale_batch(self, after_id: int, limit: int) -> List[Dict]:
+        """读取解析器版本过期的一批记录（只取ID、原文和解析方式）"""
+        rows = self._connect().execute("""
+            SELECT id, created_at, ocr_text, parse_mode FROM ocr_records
+            WHERE parser_version < ? AND id > ?
+            ORDER BY id LIMIT ?
+        """, (PARSER_VERSION, after_id, limit)).fetchall()
+        return [dict(row) for row in rows]
+
+    def update_parsed(self, results: List[Dict]):
+        """批量写回重新解析的结果"""
+        now = time.time()
+        conn = self._connect()
+        conn.executemany(
+            "UPDATE ocr_records SET data = ?, parser_version = ?, parsed_at = ? WHERE id = ?",
+            [(json.dumps(r['data'], ensure_ascii=False) if r['data'] else None, PARSER_VERSION, now, r['id'])
+             for r in results]
+        )
+        conn.commit()
+
+    def version_counts(self) -> Dict:
+        """统计过期记录数量"""
+        conn = self._connect()
+        total = conn.execute("SELECT COUNT(*) FROM ocr_records").fetchone()[0]
+        stale_parser = conn.execute(
+            "SELECT COUNT(*) FROM ocr_records WHERE parser_version < ?", (PARSER_VERSION,)
+        ).fetchone()[0]
+        stale_preprocessor = conn.execute(
+            "SELECT COUNT(*) FROM ocr_records WHERE preprocessor_version < ?", (PREPROCESSOR_VERSION,)
+        ).fetchone()[0]
+        return {'total': total, 'stale_parser': stale_parser, 'stale_preprocessor': stale_preprocessor}
+
+    def search(self, query: str, limit: int = 20, offset: int = 0,
+               since: Optional[float] = None) -> Tuple[int, List[Dict]]:
+        """全文搜索，多个词之间为AND关系，按时间倒序分页。
+        返回(匹配总数, 本页结果)，结果只含摘要，不含完整原文和单词坐标"""
+        terms = query.split()
+        if not terms:
+            return 0, []
+
+        conditions, params = [], []
+        match_terms = [term for term in terms if len(term) >= MIN_MATCH_LENGTH]
+        if match_terms:
+            conditions.append("ocr_search MATCH ?")
+            params.append(' '.join('"%s"' % term.replace('"', '""') for term in match_terms))
+        for term in terms:
+            if len(term) < MIN_MATCH_LENGTH:
+                conditions.append("s.rowid IN (SELECT id FROM ocr_search_names WHERE instr(names, lower(?)) > 0)")
+                params.append(term)
+        if since is not None:
+            conditions.append("r.created_at >= ?")
+            params.append(since)
+
+        where = ' AND '.join(conditions)
+        conn = self._connect()
+        total = conn.execute(f"""
+            SELECT COUNT(*) FROM ocr_search AS s JOIN ocr_records AS r ON r.id = s.rowid
+            WHERE {where}
+        """, params).fetchone()[0]
+        rows = conn.execute(f"""
+            SELECT r.id, r.content_hash, r.filename, r.created_at, s.booking_id, s.rate_codes, s.ocr_text
+            FROM ocr_search AS s JOIN ocr_records AS r ON r.id = s.rowid
+            WHERE {where}
+            ORDER BY s.rowid DESC LIMIT ? OFFSET ?
+        """, params + [limit, offset]).fetchall()
+
+        results = []
+        for row in rows:
+            result = dict(row)
+            result['snippet'] = self._snippet(result.pop('ocr_text'), terms)
+            results.append(result)
+        return total, results
+
+    def _snippet(self, text: str, terms: List[str]) -> str:
+        """原文中第一个命中词前后的片段"""
+        lowered = text.lower()
+        positions = [p for p in (lowered.find(term.lower()) for term in terms) if p >= 0]
+        if not positions:
+            return text[:SNIPPET_CONTEXT * 2].replace('\n', ' ')
+        start = max(0, min(positions) - SNIPPET_CONTEXT)
+        snippet = text[start:min(positions) + SNIPPET_CONTEXT].replace('\n', ' ')
+        return ('…' if start > 0 else '') + snippet + '…'
+
+    def _to_record(self, row: sqlite3.Row) -> Dict:
+        record = dict(row)
+        record['ocr_words'] = json.loads(record['ocr_words'])
+        record['data'] = json.loads(record['data']) if record['data'] else None
+        return record
+
+
+# 每个子进程各自持有一个提取器
+_worker_extractor = None
+
+
+def _parse_batch(batch: List[Dict]) -> List[Dict]:
+    """在子进程中重新解析一批OCR原文"""
+    global _worker_extractor
+    if _worker_extractor is None:
+        _worker_extractor = HotelDataExtractor()
+    # 按识别时的解析方式解析，到达/离开日期的年份按截图识别时间推断
+    return [{'id': record['id'],
+             'data': _worker_extractor.parse_ocr_text(record['ocr_text'], record['parse_mode'],
+                                                      date.fromtimestamp(record['created_at']))}
+            for record in batch]
+
+
+def reprocess_stale(store: OCRStore, workers: int = None, batch_size: int = 200) -> int:
+    """并行重新解析所有解析器版本过期的记录，返回处理的记录数。
+    每批解析完成后立即写回，中断后再次运行会从剩余的过期记录继续。"""
+    workers = workers or os.cpu_count() or 1
+    processed = 0
+    last_id = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while True:
+            # 每轮读取若干批并行解析，避免一次性把全部原文读入内存
+            batches = []
+            for _ in range(workers * 2):
+                batch = store.stale_batch(last_id, batch_size)
+                if not batch:
+                    break
+                batches.append(batch)
+                last_id = batch[-1]['id']
+            if not batches:
+                break
+
+            for results in pool.map(_parse_batch, batches):
+                store.update_parsed(results)
+                processed += len(results)
+            print(f"已重新解析 {processed} 条记录")
+
+    return processed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OCR原文存储管理")
+    parser.add_argument('command', choices=['status', 'reprocess', 'search', 'revenue'])
+    parser.add_argument('query', nargs='?', default='', help="搜索关键词（search命令）")
+    parser.add_argument('--path', default=DEFAULT_STORE_PATH, help="存储文件路径")
+    parser.add_argument('--workers', type=int, help="并行进程数，默认为CPU核心数")
+    parser.add_argument('--batch-size', type=int, default=200)
+    args = parser.parse_args()
+
+    store = OCRStore(args.path)
+    if args.command == 'search':
+        start = time.perf_counter()
+        total, results = store.search(args.query)
+        print(f"共 {total} 条匹配，耗时 {(time.perf_counter() - start) * 1000:.1f}ms")
+        for result in results:
+            print(f"[{result['id']}] {result['filename']} {result['booking_id'] or ''}: {result['snippet']}")
+        return
+
+    if args.command == 'revenue':
+        # 所有已存储预订的客房收入与包价收入
+        catalog = RateCodeCatalog.load()
+        # 存储为空时没有批次可合并，按空列表计算得到全零的合计
+        batches = [split_revenue(batch, catalog) for batch in store.iter_data(args.batch_size * 5)]
+        totals = pd.concat(batches) if batches else split_revenue([], catalog)
+        print(f"预订数: {len(totals)}，总销售额: ¥{totals['total'].sum():,.2f}，"
+              f"客房收入: ¥{totals['room_revenue'].sum():,.2f}，包价收入: ¥{totals['package_revenue'].sum():,.2f}，"
+              f"含早: {totals['breakfasts'].sum()} 份")
+        return
+
+    counts = store.version_counts()
+    print(f"记录总数: {counts['total']}，解析器版本过期: {counts['stale_parser']}，"
+          f"预处理版本过期(需重新OCR): {counts['stale_preprocessor']}")
+
+    if args.command == 'reprocess':
+        start = time.perf_counter()
+        processed = reprocess_stale(store, args.workers, args.batch_size)
+        print(f"完成，共重新解析 {processed} 条记录，耗时 {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+房价异常检测
+按(房类, 预订类型)维护房价的运行均值和方差（Welford算法），每识别一个预订只更新对应的几行统计，
+不需要重新扫描历史数据。分析时价格偏离均值超过Z_THRESHOLD个标准差的房型会被标记
+（如JKN的700.00误录为70.00）。被标记的价格先作为待确认价格保存，不计入统计；
+有足够多的预订以相近的价格被标记时视为调价，把这些价格计入统计，之后的同价预订不再被标记。
+
+统计保存在SQLite中，每个预订的更新在一个写事务内完成，多个进程可以同时写入。
+同一预订同一房型只保留最后一次的价格：重复上传不会重复计数，修改后重新截图时先撤销旧价格的贡献
+
+用法:
+    python rate_anomaly.py status
+    python rate_anomaly.py rebuild      # 从OCR存储中的历史预订重建统计
+"""
+
+import argparse
+import math
+import os
+import sqlite3
+import threading
+from typing import Dict, List, Optional
+
+from ocr_store import DATA_DIR
+
+DEFAULT_STATS_PATH = os.path.join(DATA_DIR, 'rate_stats.sqlite3')
+
+# 偏离均值超过该倍数的标准差时标记为异常
+Z_THRESHOLD = 3.0
+
+# 样本数少于该值时统计不可靠，不做判断（先退回只按房类的统计）
+MIN_SAMPLES = 10
+
+# 标准差下限（占均值的比例），避免历史价格完全相同时任何调价都被标记
+MIN_STD_RATIO = 0.02
+
+# 只按房类统计时的预订类型
+ALL_TYPES = '*'
+
+# 同一统计下至少CONFIRM_BOOKINGS个预订的待确认价格彼此相差不超过CONFIRM_TOLERANCE（占价格的比例）时，
+# 视为调价而不是误录
+CONFIRM_BOOKINGS = 3
+CONFIRM_TOLERANCE = 0.05
+
+# Welford增量更新：右侧表达式使用更新前的count/mean
+_ADD_SQL = """
+    INSERT INTO rate_stats (room_type, booking_type, count, mean, m2) VALUES (?, ?, 1, ?, 0)
+    ON CONFLICT(room_type, booking_type) DO UPDATE SET
+        count = count + 1,
+        mean = mean + (excluded.mean - mean) / (count + 1),
+        m2 = m2 + (excluded.mean - mean) * (excluded.mean - (mean + (excluded.mean - mean) / (count + 1)))
+"""
+
+# Welford逆运算，撤销一个价格的贡献（只剩一个样本的统计另行删除）
+_REMOVE_SQL = """
+    UPDATE rate_stats SET
+        count = count - 1,
+        mean = (count * mean - ?1) / (count - 1),
+        m2 = max(0.0, m2 - (?1 - mean) * (?1 - (count * mean - ?1) / (count - 1)))
+    WHERE room_type = ?2 AND booking_type = ?3 AND count > 1
+"""
+
+
+class RateAnomalyDetector:
+    """按(房类, 预订类型)的房价运行统计"""
+
+    def __init__(self, path: str = DEFAULT_STATS_PATH):
+        self.path = path
+        self._local = threading.local()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        conn = self._connect()
+        # 旧格式按(预订, 房类, 价格)去重，改价前的价格仍留在统计中且无法撤销，清空后从历史记录重建
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(rate_observations)")]
+        if columns and 'counted' not in columns:
+            conn.executescript("DROP TABLE rate_observations; DROP TABLE IF EXISTS rate_stats;")
+            print("房价统计格式已更新，请运行 python rate_anomaly.py rebuild 重建统计")
+
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS rate_stats (
+                room_type TEXT NOT NULL,
+                booking_type TEXT NOT NULL,
+                count INTEGER NOT NULL,
+                mean REAL NOT NULL,
+                m2 REAL NOT NULL,
+                PRIMARY KEY (room_type, booking_type)
+            );
+            -- 每个预订每个房型最后一次的价格，counted=0为待确认（被标记，未计入统计）
+            CREATE TABLE IF NOT EXISTS rate_observations (
+                booking_id TEXT NOT NULL,
+                room_type TEXT NOT NULL,
+                booking_type TEXT NOT NULL,
+                price REAL NOT NULL,
+                counted INTEGER NOT NULL,
+                PRIMARY KEY (booking_id, room_type)
+            );
+            CREATE INDEX IF NOT EXISTS idx_rate_observations_pending
+                ON rate_observations (room_type, booking_type, price) WHERE counted = 0;
+        """)
+        conn.commit()
+
+    def _connect(self) -> sqlite3.Connection:
+        """每个线程使用独立连接"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def stats(self, room_type: str, booking_type: str) -> Optional[Dict]:
+        """房类在该预订类型下的统计，样本不足时退回只按房类的统计，仍不足时返回None"""
+        rows = self._connect().execute(
+            "SELECT * FROM rate_stats WHERE room_type = ? AND booking_type IN (?, ?)",
+            (room_type, booking_type, ALL_TYPES)
+        ).fetchall()
+        rows = {row['booking_type']: row for row in rows}
+        for key in (booking_type, ALL_TYPES):
+            row = rows.get(key)
+            if row is not None and row['count'] >= MIN_SAMPLES:
+                std = math.sqrt(row['m2'] / (row['count'] - 1))
+                return {'booking_type': key, 'count': row['count'], 'mean': row['mean'],
+                        'std': max(std, row['mean'] * MIN_STD_RATIO)}
+        return None
+
+    def check(self, data: Dict, booking_type: str) -> List[Dict]:
+        """检查一个预订各房型的价格，返回异常列表（房类、价格、预期范围、偏离的标准差倍数）"""
+        anomalies = []
+        for room_type, price in zip(data['room_types'], data['prices']):
+            stats = self.stats(room_type, booking_type)
+            if stats is None:
+                continue
+            z = (price - stats['mean']) / stats['std']
+            if abs(z) > Z_THRESHOLD:
+                anomalies.append({
+                    'room_type': room_type,
+                    'price': price,
+                    'mean': stats['mean'],
+                    'low': max(0.0, stats['mean'] - Z_THRESHOLD * stats['std']),
+                    'high': stats['mean'] + Z_THRESHOLD * stats['std'],
+                    'z': z,
+                    'samples': stats['count'],
+                    'basis': booking_type if stats['booking_type'] != ALL_TYPES else '全部类型',
+                })
+        return anomalies
+
+    @staticmethod
+    def _add(conn: sqlite3.Connection, room_type: str, booking_type: str, price: float):
+        for key in (booking_type, ALL_TYPES):
+            conn.execute(_ADD_SQL, (room_type, key, price))
+
+    @staticmethod
+    def _remove(conn: sqlite3.Connection, room_type: str, booking_type: str, price: float):
+        for key in (booking_type, ALL_TYPES):
+            conn.execute("DELETE FROM rate_stats WHERE room_type = ? AND booking_type = ? AND count <= 1",
+                         (room_type, key))
+            conn.execute(_REMOVE_SQL, (price, room_type, key))
+
+    def _confirm(self, conn: sqlite3.Connection, room_type: str, booking_type: str, price: float, accepted: bool):
+        """与price相近的待确认价格来自至少CONFIRM_BOOKINGS个预订，或price本身已通过检查（accepted）时，
+        视为调价，全部计入统计"""
+        rows = conn.execute("""
+            SELECT booking_id, price FROM rate_observations
+            WHERE room_type = ? AND booking_type = ? AND counted = 0 AND price BETWEEN ? AND ?
+        """, (room_type, booking_type, price * (1 - CONFIRM_TOLERANCE), price * (1 + CONFIRM_TOLERANCE))).fetchall()
+        if not rows or (not accepted and len(rows) < CONFIRM_BOOKINGS):
+            return
+        for row in rows:
+            conn.execute("UPDATE rate_observations SET counted = 1 WHERE booking_id = ? AND room_type = ?",
+                         (row['booking_id'], room_type))
+            self._add(conn, room_type, booking_type, row['price'])
+
+    def observe(self, data: Dict, booking_type: str, flagged: Optional[List[str]] = None):
+        """把一个预订的房价计入统计。flagged中的房类（被标记的价格）作为待确认价格保存，确认为调价后才计入。
+        同一预订同一房型只保留最后一次的价格，价格变化时先撤销旧价格的贡献"""
+        conn = self._connect()
+        flagged = set(flagged or [])
+        with conn:
+            # 先取得写锁，避免两个进程同时处理同一预订时都按旧记录更新
+            conn.execute("BEGIN IMMEDIATE")
+            for room_type, price in zip(data['room_types'], data['prices']):
+                price = float(price)
+                counted = room_type not in flagged
+                previous = conn.execute(
+                    "SELECT booking_type, price, counted FROM rate_observations WHERE booking_id = ? AND room_type = ?",
+                    (data['booking_id'], room_type)
+                ).fetchone()
+                if previous is not None:
+                    # 价格未变时保留已计入的价格（统计变化后重新检查可能被标记）
+                    if previous['price'] == price and (previous['counted'] or not counted):
+                        continue
+                    if previous['counted']:
+                        self._remove(conn, room_type, previous['booking_type'], previous['price'])
+                conn.execute("""
+                    INSERT OR REPLACE INTO rate_observations (booking_id, room_type, booking_type, price, counted)
+                    VALUES (?, ?, ?, ?, ?)
+                """, (data['booking_id'], room_type, booking_type, price, int(counted)))
+                if counted:
+                    self._add(conn, room_type, booking_type, price)
+                self._confirm(conn, room_type, booking_type, price, accepted=counted)
+
+    def check_and_observe(self, data: Dict, booking_type: str) -> List[Dict]:
+        """分析时调用：先检查再计入统计，异常价格待确认"""
+        anomalies = self.check(data, booking_type)
+        self.observe(data, booking_type, flagged=[a['room_type'] for a in anomalies])
+        return anomalies
+
+    def pending(self) -> List[Dict]:
+        """待确认价格（房类、预订类型、预订数、价格范围）"""
+        rows = self._connect().execute("""
+            SELECT room_type, booking_type, COUNT(*) AS bookings, MIN(price) AS low, MAX(price) AS high
+            FROM rate_observations WHERE counted = 0
+            GROUP BY room_type, booking_type ORDER BY room_type, booking_type
+        """).fetchall()
+        return [dict(row) for row in rows]
+
+    def summary(self) -> List[Dict]:
+        """所有统计（房类、预订类型、样本数、均值、标准差）"""
+        rows = self._connect().execute(
+            "SELECT * FROM rate_stats ORDER BY room_type, booking_type"
+        ).fetchall()
+        return [{'room_type': row['room_type'], 'booking_type': row['booking_type'], 'count': row['count'],
+                 'mean': row['mean'], 'std': math.sqrt(row['m2'] / (row['count'] - 1)) if row['count'] > 1 else 0.0}
+                for row in rows]
+
+    def clear(self):
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM rate_stats")
+            conn.execute("DELETE FROM rate_observations")
+
+
+def describe_anomaly(anomaly: Dict) -> str:
+    return (f"{anomaly['room_type']} 定价 {anomaly['price']:.2f} 超出预期范围 "
+            f"{anomaly['low']:.0f}~{anomaly['high']:.0f}（{anomaly['basis']}，{anomaly['samples']} 个样本）")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="房价异常检测统计")
+    parser.add_argument('command', choices=['status', 'rebuild'])
+    parser.add_argument('--path', default=DEFAULT_STATS_PATH, help="统计文件路径")
+    args = parser.parse_args()
+
+    detector = RateAnomalyDetector(args.path)
+    if args.command == 'rebuild':
+        from data_extractor import HotelDataExtractor
+        from ocr_store import OCRStore
+
+        extractor = HotelDataExtractor()
+        detector.clear()
+        flagged = 0
+        for batch in OCRStore().iter_data():
+            for data in batch:
+                flagged += len(detector.check_and_observe(data, extractor.determine_booking_type(data['booking_id'])))
+        print(f"重建完成，标记异常价格 {flagged} 个")
+
+    for row in detector.summary():
+        print(f"{row['room_type']:>6} {row['booking_type']:<4} 样本 {row['count']:>5}  "
+              f"均值 {row['mean']:8.2f}  标准差 {row['std']:7.2f}")
+    for row in detector.pending():
+        print(f"{row['room_type']:>6} {row['booking_type']:<4} 待确认 {row['bookings']} 个预订  "
+              f"价格 {row['low']:.2f}~{row['high']:.2f}")
+
+
+if __name__ == "__main__":
+    main()
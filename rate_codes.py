@@ -0,0 +1,141 @@
+"""
+包价代码目录
+'BRK2, NSV'之类的包价代码由多个代码组成，每个代码对应含早份数、包含的服务和包价项目。
+目录编译为按代码编号索引的数组，一批预订的所有房型行一次性查表，
+把销售额拆分为客房收入和包价收入，不在每个预订上循环
+"""
+
+import json
+import os
+import re
+import numpy as np
+import pandas as pd
+from typing import Dict, Iterable, List, Optional, Sequence
+
+DEFAULT_CATALOG_PATH = os.environ.get('RATE_CODE_CATALOG_PATH', 'rate_codes.json')
+
+# 默认目录，可用rate_codes.json覆盖或补充（早餐单价请按酒店实际价格修改）
+DEFAULT_CATALOG = {
+    'breakfast_price': 88.0,
+    'codes': {
+        'BRK1': {'name': '单早', 'breakfast': 1, 'services': [], 'packages': {}},
+        'BRK2': {'name': '双早', 'breakfast': 2, 'services': [], 'packages': {}},
+        'NSV': {'name': '免服务费', 'breakfast': 0, 'services': ['免服务费'], 'packages': {}},
+    }
+}
+
+# 包价字段中代码之间的分隔符
+CODE_SEPARATORS = r'[,\s/;，]+'
+
+
+class RateCodeCatalog:
+    """编译后的包价代码目录。
+    每个代码一个编号，breakfast/package_amount为按编号索引的数组，
+    包价字符串（可能含多个代码）先拆分为代码再按字符串汇总，相同字符串只计算一次"""
+
+    def __init__(self, catalog: Optional[Dict] = None):
+        catalog = catalog or DEFAULT_CATALOG
+        self.breakfast_price = float(catalog.get('breakfast_price', 0.0))
+        self.codes = {code.upper(): spec for code, spec in catalog['codes'].items()}
+        self.index = {code: i for i, code in enumerate(self.codes)}
+
+        # 每个代码每间夜的含早份数和包价金额（早餐按份数乘单价，其他项目按目录金额）
+        self.breakfast = np.array([spec.get('breakfast', 0) for spec in self.codes.values()], dtype=np.int32)
+        self.package_amount = np.array([
+            spec.get('breakfast', 0) * self.breakfast_price + sum(spec.get('packages', {}).values())
+            for spec in self.codes.values()
+        ], dtype=np.float64)
+        self._compiled = {}  # 包价字符串 -> (含早份数, 包价金额, 代码列表, 未知代码列表)
+
+    @classmethod
+    def load(cls, path: str = DEFAULT_CATALOG_PATH) -> 'RateCodeCatalog':
+        """加载目录，rate_codes.json中的代码覆盖或补充默认目录"""
+        catalog = {'breakfast_price': DEFAULT_CATALOG['breakfast_price'], 'codes': dict(DEFAULT_CATALOG['codes'])}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                custom = json.load(f)
+            catalog['breakfast_price'] = custom.get('breakfast_price', catalog['breakfast_price'])
+            catalog['codes'].update(custom.get('codes', {}))
+        return cls(catalog)
+
+    def split_codes(self, rate_code: str) -> List[str]:
+        """'BRK2, NSV' -> ['BRK2', 'NSV']"""
+        return [code for code in re.split(CODE_SEPARATORS, rate_code.upper()) if code]
+
+    def _compile(self, rate_code: str) -> tuple:
+        if rate_code not in self._compiled:
+            codes = self.split_codes(rate_code or '')
+            known = [self.index[code] for code in codes if code in self.index]
+            self._compiled[rate_code] = (
+                int(self.breakfast[known].sum()),
+                float(self.package_amount[known].sum()),
+                codes,
+                [code for code in codes if code not in self.index],
+            )
+        return self._compiled[rate_code]
+
+    def lookup(self, rate_codes: Sequence[str]) -> pd.DataFrame:
+        """批量查表，返回每行的含早份数和每间夜包价金额"""
+        keys, uniques = pd.factorize(pd.Series(rate_codes, dtype=object).fillna(''))
+        compiled = [self._compile(rate_code) for rate_code in uniques]
+        breakfast = np.array([c[0] for c in compiled], dtype=np.int32)
+        package_amount = np.array([c[1] for c in compiled], dtype=np.float64)
+        return pd.DataFrame({'breakfast': breakfast[keys], 'package_amount': package_amount[keys]})
+
+    def describe(self, rate_code: str) -> Dict:
+        """包价字符串的含义：含早份数、服务、包价项目和未知代码"""
+        breakfast, package_amount, codes, unknown = self._compile(rate_code)
+        known = [code for code in codes if code in self.codes]
+        specs = [self.codes[code] for code in known]
+        return {
+            'names': [spec.get('name', code) for code, spec in zip(known, specs)],
+            'breakfast': breakfast,
+            'services': [service for spec in specs for service in spec.get('services', [])],
+            'packages': [package for spec in specs for package in spec.get('packages', {})],
+            'package_amount': package_amount,
+            'unknown': unknown,
+        }
+
+
+def room_lines(bookings: Iterable[Dict]) -> pd.DataFrame:
+    """把一批预订的房型明细展开为一张表，每行一个房型，booking为预订序号"""
+    bookings = list(bookings)
+    lengths = np.array([len(data['room_types']) for data in bookings], dtype=np.int64)
+    rate_codes = []
+    for data, length in zip(bookings, lengths):
+        codes = list(data.get('rate_codes', []))[:length]
+        rate_codes.extend(codes + [''] * (length - len(codes)))
+    return pd.DataFrame({
+        'booking': np.repeat(np.arange(len(bookings)), lengths),
+        'room_type': [room_type for data in bookings for room_type in data['room_types']],
+        'room_count': np.array([c for data in bookings for c in data['room_counts']], dtype=np.float64),
+        'price': np.array([p for data in bookings for p in data['prices']], dtype=np.float64),
+        'rate_code': rate_codes,
+    })
+
+
+def split_revenue(bookings: Iterable[Dict], catalog: Optional[RateCodeCatalog] = None) -> pd.DataFrame:
+    """按预订拆分每晚销售额：total = room_revenue + package_revenue。
+    包价金额不超过房价；未在目录中的代码不计入包价"""
+    bookings = list(bookings)
+    catalog = catalog or RateCodeCatalog.load()
+    lines = room_lines(bookings)
+    packages = catalog.lookup(lines['rate_code'])
+
+    counts = lines['room_count'].to_numpy()
+    prices = lines['price'].to_numpy()
+    package_per_room = np.minimum(packages['package_amount'].to_numpy(), prices)
+
+    n = len(bookings)
+    booking = lines['booking'].to_numpy()
+    total = np.bincount(booking, weights=counts * prices, minlength=n)
+    package_revenue = np.bincount(booking, weights=counts * package_per_room, minlength=n)
+    breakfasts = np.bincount(booking, weights=counts * packages['breakfast'].to_numpy(), minlength=n)
+
+    return pd.DataFrame({
+        'booking_id': [data['booking_id'] for data in bookings],
+        'total': total,
+        'room_revenue': total - package_revenue,
+        'package_revenue': package_revenue,
+        'breakfasts': breakfasts.astype(np.int64),
+    })
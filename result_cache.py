@@ -0,0 +1,73 @@
+"""
+提取结果缓存
+以文件内容哈希为键，将提取结果保存在SQLite中，多个gunicorn worker进程共享同一份缓存
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+
+DEFAULT_CACHE_PATH = os.path.join(os.environ.get('EXTRACTOR_CACHE_DIR', '.cache'), 'results.sqlite3')
+
+
+def content_hash(content: bytes) -> str:
+    """计算文件内容哈希"""
+    return hashlib.sha256(content).hexdigest()
+
+
+class ResultCache:
+    """基于SQLite的提取结果缓存，可跨进程共享"""
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_entries: int = 5000):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        conn = self._connect()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                payload TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+        """)
+        conn.commit()
+
+    def _connect(self) -> sqlite3.Connection:
+        """每个线程使用独立连接，WAL模式允许多进程并发读写"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[Dict]:
+        """读取缓存结果"""
+        row = self._connect().execute(
+            "SELECT payload FROM results WHERE key = ?", (key,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key: str, value: Dict):
+        """写入缓存结果，超过上限时删除最旧的条目"""
+        conn = self._connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO results (key, payload, created_at) VALUES (?, ?, ?)",
+            (key, json.dumps(value, ensure_ascii=False), time.time())
+        )
+        conn.execute("""
+            DELETE FROM results WHERE key IN (
+                SELECT key FROM results ORDER BY created_at DESC LIMIT -1 OFFSET ?
+            )
+        """, (self.max_entries,))
+        conn.commit()
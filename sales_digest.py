@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+每日销售汇总
+从OCR存储中取出一段时间内识别的全部预订，一次性生成每个预订的"新增...团队...销售"总结语句，
+按预订类型分组并汇总房数、间夜和收入，输出为文本、Markdown和Excel。
+汇总结果按时间范围缓存（记录有新增或重新解析时失效），重复查看不再重新计算
+
+用法:
+    # 生成昨天的汇总，写入data/digests
+    python sales_digest.py run
+
+    # 指定日期范围
+    python sales_digest.py run --from 2024-12-01 --to 2024-12-07
+
+    # 每天08:00生成前一天的汇总
+    python sales_digest.py schedule --at 08:00
+"""
+
+import argparse
+import io
+import os
+import time
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from booking_dates import bookings_frame
+from data_extractor import PARSER_VERSION, HotelDataExtractor
+from ocr_store import DATA_DIR, OCRStore
+from rate_codes import room_lines, split_revenue
+from result_cache import ResultCache
+
+DEFAULT_DIGEST_DIR = os.path.join(DATA_DIR, 'digests')
+DEFAULT_DIGEST_TIME = os.environ.get('SALES_DIGEST_TIME', '08:00')
+DIGEST_FORMATS = ('txt', 'md', 'xlsx')
+
+TOTAL_COLUMNS = ['预订数', '房数', '间夜', '销售额', '客房收入', '包价收入']
+
+
+def period_bounds(start: date, end: date) -> Tuple[float, float]:
+    """日期范围[start, end]（含两端）对应的时间戳范围"""
+    since = datetime.combine(start, datetime.min.time()).timestamp()
+    until = datetime.combine(end + timedelta(days=1), datetime.min.time()).timestamp()
+    return since, until
+
+
+def period_label(start: date, end: date) -> str:
+    return start.isoformat() if start == end else f"{start.isoformat()} ~ {end.isoformat()}"
+
+
+def booking_types(booking_ids: pd.Series, patterns: Dict[str, str]) -> np.ndarray:
+    """按前缀批量确定预订类型，规则与determine_booking_type相同（按顺序第一个匹配的前缀）"""
+    ids = booking_ids.astype(str)
+    conditions = [ids.str.startswith(prefix).to_numpy() for prefix in patterns]
+    return np.select(conditions, list(patterns.values()), default='团队')
+
+
+def summary_lines(bookings: List[Dict], extractor: HotelDataExtractor) -> pd.DataFrame:
+    """一次性生成一批预订的总结语句（格式与generate_summary相同）及房数、间夜、收入"""
+    frame = bookings_frame(bookings)
+    frame['类型'] = booking_types(frame['booking_id'], extractor.booking_type_patterns)
+
+    # 房型明细按房数从多到少拼接，如"25DKN(520)20EKN(580)"
+    lines = room_lines(bookings)
+    lines['detail'] = (lines['room_count'].map('{:g}'.format) + lines['room_type'].astype(str) + '(' +
+                       np.round(lines['price'].to_numpy()).astype(np.int64).astype(str) + ')')
+    lines = lines.sort_values(['booking', 'room_count'], ascending=[True, False], kind='stable')
+    details = lines.groupby('booking')['detail'].agg(''.join).reindex(range(len(bookings)), fill_value='')
+
+    arrival = frame['arrival_at'].dt.strftime('%m/%d').fillna(frame['arrival'])
+    departure = frame['departure_at'].dt.strftime('%m/%d').fillna(frame['departure'])
+    summary = ('新增' + frame['类型'] + '团队' + frame['booking_id'].astype(str) + ' ' + arrival + '-' + departure +
+               ' ' + details.to_numpy() + ' 销售')
+
+    revenue = split_revenue(bookings, extractor.rate_catalog)
+    return pd.DataFrame({
+        '类型': frame['类型'],
+        '预订': frame['booking_id'],
+        '总结': summary,
+        '房数': frame['total_rooms'],
+        '间夜': frame['room_nights'].fillna(0).astype(np.int64),
+        '销售额': revenue['total'],
+        '客房收入': revenue['room_revenue'],
+        '包价收入': revenue['package_revenue'],
+    })
+
+
+def summarize_totals(details: pd.DataFrame) -> pd.DataFrame:
+    """按预订类型汇总（销售额从高到低），最后一行为合计"""
+    totals = details.groupby('类型').agg(
+        预订数=('预订', 'size'), 房数=('房数', 'sum'), 间夜=('间夜', 'sum'),
+        销售额=('销售额', 'sum'), 客房收入=('客房收入', 'sum'), 包价收入=('包价收入', 'sum'),
+    ).sort_values('销售额', ascending=False)
+    totals.loc['合计'] = totals.sum()
+    return totals.reset_index()
+
+
+def load_bookings(store: OCRStore, since: float, until: float) -> List[Dict]:
+    """时间范围内识别的预订，同一预订多次截图时只取最后一次"""
+    latest = {}
+    for batch in store.iter_data(since=since, until=until):
+        for data in batch:
+            latest.pop(data['booking_id'], None)
+            latest[data['booking_id']] = data
+    return list(latest.values())
+
+
+def build_digest(store: OCRStore, start: date, end: Optional[date] = None,
+                 extractor: Optional[HotelDataExtractor] = None, cache: Optional[ResultCache] = None) -> Dict:
+    """生成日期范围内的销售汇总。结果按(时间范围, 记录指纹, 解析器版本)缓存"""
+    end = end or start
+    since, until = period_bounds(start, end)
+    cache = cache or ResultCache()
+    key = f"digest:{start.isoformat()}:{end.isoformat()}:{store.period_fingerprint(since, until)}:{PARSER_VERSION}"
+    digest = cache.get(key)
+    if digest is not None:
+        return digest
+
+    bookings = load_bookings(store, since, until)
+    if bookings:
+        details = summary_lines(bookings, extractor or HotelDataExtractor())
+        totals = summarize_totals(details)
+    else:
+        details = pd.DataFrame(columns=['类型', '预订', '总结', '房数', '间夜', '销售额', '客房收入', '包价收入'])
+        totals = pd.DataFrame(columns=['类型'] + TOTAL_COLUMNS)
+    digest = {
+        'period': period_label(start, end),
+        'details': details.to_dict('records'),
+        'totals': totals.to_dict('records'),
+    }
+    digest['text'] = to_text(digest)
+    digest['markdown'] = to_markdown(digest)
+    cache.set(key, digest)
+    return digest
+
+
+def _type_order(digest: Dict) -> List[Dict]:
+    return [row for row in digest['totals'] if row['类型'] != '合计']
+
+
+def _total_line(row: Dict) -> str:
+    return (f"预订 {int(row['预订数'])} 个，房数 {int(row['房数'])}，间夜 {int(row['间夜'])}，"
+            f"销售额 ¥{row['销售额']:,.2f}（客房 ¥{row['客房收入']:,.2f}，包价 ¥{row['包价收入']:,.2f}）")
+
+
+def to_text(digest: Dict) -> str:
+    """公告用的纯文本"""
+    if not digest['details']:
+        return f"{digest['period']} 没有新增预订"
+    lines = [f"{digest['period']} 销售汇总：{_total_line(digest['totals'][-1])}"]
+    for group in _type_order(digest):
+        lines.append("")
+        lines.append(f"【{group['类型']}】{_total_line(group)}")
+        lines.extend(row['总结'] for row in digest['details'] if row['类型'] == group['类型'])
+    return "\n".join(lines)
+
+
+def to_markdown(digest: Dict) -> str:
+    """Markdown：汇总表 + 按类型分组的总结语句"""
+    lines = [f"## {digest['period']} 销售汇总", ""]
+    if not digest['details']:
+        return "\n".join(lines + ["没有新增预订"])
+    lines.append("| 类型 | " + " | ".join(TOTAL_COLUMNS) + " |")
+    lines.append("|" + "---|" * (len(TOTAL_COLUMNS) + 1))
+    for row in digest['totals']:
+        values = [f"{int(row[c])}" for c in TOTAL_COLUMNS[:3]] + [f"¥{row[c]:,.2f}" for c in TOTAL_COLUMNS[3:]]
+        lines.append(f"| {row['类型']} | " + " | ".join(values) + " |")
+    for group in _type_order(digest):
+        lines.extend(["", f"### {group['类型']}", ""])
+        lines.extend(f"- {row['总结']}" for row in digest['details'] if row['类型'] == group['类型'])
+    return "\n".join(lines)
+
+
+def to_excel(digest: Dict) -> bytes:
+    """Excel：汇总和明细两个工作表"""
+    buffer = io.BytesIO()
+    with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
+        pd.DataFrame(digest['totals'], columns=['类型'] + TOTAL_COLUMNS).to_excel(writer, sheet_name='汇总', index=False)
+        pd.DataFrame(digest['details']).to_excel(writer, sheet_name='明细', index=False)
+    return buffer.getvalue()
+
+
+def write_digest(digest: Dict, directory: str = DEFAULT_DIGEST_DIR, formats=DIGEST_FORMATS) -> List[str]:
+    """把汇总写入目录，文件名为时间范围，返回写入的文件"""
+    os.makedirs(directory, exist_ok=True)
+    name = digest['period'].replace(' ~ ', '_')
+    paths = []
+    for fmt in formats:
+        path = os.path.join(directory, f"{name}.{fmt}")
+        if fmt == 'xlsx':
+            with open(path, 'wb') as f:
+                f.write(to_excel(digest))
+        else:
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(digest['markdown'] if fmt == 'md' else digest['text'])
+        paths.append(path)
+    return paths
+
+
+def next_run(at: str, now: datetime) -> datetime:
+    """下一次运行时间（今天的at已过则为明天）"""
+    hour, minute = (int(v) for v in at.split(':'))
+    run_at = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    return run_at if run_at > now else run_at + timedelta(days=1)
+
+
+def run_schedule(store: OCRStore, at: str, directory: str, formats):
+    """每天在at时刻生成前一天的汇总，Ctrl+C退出"""
+    extractor = HotelDataExtractor()
+    while True:
+        run_at = next_run(at, datetime.now())
+        print(f"下一次生成: {run_at:%Y-%m-%d %H:%M}")
+        time.sleep(max(0.0, (run_at - datetime.now()).total_seconds()))
+        day = run_at.date() - timedelta(days=1)
+        try:
+            paths = write_digest(build_digest(store, day, extractor=extractor), directory, formats)
+            print(f"已生成 {day.isoformat()} 汇总: {', '.join(paths)}")
+        except Exception as e:
+            print(f"生成汇总失败: {str(e)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="每日销售汇总")
+    parser.add_argument('command', choices=['run', 'schedule'])
+    parser.add_argument('--from', dest='start', type=date.fromisoformat, help="开始日期，默认昨天")
+    parser.add_argument('--to', dest='end', type=date.fromisoformat, help="结束日期，默认与开始日期相同")
+    parser.add_argument('--at', default=DEFAULT_DIGEST_TIME, help="schedule每天的生成时间(HH:MM)")
+    parser.add_argument('--output', default=DEFAULT_DIGEST_DIR, help="输出目录")
+    parser.add_argument('--formats', default=','.join(DIGEST_FORMATS), help="输出格式，逗号分隔(txt,md,xlsx)")
+    args = parser.parse_args()
+
+    store = OCRStore()
+    formats = [fmt for fmt in args.formats.split(',') if fmt]
+    if args.command == 'schedule':
+        run_schedule(store, args.at, args.output, formats)
+        return
+
+    start = args.start or date.today() - timedelta(days=1)
+    digest = build_digest(store, start, args.end or start)
+    print(digest['text'])
+    print(f"\n已写入: {', '.join(write_digest(digest, args.output, formats))}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+进程间图片传输
+批量OCR时把解码后的图片放入共享内存，工作进程只收到共享内存名称、形状和类型，
+直接在共享内存上建立NumPy视图，不用pickle复制整幅图片。
+共享内存由父进程创建和释放：任务完成（或失败）后立即unlink，同时在共享内存中的图片数量有上限。
+父进程的RSS包含在途的共享内存，比pickle方式高，省下的是工作进程反序列化出的副本，看各进程PSS之和
+
+对比pickle传输的耗时和内存:
+    python shared_images.py --count 40 --size 1600x4000 --workers 4
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, ProcessPoolExecutor, wait
+from contextlib import contextmanager
+from multiprocessing import resource_tracker, shared_memory
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+# resource只在Unix上可用，没有时基准测试不报告峰值RSS
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+class SharedImage:
+    """放在共享内存中的一幅图片（uint8数组），父进程持有，用完后调用release释放"""
+
+    def __init__(self, pixels: np.ndarray):
+        self.shm = shared_memory.SharedMemory(create=True, size=max(pixels.nbytes, 1))
+        self.shape = pixels.shape
+        self.dtype = pixels.dtype.str
+        view = np.ndarray(pixels.shape, dtype=pixels.dtype, buffer=self.shm.buf)
+        view[...] = pixels
+        del view
+        self._released = False
+
+    @property
+    def ref(self) -> Tuple[str, tuple, str]:
+        """传给工作进程的引用（共享内存名称、形状、类型）"""
+        return self.shm.name, self.shape, self.dtype
+
+    def release(self):
+        """关闭并删除共享内存。已挂载的工作进程仍可读到退出为止"""
+        if self._released:
+            return
+        self._released = True
+        self.shm.close()
+        self.shm.unlink()
+
+    def __enter__(self) -> 'SharedImage':
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def share_resource_tracker():
+    """创建进程池之前调用：先启动resource_tracker，工作进程（fork、spawn、forkserver）都与父进程共用它。
+    否则在此之前fork出的工作进程挂载共享内存时会各自启动一个，工作进程退出时把父进程的共享内存
+    当作泄漏报告并删除"""
+    if os.name == 'posix':
+        resource_tracker.ensure_running()
+
+
+@contextmanager
+def attach(ref: Tuple[str, tuple, str]) -> Iterator[np.ndarray]:
+    """在工作进程中挂载共享内存，得到只读NumPy视图，退出时关闭映射（不删除）。
+    共享内存由父进程登记和释放：3.13起挂载时不登记；更早的版本挂载时也会登记，
+    但与父进程共用resource_tracker（见share_resource_tracker），重复登记不产生泄漏记录"""
+    name, shape, dtype = ref
+    if sys.version_info >= (3, 13):
+        shm = shared_memory.SharedMemory(name=name, track=False)
+    else:
+        shm = shared_memory.SharedMemory(name=name)
+    try:
+        view = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        view.flags.writeable = False
+        yield view
+    finally:
+        view = None
+        try:
+            shm.close()
+        except BufferError:
+            # 调用方仍持有视图（如未释放的Image），映射在其回收时释放
+            pass
+
+
+# 每个工作进程各自持有一个提取器
+_worker_extractor = None
+
+
+def _ocr_shared(ref: Tuple[str, tuple, str]) -> Tuple[Optional[Dict], Dict]:
+    """在工作进程中识别共享内存中的图片"""
+    global _worker_extractor
+    if _worker_extractor is None:
+        from data_extractor import HotelDataExtractor
+        _worker_extractor = HotelDataExtractor()
+    with attach(ref) as pixels:
+        image = Image.fromarray(pixels)
+        try:
+            return _worker_extractor.extract_data_and_ocr(image)
+        finally:
+            image.close()
+            del image
+
+
+def _collect(pending: Dict, return_when: str) -> Iterator[Tuple]:
+    done, _ = wait(list(pending), return_when=return_when)
+    for future in done:
+        key, shared = pending.pop(future)
+        shared.release()
+        error = future.exception()
+        yield key, None if error else future.result(), error
+
+
+def map_shared(pool: ProcessPoolExecutor, func: Callable, items: Iterable[Tuple[str, np.ndarray]],
+               window: int) -> Iterator[Tuple]:
+    """把每个数组放入共享内存后提交func(ref)，按完成顺序产出(key, 结果, 异常)。
+    pool应在share_resource_tracker之后创建。同时在共享内存中的数组最多window个；中途停止迭代时释放尚未完成任务的共享内存
+    （已挂载的工作进程仍可读到任务结束）"""
+    pending = {}
+    try:
+        for key, pixels in items:
+            shared = SharedImage(pixels)
+            try:
+                pending[pool.submit(func, shared.ref)] = (key, shared)
+            except BaseException:
+                shared.release()
+                raise
+            if len(pending) >= window:
+                yield from _collect(pending, FIRST_COMPLETED)
+        while pending:
+            yield from _collect(pending, ALL_COMPLETED)
+    finally:
+        for _, shared in pending.values():
+            shared.release()
+
+
+def image_pixels(image: Image.Image) -> np.ndarray:
+    if image.mode not in ('L', 'RGB'):
+        image = image.convert('RGB')
+    return np.asarray(image)
+
+
+def ocr_in_workers(images: Iterable[Tuple[str, Image.Image]], workers: Optional[int] = None) -> Iterator[Tuple]:
+    """在多个工作进程中OCR一批图片，按完成顺序产出(key, (data, ocr), error)。
+    同时在共享内存中的图片最多workers+1张：每个工作进程一张，另备一张供最先空闲的进程接着处理"""
+    workers = workers or os.cpu_count() or 1
+    share_resource_tracker()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        yield from map_shared(pool, _ocr_shared, ((key, image_pixels(image)) for key, image in images), workers + 1)
+
+
+def _checksum_pickled(pixels: np.ndarray) -> int:
+    return int(pixels.sum(dtype=np.uint64))
+
+
+def _checksum_shared(ref: Tuple[str, tuple, str]) -> int:
+    with attach(ref) as pixels:
+        return int(pixels.sum(dtype=np.uint64))
+
+
+def _pss_mb(pid: int) -> Optional[float]:
+    """进程的PSS（与其他进程共享的页按共享进程数均摊），各进程相加即为实际占用的内存。只在Linux上可用"""
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            for line in f:
+                if line.startswith('Pss:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+class MemorySampler:
+    """在后台线程中定时采样一组进程的PSS之和，记录峰值。
+    RSS把共享内存页重复计入每个挂载它的进程，比较两种传输方式的内存占用要看PSS之和"""
+
+    def __init__(self, pids: List[int], interval: float = 0.005):
+        self.pids = pids
+        self.interval = interval
+        self.peak_mb = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            values = [_pss_mb(pid) for pid in self.pids]
+            if any(v is None for v in values):
+                return
+            self.peak_mb = max(self.peak_mb or 0.0, sum(values))
+            self._stop.wait(self.interval)
+
+    def __enter__(self) -> 'MemorySampler':
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def run_benchmark(mode: str, count: int, width: int, height: int, workers: int) -> Dict:
+    """向工作进程传输count张图片，工作进程读取全部像素（求和），统计耗时和内存。
+    total_peak_pss_mb为父进程和工作进程PSS之和的峰值（共享内存只计一次），不含启动时的基线"""
+    pixels = np.random.default_rng(0).integers(0, 256, (height, width, 3), dtype=np.uint8)
+    share_resource_tracker()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # 先启动全部工作进程，不计入耗时和内存
+        list(pool.map(int, range(workers)))
+        pids = [os.getpid()] + [process.pid for process in multiprocessing.active_children()]
+        baseline = [_pss_mb(pid) for pid in pids]
+        with MemorySampler(pids) as sampler:
+            started_at = time.perf_counter()
+            if mode == 'pickle':
+                results = list(pool.map(_checksum_pickled, [pixels] * count))
+            else:
+                items = ((i, pixels) for i in range(count))
+                results = [result for _, result, _ in map_shared(pool, _checksum_shared, items, workers + 1)]
+            elapsed = time.perf_counter() - started_at
+    assert len(set(results)) == 1
+    total_peak = None
+    if sampler.peak_mb is not None and None not in baseline:
+        total_peak = sampler.peak_mb - sum(baseline)
+    rss = {}
+    if resource is not None:
+        # Linux下ru_maxrss单位为KB，macOS下为字节
+        rss_unit = 1 if sys.platform == 'darwin' else 1024
+        rss = {
+            'parent_peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * rss_unit / 1024 / 1024,
+            'worker_peak_rss_mb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * rss_unit / 1024 / 1024,
+        }
+    return {
+        'mode': mode,
+        'per_image_ms': elapsed / count * 1000,
+        'mb_per_second': pixels.nbytes * count / elapsed / 1024 / 1024,
+        'image_mb': pixels.nbytes / 1024 / 1024,
+        'total_peak_pss_mb': total_peak,
+        **rss,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="比较共享内存和pickle传输图片到工作进程的开销")
+    parser.add_argument('--count', type=int, default=40, help="图片数量")
+    parser.add_argument('--size', default='1600x4000', help="图片尺寸(宽x高)")
+    parser.add_argument('--workers', type=int, default=4, help="工作进程数")
+    parser.add_argument('--mode', choices=['pickle', 'shared'], help="只运行一种方式（输出JSON）")
+    args = parser.parse_args()
+    width, height = (int(v) for v in args.size.split('x'))
+
+    if args.mode:
+        print(json.dumps(run_benchmark(args.mode, args.count, width, height, args.workers)))
+        return
+
+    # 每种方式在独立进程中运行，峰值内存互不影响
+    print(f"{args.count}张 {width}x{height} RGB图片，{args.workers}个工作进程")
+    for mode in ('pickle', 'shared'):
+        output = subprocess.run([sys.executable, __file__, '--mode', mode, '--count', str(args.count),
+                                 '--size', args.size, '--workers', str(args.workers)],
+                                capture_output=True, text=True, check=True).stdout
+        r = json.loads(output.strip().splitlines()[-1])
+        line = f"{mode:>7}: 每张 {r['per_image_ms']:.1f}ms，{r['mb_per_second']:.0f}MB/s"
+        if r['total_peak_pss_mb'] is not None:
+            line += f"，传输占用内存峰值(PSS合计) {r['total_peak_pss_mb']:.0f}MB"
+        if 'parent_peak_rss_mb' in r:
+            line += f"，父进程峰值RSS {r['parent_peak_rss_mb']:.0f}MB，工作进程峰值RSS {r['worker_peak_rss_mb']:.0f}MB"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+长截图增量识别的回归测试
+用确定的"OCR"代替Tesseract：按文字行的像素签名查出渲染时的行文本，不需要安装Tesseract
+"""
+
+import hashlib
+import string
+
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw
+
+import data_extractor
+from data_extractor import TILE_THRESHOLD, HotelDataExtractor
+from delta_ocr import QUANT_SHIFT, row_bands
+
+ROW_HEIGHT = 30
+ROW_COUNT = 100
+QUALITY = {'status': 'ok', 'enhance': False, 'reasons': []}
+
+
+def room_types():
+    letters = string.ascii_uppercase
+    return ['R' + a + b for a in letters for b in letters][:ROW_COUNT]
+
+
+def row_text(room_type: str, count: int) -> str:
+    return f"R CON25625/abc {room_type} {count} 520.00 12/19 18:00 12/21 12:00 2"
+
+
+def signature(gray: np.ndarray) -> bytes:
+    return hashlib.blake2b((gray >> QUANT_SHIFT).tobytes(), digest_size=8).digest()
+
+
+class FakeOCR:
+    """按行的像素签名识别渲染过的行，被分块切断的行识别不出"""
+
+    def __init__(self):
+        self.lines = {}
+
+    def render(self, rows):
+        image = Image.new('L', (900, ROW_HEIGHT * len(rows) + 20), 255)
+        draw = ImageDraw.Draw(image)
+        for index, text in enumerate(rows):
+            draw.text((10, 10 + index * ROW_HEIGHT), text, fill=0)
+        gray = np.asarray(image)
+        for top, bottom in row_bands(gray):
+            line = gray[top:bottom]
+            self.lines[signature(line)] = (text_at(rows, top), bottom - top)
+        return image.convert('RGB')
+
+    def run_ocr(self, image, quality=None, strategy=None, timeout=0):
+        gray = np.asarray(image.convert('L'))
+        words, lines = [], []
+        for index, (top, bottom) in enumerate(row_bands(gray)):
+            found = self.lines.get(signature(gray[top:bottom]))
+            if found is None:
+                continue
+            lines.append(found[0])
+            left = 10
+            for text in found[0].split():
+                words.append({'text': text, 'left': left, 'top': top, 'width': 8 * len(text),
+                              'height': found[1], 'conf': 95.0, 'line': (1, 1, index)})
+                left += 8 * len(text) + 6
+        return {'text': '\n'.join(lines), 'words': words}
+
+
+def text_at(rows, top):
+    return rows[(top - 10 + ROW_HEIGHT // 2) // ROW_HEIGHT]
+
+
+@pytest.fixture
+def extractor(monkeypatch):
+    monkeypatch.setattr(data_extractor, 'TESSERACT_AVAILABLE', True)
+    extractor = HotelDataExtractor()
+    ocr = FakeOCR()
+    monkeypatch.setattr(extractor, 'run_ocr', ocr.run_ocr)
+    extractor.fake_ocr = ocr
+    return extractor
+
+
+def test_tall_recapture_counts_each_row_once(extractor):
+    types = room_types()
+    counts = [1 + i % 3 for i in range(ROW_COUNT)]
+    before = extractor.fake_ocr.render([row_text(t, c) for t, c in zip(types, counts)])
+    assert before.size[1] > TILE_THRESHOLD
+
+    data, ocr = extractor.extract_data_and_ocr_tiled([before], QUALITY)
+    assert data['total_rooms'] == sum(counts)
+
+    counts[40] += 1
+    after = extractor.fake_ocr.render([row_text(t, c) for t, c in zip(types, counts)])
+    previous = {'content_hash': 'before', 'ocr_words': ocr['words']}
+    data, delta_ocr = extractor.extract_data_and_ocr_delta(after, before, previous, QUALITY)
+
+    assert delta_ocr['delta']['changed_bands'] == 1
+    assert data['total_rooms'] == sum(counts)
+    assert data['room_counts'][data['room_types'].index(types[40])] == counts[40]
+
+
+def test_recapture_of_record_stored_with_overlap_duplicates(extractor):
+    """更新前保存的分块结果中重叠区域的行有两份（行号带不同的块号）"""
+    types = room_types()
+    counts = [2] * ROW_COUNT
+    before = extractor.fake_ocr.render([row_text(t, c) for t, c in zip(types, counts)])
+    _, ocr = extractor.extract_data_and_ocr_tiled([before], QUALITY)
+    duplicated = [dict(word, line=('dup',) + tuple(word['line'])) for word in ocr['words']
+                  if 1500 <= word['top'] < 1700]
+
+    counts[10] = 5
+    after = extractor.fake_ocr.render([row_text(t, c) for t, c in zip(types, counts)])
+    previous = {'content_hash': 'before', 'ocr_words': ocr['words'] + duplicated}
+    data, _ = extractor.extract_data_and_ocr_delta(after, before, previous, QUALITY)
+
+    assert data['total_rooms'] == sum(counts)
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+监控文件夹自动识别
+监控前台保存PMS截图的共享文件夹，新图片写入完成后自动识别并存入OCR存储，界面中即可查看结果:
+    python watch_folder.py /shared/screenshots --workers 2
+
+优先使用watchdog(inotify)接收文件事件，不可用时退回定时扫描。
+"""
+
+import argparse
+import hashlib
+import io
+import os
+import queue
+import threading
+import time
+from typing import List
+
+from PIL import Image
+
+from data_extractor import HotelDataExtractor
+from delta_ocr import extract_incremental
+from image_archive import ImageArchive
+from ocr_store import OCRStore
+from rate_anomaly import RateAnomalyDetector, describe_anomaly
+
+# 尝试导入watchdog，如果失败则使用定时扫描
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+    WATCHDOG_AVAILABLE = True
+except ImportError:
+    WATCHDOG_AVAILABLE = False
+    print("watchdog不可用，将使用定时扫描监控文件夹")
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+
+def file_hash(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """分块计算文件哈希，不把整个文件读入内存"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+if WATCHDOG_AVAILABLE:
+    class _EventHandler(FileSystemEventHandler):
+        """将文件事件转交给守护进程"""
+
+        def __init__(self, daemon: 'WatchFolderDaemon'):
+            self.daemon = daemon
+
+        def on_created(self, event):
+            if not event.is_directory:
+                self.daemon.notify(event.src_path)
+
+        def on_modified(self, event):
+            if not event.is_directory:
+                self.daemon.notify(event.src_path)
+
+        def on_moved(self, event):
+            if not event.is_directory:
+                self.daemon.notify(event.dest_path)
+
+
+class WatchFolderDaemon:
+    """文件夹监控守护进程。
+    新文件先进入待定表，大小和修改时间在debounce秒内不再变化才视为写入完成；
+    写入完成的文件按内容哈希去重后放入有界队列，由工作线程识别。
+    队列满时监控线程阻塞等待，待定表只保存路径，因此突发大量文件也不会耗尽内存。"""
+
+    def __init__(self, directories: List[str], store: OCRStore = None, workers: int = 2,
+                 queue_size: int = 16, debounce: float = 2.0, poll_interval: float = 1.0,
+                 use_watchdog: bool = True):
+        self.directories = [os.path.abspath(d) for d in directories]
+        self.store = store or OCRStore()
+        self.archive = ImageArchive()
+        self.workers = workers
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.use_watchdog = use_watchdog and WATCHDOG_AVAILABLE
+
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.pending = {}  # 路径 -> (大小, 修改时间, 最后变化时间)
+        self.seen = {}  # 路径 -> (大小, 修改时间)，已处理过的文件
+        self.in_flight = set()  # 已入队但尚未处理完的内容哈希
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.stats = {'queued': 0, 'processed': 0, 'duplicates': 0, 'failed': 0}
+
+        self.extractor = HotelDataExtractor()
+        self.rate_detector = RateAnomalyDetector()
+        self._threads = []
+        self._observer = None
+
+    def notify(self, path: str):
+        """登记可能有变化的文件"""
+        if not path.lower().endswith(IMAGE_EXTENSIONS):
+            return
+        with self.lock:
+            if path not in self.pending:
+                self.pending[path] = (-1, -1, time.monotonic())
+
+    def scan(self):
+        """扫描监控目录，登记所有图片文件（定时扫描模式及启动时使用）"""
+        for directory in self.directories:
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                            stat = entry.stat()
+                            if self.seen.get(entry.path) != (stat.st_size, stat.st_mtime):
+                                self.notify(entry.path)
+            except FileNotFoundError:
+                print(f"监控目录不存在: {directory}")
+
+    def _stable_files(self) -> List[str]:
+        """检查待定文件，返回已写入完成的文件"""
+        now = time.monotonic()
+        stable = []
+        with self.lock:
+            for path, (size, mtime, changed_at) in list(self.pending.items()):
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    del self.pending[path]
+                    continue
+                current = (stat.st_size, stat.st_mtime)
+                if current != (size, mtime):
+                    self.pending[path] = current + (now,)
+                elif stat.st_size > 0 and now - changed_at >= self.debounce:
+                    del self.pending[path]
+                    if self.seen.get(path) != current:
+                        self.seen[path] = current
+                        stable.append(path)
+        return stable
+
+    def _enqueue(self, path: str):
+        """按内容哈希去重后放入工作队列，队列满时阻塞"""
+        try:
+            digest = file_hash(path)
+        except OSError as e:
+            print(f"读取文件失败: {path}: {str(e)}")
+            return
+
+        with self.lock:
+            if digest in self.in_flight:
+                self.stats['duplicates'] += 1
+                return
+        if self.store.exists(digest):
+            self.stats['duplicates'] += 1
+            return
+
+        with self.lock:
+            self.in_flight.add(digest)
+        while not self.stop_event.is_set():
+            try:
+                self.queue.put((path, digest), timeout=1)
+                self.stats['queued'] += 1
+                return
+            except queue.Full:
+                continue
+
+    def _watch_loop(self):
+        """监控线程：定时扫描或处理事件，把写入完成的文件放入队列"""
+        last_scan = 0.0
+        while not self.stop_event.is_set():
+            if not self.use_watchdog and time.monotonic() - last_scan >= self.poll_interval:
+                self.scan()
+                last_scan = time.monotonic()
+            for path in self._stable_files():
+                self._enqueue(path)
+            self.stop_event.wait(min(self.poll_interval, self.debounce / 2))
+
+    def _worker_loop(self):
+        """工作线程：识别图片并存入OCR存储"""
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                return
+            path, digest = item
+            try:
+                with open(path, 'rb') as f:
+                    content = f.read()
+                self.archive.put(digest, content)
+                with Image.open(io.BytesIO(content)) as image:
+                    image.load()
+                    data, ocr = extract_incremental(self.extractor, self.store, self.archive, image, digest)
+                self.store.save(digest, os.path.basename(path), ocr, data)
+                if data:
+                    booking_type = self.extractor.determine_booking_type(data['booking_id'])
+                    for anomaly in self.rate_detector.check_and_observe(data, booking_type):
+                        print(f"定价异常: {data['booking_id']}: {describe_anomaly(anomaly)}")
+                self.stats['processed'] += 1
+                print(f"已识别: {path} -> {data['booking_id'] if data else '无数据'}")
+            except Exception as e:
+                self.stats['failed'] += 1
+                print(f"识别失败: {path}: {str(e)}")
+            finally:
+                with self.lock:
+                    self.in_flight.discard(digest)
+                self.queue.task_done()
+
+    def start(self):
+        """启动监控和工作线程"""
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self._worker_loop, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+        # 启动时先处理目录中已有的文件
+        self.scan()
+
+        if self.use_watchdog:
+            self._observer = Observer()
+            handler = _EventHandler(self)
+            for directory in self.directories:
+                self._observer.schedule(handler, directory, recursive=False)
+            self._observer.start()
+
+        watcher = threading.Thread(target=self._watch_loop, daemon=True)
+        watcher.start()
+        self._threads.append(watcher)
+        print(f"开始监控: {', '.join(self.directories)} "
+              f"({'inotify' if self.use_watchdog else '定时扫描'}, {self.workers}个工作线程)")
+
+    def stop(self):
+        """停止监控，等待队列中已有的文件处理完"""
+        self.stop_event.set()
+        if self._observer:
+            self._observer.stop()
+            self._observer.join()
+        for _ in range(self.workers):
+            self.queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="监控文件夹并自动识别预订截图")
+    parser.add_argument('directories', nargs='+', help="监控的目录")
+    parser.add_argument('--workers', type=int, default=2, help="识别工作线程数")
+    parser.add_argument('--queue-size', type=int, default=16, help="工作队列长度上限")
+    parser.add_argument('--debounce', type=float, default=2.0, help="文件多少秒不再变化视为写入完成")
+    parser.add_argument('--poll-interval', type=float, default=1.0, help="定时扫描间隔(秒)")
+    parser.add_argument('--polling', action='store_true', help="强制使用定时扫描")
+    args = parser.parse_args()
+
+    daemon = WatchFolderDaemon(args.directories, workers=args.workers, queue_size=args.queue_size,
+                               debounce=args.debounce, poll_interval=args.poll_interval,
+                               use_watchdog=not args.polling)
+    daemon.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print("正在停止...")
+        daemon.stop()
+        print(f"统计: {daemon.stats}")
+
+
+if __name__ == "__main__":
+    main()